@@ -1,10 +1,12 @@
-from abod import ABOD
+from _config import get_config, set_config, config_context
+
+from abod import ABOD, LBABOD
 from neighborhood import LOF, COF
 
 from kse import KSE
 
 from oversampling_pca import OversamplingPCA
 
-from iforest import IForest
+from iforest import IForest, StreamingIForest
 
 from density_estimation import ParzenWindow
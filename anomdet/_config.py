@@ -0,0 +1,69 @@
+"""Package-wide configuration of anomdet"""
+
+from contextlib import contextmanager
+
+import numpy as np
+
+_global_config = {
+    'dtype': np.float64,
+}
+
+
+def get_config():
+    '''
+    Retrieve the current values of the configuration set by `set_config`.
+
+    Returns
+    -------
+    config : dict
+        Keys are parameter names that can be passed to `set_config`.
+    '''
+    return _global_config.copy()
+
+
+def set_config(dtype=None):
+    '''
+    Set package-wide configuration.
+
+    Parameters
+    ----------
+    dtype : {np.float64, np.float32}, optional (default=None)
+        Floating point type of the distance, kernel and affinity matrices
+        and the intermediate arrays computed from them. np.float32 halves
+        the memory of the (n_samples, n_samples) matrices of KPCA,
+        StochasticOutlierSelection and RandomWalkOutlier, and of the
+        neighborhood graphs. If None, the current value is kept.
+
+        Scores computed in float32 differ from the float64 scores by
+        roughly the float32 machine epsilon (1e-7) times the conditioning
+        of the detector. Use `anomdet.utils.check_dtype_precision` to
+        measure the difference on your own data before relying on it.
+    '''
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("dtype should be np.float32 or np.float64!")
+        _global_config['dtype'] = dtype.type
+
+
+@contextmanager
+def config_context(**new_config):
+    '''
+    Context manager for package-wide configuration.
+
+    Parameters
+    ----------
+    Same as `set_config`. The previous configuration is restored on exit.
+
+    Examples
+    --------
+    >>> with config_context(dtype=np.float32):
+    ...     scores = KPCA(sigma=1., n_eigval=10).fit(X).predict(X)
+    '''
+    old_config = get_config()
+    set_config(**new_config)
+
+    try:
+        yield
+    finally:
+        set_config(**old_config)
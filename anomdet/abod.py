@@ -1,55 +1,250 @@
 from .base import BaseAnomalyDetector
 
-from sklearn.neighbors import NearestNeighbors
+from sklearn.metrics.pairwise import euclidean_distances
 import numpy as np
-from numpy.linalg import norm
+
+from .neighborhood import NeighborhoodGraph
+
+
+def _pair_sums(diff):
+    '''
+    Sums over the pairs of difference vectors of each point, used in the
+    weighted variance of the angles.
+
+    For a pair of difference vectors b, c the angle term is
+    x = <b, c> / (|b|^2 |c|^2), weighted by w = 1 / (|b| |c|). All the dot
+    products of a point come from one (k, k) Gram matrix.
+
+    Parameters
+    ----------
+    diff : array, shape (n_points, k, n_features)
+        Difference vectors from each point to its k neighbors.
+
+    Returns
+    -------
+    sum_wx2, sum_wx, sum_w : arrays, shape (n_points,)
+        Sums of w * x**2, w * x and w over the pairs of distinct neighbors.
+    '''
+    gram = np.einsum('ijd,ikd->ijk', diff, diff)
+    sq_norms = np.einsum('ijj->ij', gram)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = 1. / np.sqrt(sq_norms[:, :, None] * sq_norms[:, None, :])
+        x = gram * w**2
+
+    # Each unordered pair once
+    pairs = np.triu(np.ones(gram.shape[1:], dtype=bool), 1)
+    w, x = w[:, pairs], x[:, pairs]
+    return (w * x**2).sum(axis=1), (w * x).sum(axis=1), w.sum(axis=1)
+
+
+def _weighted_variance(sum_wx2, sum_wx, sum_w):
+    return sum_wx2 / sum_w - (sum_wx / sum_w)**2
+
+
+def _exact_abof(X, rows):
+    '''
+    ABOF of X[rows] over all pairs of the other points, in closed form.
+
+    With u_b = b / |b|^3 and M_b = b b^T / |b|^5 for every difference
+    vector b, w * x = <u_b, u_c> and w * x**2 = <M_b, M_c>, so the sums over
+    all pairs follow from the sums of u_b and M_b, e.g.
+    sum_{b<c} <u_b, u_c> = (|sum_b u_b|^2 - sum_b |u_b|^2) / 2. This takes
+    O(n d^2) per point instead of O(n^2 d).
+    '''
+    n = X.shape[0]
+    abof = np.empty(len(rows))
+    for i, row in enumerate(rows):
+        diff = X[np.arange(n) != row] - X[row]
+        norms = np.sqrt((diff**2).sum(axis=1))
+
+        u = diff / norms[:, None]**3
+        M = np.dot(diff.T, diff / norms[:, None]**5)
+        sum_wx = (u.sum(axis=0).dot(u.sum(axis=0)) - (u**2).sum()) / 2.
+        sum_wx2 = ((M**2).sum() - (norms**-6).sum()) / 2.
+        sum_w = ((1. / norms).sum()**2 - (norms**-2).sum()) / 2.
+
+        abof[i] = _weighted_variance(sum_wx2, sum_wx, sum_w)
+    return abof
+
 
 class ABOD(BaseAnomalyDetector):
     '''
     Angle Based Outlier Detector
-    
+
     Uses the fast ABOD algorithm of "Angle-Based Outlier Detection in High-dimensional Data In KDD2008"
     [Hans-Peter, Kriegel Matthias, Schubert Arthur Zimek]
+
+    The angles of each point are taken over the pairs of its n_k - 1
+    nearest neighbors, found with a kNN index. The dot products of a batch
+    of points come from one Gram matrix per point, and the weighted
+    variance of the angles is computed in closed form.
+
+    Parameters
+    ----------
+    n_k : int, optional (default=10)
+        Size of the neighborhood, including the point itself.
+
+    batch_size : int, optional (default=10000)
+        Bounds the number of neighbor pairs, batch * n_k**2, processed at a
+        time.
     '''
-    
-    def __init__(self, n_k):
+
+    def __init__(self, n_k=10, batch_size=10000):
         self.n_k = n_k
-    
+        self.batch_size = batch_size
+
     def predict(self, A):
         '''
         Predict anomaly scores for dataset X
         '''
-        #import pdb;pdb.set_trace()
         num_instances = A.shape[0]
-        var_array = []
         n_k = min(self.n_k, num_instances)
-        
-        for i in range(num_instances):
-            var_front = 0
-            var_back = 0
-            denominator = 0
-            Temp = A[i, :] - A
-            Temp = np.sum(Temp**2, axis=1)
-            index = np.argsort(Temp)
-            index = index[1:n_k]
-            #index = index.T
-            count = 0
-            for j in index:
-                count += 1
-                for k in index[count:]:
-                    vector1 = A[j, :] - A[i, :]
-                    vector2 = A[k, :] - A[i, :]
-                    norm_vector1Xnorm_vector2 = norm(vector1) * norm(vector2)
-                    vector1Xvector2T = vector1.dot(vector2)
-                    var_front = var_front + (1. / norm_vector1Xnorm_vector2) * (vector1Xvector2T / (norm_vector1Xnorm_vector2**2)) **2
-                    var_back = var_back + (vector1Xvector2T / norm_vector1Xnorm_vector2**3)
-                    denominator += 1./norm_vector1Xnorm_vector2
-            var_array.append(var_front/denominator - (var_back/denominator)**2)
-        
-        min_var_array = min(var_array)
-        abof = (np.array(var_array) - min_var_array) / (max(var_array) - min_var_array)
+
+        _, indices = NeighborhoodGraph(k_max=n_k - 1).fit(A).kneighbors()
+        rows_per_batch = max(1, self.batch_size // n_k**2)
+
+        var_array = np.empty(num_instances)
+        for start in xrange(0, num_instances, rows_per_batch):
+            stop = min(start + rows_per_batch, num_instances)
+            diff = A[indices[start:stop]] - A[start:stop, None, :]
+            var_array[start:stop] = _weighted_variance(*_pair_sums(diff))
+
+        min_var_array = var_array.min()
+        abof = (var_array - min_var_array) / (var_array.max() - min_var_array)
         return abof
-        
+
     def fit(self, A=None, y=None):
         self.A_ = A
-        return self
\ No newline at end of file
+        return self
+
+
+class LBABOD(BaseAnomalyDetector):
+    '''
+    Lower bound Angle Based Outlier Detector for top-n outlier queries
+
+    LB-ABOD of "Angle-Based Outlier Detection in High-dimensional Data In
+    KDD2008" [Hans-Peter, Kriegel Matthias, Schubert Arthur Zimek]
+
+    The ABOF of a point over all pairs of points is bounded from below by
+    taking the weighted sum of the squared angle terms exactly over the
+    pairs of its n_k nearest neighbors, and bounding it with Cauchy-Schwarz
+    over the remaining pairs. The sum of the weights and the weighted sum
+    of the angle terms over all pairs are exact, and follow from the
+    distances to all the points in O(n d) per point. The points are then
+    visited in increasing order of the bound and their exact ABOF computed,
+    until the top_n smallest exact values are below the bound of every
+    remaining point. The bound is tightest for small n_features or large
+    n_k.
+
+    Parameters
+    ----------
+    n_k : int, optional (default=10)
+        Number of nearest neighbors used in the lower bound.
+
+    top_n : int, optional (default=10)
+        Number of outliers to find.
+
+    batch_size : int, optional (default=10000)
+        Bounds the number of distances, batch * n_samples, computed at a
+        time.
+
+    Attributes
+    ----------
+    outliers_ : array, shape (top_n,)
+        Indices of the top_n outliers of the last predicted data, the
+        points with the smallest ABOF, in increasing order of ABOF.
+
+    n_refined_ : int
+        Number of points whose exact ABOF was computed.
+    '''
+
+    def __init__(self, n_k=10, top_n=10, batch_size=10000):
+        self.n_k = n_k
+        self.top_n = top_n
+        self.batch_size = batch_size
+
+    def fit(self, A=None, y=None):
+        self.A_ = A
+        return self
+
+    def predict(self, A):
+        '''
+        Predict the ABOF of the top_n outliers of A and a lower bound for
+        the others.
+
+        Parameters
+        ----------
+        A : array-like, shape (n_samples, n_features)
+
+        Returns
+        -------
+        abof : array, shape (n_samples,)
+            Exact angle-based outlier factor of the refined points,
+            including the top_n outliers, and a lower bound of it for the
+            other points. Smaller values are more outlying.
+        '''
+        A = np.asarray(A, dtype=float)
+        num_instances = A.shape[0]
+        top_n = min(self.top_n, num_instances)
+
+        lower_bound = self._lower_bound(A)
+
+        # Refine in increasing order of the bound, top_n points at a time
+        abof = lower_bound.copy()
+        order = np.argsort(lower_bound, kind='mergesort')
+        refined = 0
+        while refined < num_instances:
+            rows = order[refined:refined + top_n]
+            abof[rows] = _exact_abof(A, rows)
+            refined += len(rows)
+
+            nth_smallest = np.sort(abof[order[:refined]])[top_n - 1]
+            if (refined == num_instances or
+                    nth_smallest <= lower_bound[order[refined]]):
+                break
+
+        candidates = order[:refined]
+        self.outliers_ = candidates[np.argsort(abof[candidates],
+                                               kind='mergesort')[:top_n]]
+        self.n_refined_ = refined
+        return abof
+
+    def _lower_bound(self, A):
+        num_instances = A.shape[0]
+        n_k = min(self.n_k, num_instances - 1)
+        _, indices = NeighborhoodGraph(k_max=n_k).fit(A).kneighbors()
+
+        rows_per_batch = max(1, self.batch_size // num_instances)
+        lower_bound = np.empty(num_instances)
+        for start in xrange(0, num_instances, rows_per_batch):
+            stop = min(start + rows_per_batch, num_instances)
+            rows = np.arange(start, stop)
+
+            # Pairs within the kNN
+            diff = A[indices[start:stop]] - A[start:stop, None, :]
+            knn_wx2, knn_wx, knn_w = _pair_sums(diff)
+
+            # Sums over all pairs, with u_b = b / |b|^3 as in _exact_abof:
+            # sum w = ((sum 1/|b|)^2 - sum 1/|b|^2) / 2 and
+            # sum w x = (|sum u_b|^2 - sum 1/|b|^4) / 2
+            with np.errstate(divide='ignore'):
+                inv_dist = 1. / euclidean_distances(A[start:stop], A)
+            inv_dist[rows - start, rows] = 0.
+            inv_cubed = inv_dist**3
+            sum_u = (np.dot(inv_cubed, A) -
+                     inv_cubed.sum(axis=1)[:, None] * A[start:stop])
+            all_w = ((inv_dist.sum(axis=1)**2 -
+                      (inv_dist**2).sum(axis=1)) / 2.)
+            all_wx = ((sum_u**2).sum(axis=1) -
+                      (inv_dist**4).sum(axis=1)) / 2.
+
+            # By Cauchy-Schwarz the pairs outside the kNN add at least
+            # (sum w x)^2 / sum w over these pairs to sum w x^2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rest_wx2 = (all_wx - knn_wx)**2 / (all_w - knn_w)
+            rest_wx2[~np.isfinite(rest_wx2)] = 0.
+            lower_bound[start:stop] = _weighted_variance(knn_wx2 + rest_wx2,
+                                                         all_wx, all_w)
+
+        return lower_bound
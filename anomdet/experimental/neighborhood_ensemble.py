@@ -5,23 +5,33 @@ from ..base import BaseAnomalyDetector
 import numpy as np
 from scipy.spatial.distance import cdist
 
-from sklearn.neighbors import NearestNeighbors
 from sklearn.utils import check_random_state
 
-from anomdet import LOF
-from anomdet.lof.loop import LoOP
+from ..neighborhood.approximate import make_neighbors
 from scipy.special import erf
 
 
 class NeighborhoodEnsemble(BaseAnomalyDetector):
     """Ensemble of Metrics calculated from Random Neighborhoods
+    
+    Parameters
+    ----------
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see neighborhood.NeighborhoodGraph.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index.
     """
     
-    def __init__(self, sample_size=255, n_samples=10, strategy="LoOP", random_state=None):
+    def __init__(self, sample_size=255, n_samples=10, strategy="LoOP", random_state=None,
+                 algorithm='exact', algorithm_params=None):
         self.sample_size = sample_size
         self.n_samples = n_samples
         self.strategy = strategy
         self.random_state = random_state
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
         
     def fit(self, X=None, y=None):
         return self
@@ -40,7 +50,8 @@ class NeighborhoodEnsemble(BaseAnomalyDetector):
          
         outlier_scores = np.zeros(X.shape[0])
         for k in range(self.n_samples):
-            nbrs = NearestNeighbors(n_neighbors=n_neighbors+1).fit(samples[k])
+            nbrs = make_neighbors(self.algorithm, n_neighbors+1,
+                                  self.algorithm_params).fit(samples[k])
             distances, indices = nbrs.kneighbors(samples[k])
             indices = indices[:, 1:]
             distances = distances[:, 1:]
@@ -56,11 +67,10 @@ class NeighborhoodEnsemble(BaseAnomalyDetector):
             # nplof : the std of plof assuming mean is zero
             nplof = lambda_ * np.sqrt(np.nanmean(plof**2))
             
-            for i in range(n_items):
-                distances, indices = nbrs.kneighbors(X[i])
-                plof_ = np.sqrt((distances**2).mean()) / np.mean(prob_dist[indices]) - 1.0
-                
-                outlier_scores[i] += erf(plof_ / nplof / np.sqrt(2))  #.clip(0), don't clip to 0 like in LoOP
+            distances, indices = nbrs.kneighbors(X)
+            plof_ = np.sqrt((distances**2).mean(axis=1)) / prob_dist[indices].mean(axis=1) - 1.0
+            
+            outlier_scores += erf(plof_ / nplof / np.sqrt(2))  #.clip(0), don't clip to 0 like in LoOP
         
         self.samples = samples
         outlier_scores /= self.n_samples
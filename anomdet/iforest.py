@@ -2,8 +2,15 @@
 
 from .base import BaseAnomalyDetector
 
+import os
+from functools import partial
+
 import numpy as np
-from .utils import maybe_default_random_state
+from sklearn.externals.joblib import Parallel, delayed
+from .utils import maybe_default_random_state, predict_in_chunks, effective_n_jobs
+from .utils import iter_chunks
+
+MAX_INT = np.iinfo(np.int32).max
 
 class IForest(BaseAnomalyDetector):
     """Isolation Forest
@@ -23,7 +30,7 @@ class IForest(BaseAnomalyDetector):
           - If int, then sample `subsample_size' number of data points.
           - If float, then `subsample_size' should be in the range (0, 1) and
             sample ceil(`subsample_size' * m) points where m is the number of
-            data points.
+            data points. Only for data in memory, see `fit'.
      
     `height_limit' : int or None, optional (default=None)
         The maximum height of a tree, equivalent to the maximum number of
@@ -36,6 +43,17 @@ class IForest(BaseAnomalyDetector):
         If RandomState instance, random_state is the random number generator;
         If None, the random number generator is the RandomState instance used
         by `np.random`.        
+        Every tree is built with its own RandomState, seeded from this one,
+        so the forest does not depend on `n_jobs'.
+    
+    `n_jobs' : int, optional (default=1)
+        The number of worker processes the trees are built in. -1 means all
+        CPUs.
+    
+    `chunk_size' : int or None, optional (default=10000)
+        The number of rows scored at a time. Every row of a chunk goes down
+        all the trees at once, so memory scales with chunk_size * num_trees.
+        If None, all rows at once.
         
     References
     ----------
@@ -48,92 +66,486 @@ class IForest(BaseAnomalyDetector):
 
     """
     
-    def __init__(self, num_trees=20, subsample_size=0.25, height_limit=None, random_state=None):
+    def __init__(self, num_trees=20, subsample_size=0.25, height_limit=None, random_state=None,
+                 chunk_size=10000, n_jobs=1):
         self.num_trees = num_trees
         self.subsample_size = subsample_size
         self.trees = []
         self.height_limit = height_limit
         self.random_state = random_state
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
         
     def fit(self, X, y=None):
+        '''
+        Grow the trees on random subsamples of X.
+        
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features), or an iterable of them
+            The training data. An np.memmap is read `chunk_size' rows at a
+            time, and an iterable of arrays, e.g. the chunks of a large CSV
+            file, one chunk at a time. Both draw the subsamples of all the
+            trees in a single pass with reservoir sampling, in
+            O(num_trees * psi * n_features) memory, so the data never needs
+            to fit in memory. `subsample_size' should then be an int.
+            The subsamples are drawn differently than for an ndarray, so an
+            np.memmap and the same data in memory give different forests for
+            the same `random_state'.
+        '''
         random_state = maybe_default_random_state(self.random_state)
         
-        m = X.shape[0]
+        in_memory = isinstance(X, np.ndarray) and not isinstance(X, np.memmap)
+        if in_memory or isinstance(X, np.memmap):
+            m = X.shape[0]
+        else:
+            m = None
+        
         if self.subsample_size <= 1.0:
+            if not in_memory:
+                raise ValueError("subsample_size should be an int to fit on "
+                                 "an np.memmap or an iterable of chunks!")
             psi = int(np.ceil(self.subsample_size * m))
         else:
             psi = self.subsample_size
+        
+        # One seed per tree, and one contiguous group of trees per job
+        seeds = random_state.randint(MAX_INT, size=self.num_trees)
+        groups = np.array_split(np.arange(self.num_trees),
+                                min(effective_n_jobs(self.n_jobs), self.num_trees))
+        
+        if not in_memory:
+            if m is None:
+                chunks = X
+            else:
+                chunks = (X[start:stop] for start, stop in iter_chunks(m, self.chunk_size))
+            random_states = [np.random.RandomState(seed) for seed in seeds]
+            samples = _reservoir_samples(chunks, psi, random_states)
+            psi = samples.shape[1]
+        
         if self.height_limit is None:
-            self.height_limit = np.ceil(np.log2(psi))
-        numdata = X.shape[0]
-        trees = []
-        for i in range(self.num_trees):
-            sample_ind = random_state.permutation(numdata)[:psi]
-            X_sample = X[sample_ind, :]
-            trees.append(ITree(height_limit=self.height_limit, random_state=random_state).fit(X_sample))
-        self.trees = trees
+            height_limit = np.ceil(np.log2(psi))
+        else:
+            height_limit = self.height_limit
+        
+        if in_memory:
+            jobs = [delayed(_build_trees)(X, psi, height_limit, seeds[group])
+                    for group in groups]
+        else:
+            jobs = [delayed(_grow_trees)(samples[group], height_limit,
+                                         [random_states[i] for i in group])
+                    for group in groups]
+        
+        trees = Parallel(n_jobs=len(groups))(jobs)
+        self.trees = [tree for group in trees for tree in group]
         self.psi = psi
+        self._forest = FlatForest.from_trees(self.trees)
         return self
         
     def predict(self, X):
-        m = X.shape[0]
-        scores = np.zeros(m)
-        for i in range(m):
-            x = X[i, :]
-            for tree in self.trees:
-                path_length, leaf_size = tree.path_length_and_leaf_size(x)
-                scores[i] += path_length + _adjustment(leaf_size)
+        '''
+        Anomaly scores of the rows of X, `chunk_size` rows at a time.
+        '''
+        return predict_in_chunks(partial(_predict_chunk, self._forest, self.psi),
+                                 X, self.chunk_size)
+    
+    def predict_anytime(self, X, threshold=0.5, block_size=5, z=3.):
+        '''
+        Anytime anomaly scores of the rows of X, for triage.
         
-        scores = 2**(-scores / len(self.trees) / _adjustment(self.psi))
-        return scores
+        The trees are evaluated `block_size' at a time, keeping the running
+        mean and standard error of the path lengths of every row. A row
+        stops going down further trees as soon as its score is below
+        `threshold' with confidence, i.e. when its mean path length minus
+        `z' standard errors still gives a score below `threshold'. Clearly
+        normal rows are thus scored with a fraction of the forest, while the
+        others get the same scores as `predict'.
         
-def _adjustment(n):
-        if n<=1:
-            value = 0
-        elif n == 2:
-            value = 1
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+        
+        threshold : float, optional (default=0.5)
+            Rows are dropped once confidently scored below it. Scores close
+            to 0.5 and below are normal, see [1].
+        
+        block_size : int, optional (default=5)
+            The number of trees evaluated at a time. The first decision
+            is taken after one block, so it should be at least 2.
+        
+        z : float, optional (default=3.)
+            Width of the confidence interval of the mean path length, in
+            standard errors. Larger values drop fewer rows, and more surely.
+        
+        Returns
+        -------
+        scores : array, shape (n_samples,)
+            The scores estimated from the trees each row went down.
+        
+        n_trees : array of int, shape (n_samples,)
+            The number of trees each row went down.
+        '''
+        n_samples = X.shape[0]
+        scores = np.empty(n_samples)
+        n_trees = np.empty(n_samples, dtype=int)
+        for start, stop in iter_chunks(n_samples, self.chunk_size):
+            scores[start:stop], n_trees[start:stop] = _predict_anytime_chunk(
+                self._forest, self.psi, threshold, block_size, z, X[start:stop])
+        return scores, n_trees
+    
+    def save(self, path):
+        '''
+        Save the fitted forest as flat NumPy arrays.
+        
+        Parameters
+        ----------
+        path : string
+            If it ends with '.npz', all the arrays are written to a single
+            .npz file. Otherwise `path' is a directory, created if needed,
+            holding one raw .npy file per array, which `load' can memory-map.
+        '''
+        arrays = dict((name, getattr(self._forest, name))
+                      for name in FlatForest.arrays)
+        arrays['psi'] = self.psi
+        if path.endswith('.npz'):
+            np.savez(path, **arrays)
+            return
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+    
+    @classmethod
+    def load(cls, path, mmap=True, **params):
+        '''
+        Load a forest saved with `save'.
+        
+        The forest is read-only and keeps no ITrees, so `trees' is empty.
+        Predicting only needs the flat arrays.
+        
+        Parameters
+        ----------
+        path : string
+            A .npz file or a directory of .npy files written by `save'.
+        
+        mmap : bool, optional (default=True)
+            Memory-map the .npy files of a directory read-only instead of
+            reading them. Loading is then almost instantaneous, and all the
+            processes which load the same forest share its pages through the
+            page cache. Ignored for a .npz file, which is read into memory.
+        
+        params : keyword arguments
+            Passed to the constructor, e.g. `chunk_size'.
+        '''
+        if path.endswith('.npz'):
+            with np.load(path) as npz:
+                arrays = dict((name, npz[name]) for name in npz.files)
         else:
-            value = 2 * (np.log(n-1)+0.5772156649) - 2*(n-1) / n;
-        return value
+            mmap_mode = 'r' if mmap else None
+            arrays = dict((name, np.load(os.path.join(path, name + '.npy'),
+                                         mmap_mode=mmap_mode))
+                          for name in FlatForest.arrays + ('psi',))
+        
+        psi = int(arrays.pop('psi'))
+        forest = FlatForest(**arrays)
+        params.setdefault('num_trees', forest.roots.shape[0])
+        params.setdefault('subsample_size', psi)
+        clf = cls(**params)
+        clf.psi = psi
+        clf._forest = forest
+        return clf
+        
+class StreamingIForest(IForest):
+    """Streaming Isolation Forest
+    
+    An isolation forest over a sliding window of the most recent points of
+    a stream. Every call to `partial_fit` adds a mini-batch to the window
+    and replaces the oldest `replace_fraction' of the trees with trees
+    grown on subsamples of the current window, so the cost of a batch does
+    not depend on the length of the stream. While the window holds fewer
+    than `subsample_size' points, and on the batch that fills it to
+    `subsample_size', all the trees are rebuilt, so that every tree is
+    grown on subsamples of the same size.
+    
+    Parameters
+    ----------
+    `num_trees' : int, optional (default=20)
+        The number of trees in the forest.
+    
+    `subsample_size' : int, optional (default=256)
+        The number of points of the window each tree is grown on.
+    
+    `window_size' : int, optional (default=2048)
+        The number of most recent points kept.
+    
+    `replace_fraction' : float, optional (default=0.1)
+        The fraction of the trees replaced by every call to `partial_fit`,
+        at least one tree.
+    
+    `height_limit', `random_state', `chunk_size' : as in IForest
+    
+    Examples
+    --------
+    Score every mini-batch against the forest of the points before it:
+    
+    >>> clf = StreamingIForest(random_state=0).partial_fit(first_batch)
+    >>> for batch in stream:
+    ...     scores = clf.predict(batch)
+    ...     clf.partial_fit(batch)
+    
+    References
+    ----------
+    
+    .. [1] S. C. Tan, K. M. Ting, T. F. Liu, "Fast Anomaly Detection for Streaming Data," IJCAI 2011.
+    """
+    
+    def __init__(self, num_trees=20, subsample_size=256, window_size=2048,
+                 replace_fraction=0.1, height_limit=None, random_state=None,
+                 chunk_size=10000):
+        self.num_trees = num_trees
+        self.subsample_size = subsample_size
+        self.window_size = window_size
+        self.replace_fraction = replace_fraction
+        self.trees = []
+        self.height_limit = height_limit
+        self.random_state = random_state
+        self.chunk_size = chunk_size
+        
+    def fit(self, X, y=None):
+        '''
+        Start a new stream with the points of X.
+        '''
+        self._window = None
+        return self.partial_fit(X)
+        
+    def partial_fit(self, X, y=None):
+        '''
+        Add a mini-batch of points to the window and replace the oldest
+        trees.
+        
+        Parameters
+        ----------
+        X : array-like, shape (n_batch, n_features)
+        '''
+        X = np.asarray(X)
+        if X.shape[0] == 0:
+            return self
+        if getattr(self, '_window', None) is None:
+            self._random_state = maybe_default_random_state(self.random_state)
+            self._window = np.empty((self.window_size, X.shape[1]), dtype=X.dtype)
+            self._window_count = 0
+            self._window_position = 0
+            self.trees = []
+        
+        # Ring buffer of the last window_size points
+        X = X[-self.window_size:]
+        positions = (self._window_position + np.arange(X.shape[0])) % self.window_size
+        self._window[positions] = X
+        self._window_position = (positions[-1] + 1) % self.window_size
+        self._window_count = min(self._window_count + X.shape[0], self.window_size)
+        window = self._window[:self._window_count]
+        
+        psi = min(self.subsample_size, self._window_count)
+        if self.height_limit is None:
+            height_limit = np.ceil(np.log2(self.subsample_size))
+        else:
+            height_limit = self.height_limit
+        
+        # Trees grown on a smaller window are not comparable under c(psi)
+        if psi != getattr(self, 'psi', None) or not self.trees:
+            num_new = self.num_trees
+        else:
+            num_new = max(1, int(np.ceil(self.replace_fraction * self.num_trees)))
+            num_new = min(num_new, self.num_trees)
+        
+        seeds = self._random_state.randint(MAX_INT, size=num_new)
+        self.trees = self.trees[num_new:] + _build_trees(window, psi, height_limit, seeds)
+        self.psi = psi
+        self._forest = FlatForest.from_trees(self.trees)
+        return self
+
+def _build_trees(X, psi, height_limit, seeds):
+    '''
+    Build one ITree per seed, each on its own subsample of psi rows of X
+    '''
+    random_states = [np.random.RandomState(seed) for seed in seeds]
+    samples = [X[random_state.permutation(X.shape[0])[:psi], :]
+               for random_state in random_states]
+    return _grow_trees(samples, height_limit, random_states)
+        
+def _grow_trees(samples, height_limit, random_states):
+    return [ITree(height_limit=height_limit, random_state=random_state).fit(X_sample)
+            for X_sample, random_state in zip(samples, random_states)]
+        
+def _reservoir_samples(chunks, psi, random_states):
+    '''
+    Draw a uniform sample of psi rows without replacement for every
+    RandomState, in one pass over an iterable of arrays of rows.
+    
+    Every sample is a reservoir filled with the first psi rows. Each later
+    row replaces a random row of the reservoir with probability
+    psi / (number of rows seen), and the gaps between replacements are drawn
+    directly (Algorithm L), so the work is O(psi * log(n / psi)) per
+    sample instead of O(n). A sample only depends on its RandomState, not
+    on the chunks.
+    
+    Returns an array of shape (len(random_states), min(psi, n), n_features).
+    
+    Reference: K.-H. Li, "Reservoir-Sampling Algorithms of Time Complexity
+    O(n(1 + log(N/n)))", ACM Trans. Math. Softw. 20(4), 1994.
+    '''
+    def skip(random_state, weight):
+        # The gap to the next row to replace, and the new weight
+        weight *= np.exp(np.log(1. - random_state.random_sample()) / psi)
+        gap = int(np.floor(np.log(1. - random_state.random_sample()) / np.log(1. - weight)))
+        return gap + 1, weight
+    
+    reservoirs = None
+    n_seen = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        if reservoirs is None:
+            reservoirs = np.empty((len(random_states), psi, chunk.shape[1]), dtype=chunk.dtype)
+        start, stop = n_seen, n_seen + chunk.shape[0]
+        n_seen = stop
+        
+        if start < psi:
+            n_fill = min(psi, stop) - start
+            reservoirs[:, start:start + n_fill] = chunk[:n_fill]
+            if start + n_fill < psi:
+                continue
+            # The reservoirs are full, draw the first replacements
+            weights = np.ones(len(random_states))
+            next_row = np.empty(len(random_states), dtype=np.int64)
+            for t, random_state in enumerate(random_states):
+                gap, weights[t] = skip(random_state, weights[t])
+                next_row[t] = psi - 1 + gap
+        
+        for t, random_state in enumerate(random_states):
+            while next_row[t] < stop:
+                reservoirs[t, random_state.randint(psi)] = chunk[next_row[t] - start]
+                gap, weights[t] = skip(random_state, weights[t])
+                next_row[t] += gap
+    
+    if reservoirs is None:
+        raise ValueError("Cannot fit on an empty iterable!")
+    return reservoirs[:, :min(psi, n_seen)]
+        
+def _predict_chunk(forest, psi, X):
+    scores = forest.path_lengths(X).mean(axis=1)
+    return 2**(-scores / _adjustment(psi))
+        
+def _predict_anytime_chunk(forest, psi, threshold, block_size, z, X):
+    # Path lengths above this one give scores below the threshold
+    min_path_length = -_adjustment(psi) * np.log2(threshold)
+    
+    m = X.shape[0]
+    path_sum = np.zeros(m)
+    path_sum_sq = np.zeros(m)
+    n_trees = np.zeros(m, dtype=int)
+    active = np.arange(m)
+    for start, stop in iter_chunks(forest.n_trees, block_size):
+        path_lengths = forest.path_lengths(X[active], slice(start, stop))
+        path_sum[active] += path_lengths.sum(axis=1)
+        path_sum_sq[active] += (path_lengths**2).sum(axis=1)
+        n_trees[active] = stop
+        
+        # Drop the points whose mean path length is above min_path_length
+        # with z standard errors to spare
+        k = float(stop)
+        mean = path_sum[active] / k
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = (path_sum_sq[active] - k * mean**2) / (k - 1)
+            lower = mean - z * np.sqrt(np.maximum(variance, 0.) / k)
+        active = active[~(lower > min_path_length)]
+        if active.shape[0] == 0:
+            break
+    
+    scores = 2**(-path_sum / n_trees / _adjustment(psi))
+    return scores, n_trees
+        
+def _adjustment(n):
+    '''
+    Average path length of an unsuccessful search in a binary search tree of
+    n points, for a number or an array of them
+    '''
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = 2 * (np.log(n-1)+0.5772156649) - 2*(n-1) / n
+    value = np.where(n <= 1, 0., np.where(n == 2, 1., value))
+    return value[()]
     
 class ITree(object):
     """ITree
-    An ITree is constructed out of ITreeNode's and ITreeLeaf's
+    An isolation tree stored in flat arrays, indexed by node, with the root
+    at node 0 and the nodes in depth-first order.
+    
+    Attributes
+    ----------
+    split_attribute : array of int, shape (n_nodes,)
+        The attribute an internal node splits on, -1 for a leaf.
+    split_value : array of float, shape (n_nodes,)
+        Rows with x[split_attribute] >= split_value go right, others left.
+    left, right : arrays of int, shape (n_nodes,)
+        The children of an internal node, -1 for a leaf.
+    leaf_size : array of int, shape (n_nodes,)
+        The number of training points which reached a leaf, 0 for an
+        internal node.
+    depth : array of int, shape (n_nodes,)
+        The path length from the root to a node.
     """
     
     def __init__(self, height_limit, root=None, random_state=None):
         self.height_limit = height_limit
-        self.root = None
         self.random_state = random_state
         
     def fit(self, X):
         '''
-        Given a dataset `X`, construct the ITree out of ITreeNodes and ITreeLeaf's
+        Given a dataset `X`, construct the ITree
         '''
-        self.root = self._grow(X, 0, self.height_limit)
+        nodes = []
+        self._grow(X, 0, self.height_limit, nodes)
+        (self.split_attribute, self.split_value, self.left, self.right,
+         self.leaf_size, self.depth) = [np.array(column) for column in zip(*nodes)]
+        self.split_value = self.split_value.astype(float)
         return self
     
+    @property
+    def n_nodes(self):
+        return self.left.shape[0]
+    
     def path_length_and_leaf_size(self, x):
         '''
         Return path length of x traversing this ITree and the size of the leaf reached
         '''
-        treenode = self.root
-        path_length = 0
-        while not isinstance(treenode, ITreeLeaf):
-            if treenode.compare(x):
-                treenode = treenode.get_right()
-            else:
-                treenode = treenode.get_left()
-            path_length += 1
-        return (path_length, treenode.size)
+        leaf = self.apply(np.asarray(x)[None, :])[0]
+        return (self.depth[leaf], self.leaf_size[leaf])
+    
+    def apply(self, X):
+        '''
+        Return the leaf reached by every row of X, moving all the rows down a
+        level at a time
+        '''
+        leaves = np.zeros(X.shape[0], dtype=int)
+        rows = np.arange(X.shape[0])
+        while rows.size:
+            node = leaves[rows]
+            internal = self.left[node] >= 0
+            rows, node = rows[internal], node[internal]
+            go_right = X[rows, self.split_attribute[node]] >= self.split_value[node]
+            leaves[rows] = np.where(go_right, self.right[node], self.left[node])
+        return leaves
           
-    def _grow(self, X, current_height, height_limit):
+    def _grow(self, X, current_height, height_limit, nodes):
         '''
-        Recursive function to grow the forest
+        Recursive function to grow the tree, appending (split_attribute,
+        split_value, left, right, leaf_size, depth) for every node to `nodes`
+        in depth-first order. Returns the index of the new node.
         '''
         m, n = X.shape
+        index = len(nodes)
         if current_height >= height_limit or m <= 1:
-            tree = ITreeLeaf(m)
+            nodes.append((-1, 0., -1, -1, m, current_height))
         else:
             split_att = self.random_state.randint(n)
             a = min(X[:, split_att])
@@ -143,48 +555,107 @@ class ITree(object):
             X_left = X[X[:, split_att] < split_value]
             X_right = X[X[:, split_att] >= split_value]
             
-            tree = ITreeNode(split_att, split_value)
-            tree.insert_left(self._grow(X_left, current_height + 1, height_limit))
-            tree.insert_right(self._grow(X_right, current_height + 1, height_limit))
+            nodes.append(None)
+            left = self._grow(X_left, current_height + 1, height_limit, nodes)
+            right = self._grow(X_right, current_height + 1, height_limit, nodes)
+            nodes[index] = (split_att, split_value, left, right, 0, current_height)
         
-        return tree
+        return index
 
-class ITreeNode(object):
-    """ITreeNode
-    A class to represent an internal (non-leaf) node of an isolation tree
+class FlatForest(object):
+    """FlatForest
+    The arrays of a list of ITrees concatenated into one set of arrays, so a
+    batch of rows goes down all the trees at once.
+    
+    A leaf is its own child on both sides, so every (row, tree) pair takes
+    the same number of steps, max_depth, without any masking.
+    
+    Attributes
+    ----------
+    roots : array of int, shape (n_trees,)
+        The root node of every tree.
+    split_attribute, split_value : arrays, shape (n_nodes,)
+        As in ITree, 0 for a leaf.
+    children : array of int, shape (n_nodes, 2)
+        The left and right child of every node, indexing the concatenated
+        nodes.
+    leaf_size : array of int, shape (n_nodes,)
+        As in ITree.
+    path_length : array of float, shape (n_nodes,)
+        For a leaf, its depth plus the average path length of its
+        leaf_size points, `_adjustment(leaf_size)`.
+    max_depth : int
+        The depth of the deepest leaf.
     """
     
-    def __init__(self, splitatt, splitvalue):
-        self.split_attribute = splitatt
-        self.split_value = splitvalue
-        self._left = None
-        self._right = None
+    arrays = ('roots', 'split_attribute', 'split_value', 'children', 'leaf_size',
+              'path_length', 'max_depth')
+    
+    def __init__(self, roots, split_attribute, split_value, children, leaf_size,
+                 path_length, max_depth):
+        self.roots = roots
+        self.split_attribute = split_attribute
+        self.split_value = split_value
+        self.children = children
+        self.leaf_size = leaf_size
+        self.path_length = path_length
+        self.max_depth = int(max_depth)
     
-    def insert_left(self, new_node):
-        self._left = new_node
+    @classmethod
+    def from_trees(cls, trees):
+        '''
+        Concatenate the arrays of a list of ITrees
+        '''
+        n_nodes = [tree.n_nodes for tree in trees]
+        offsets = np.concatenate(([0], np.cumsum(n_nodes)[:-1])).astype(int)
         
-    def insert_right(self, new_node):
-        self._right = new_node
-     
-    def get_right(self):
-        return self._right
-    def get_left(self):
-        return self._left
-        
-    def compare(self, x):
-        """
-        Returns a boolean value determining whether we should go left or right
-        based on the compare_value
-        True - right
-        False - left
-        """
-        
-        return x[self.split_attribute] >= self.split_value
-    
-class ITreeLeaf(object):
-    """ITreeLeaf
-    A class to represent the leaf (external node) of an isolation tree
-    """
+        left = np.concatenate([tree.left + offset for tree, offset in zip(trees, offsets)])
+        right = np.concatenate([tree.right + offset for tree, offset in zip(trees, offsets)])
+        leaf = np.concatenate([tree.left < 0 for tree in trees])
+        node = np.arange(leaf.shape[0])
+        
+        split_attribute = np.concatenate([tree.split_attribute for tree in trees])
+        split_attribute[leaf] = 0
+        return cls(roots=offsets,
+                   split_attribute=split_attribute,
+                   split_value=np.concatenate([tree.split_value for tree in trees]),
+                   children=np.column_stack((np.where(leaf, node, left),
+                                             np.where(leaf, node, right))),
+                   leaf_size=np.concatenate([tree.leaf_size for tree in trees]),
+                   path_length=np.concatenate([tree.depth + _adjustment(tree.leaf_size)
+                                               for tree in trees]),
+                   max_depth=max(tree.depth.max() for tree in trees))
     
-    def __init__(self, size):
-        self.size = size
\ No newline at end of file
+    @property
+    def n_trees(self):
+        return self.roots.shape[0]
+    
+    def apply(self, X, trees=None):
+        '''
+        Return the leaf reached by every row of X in every tree, an array of
+        shape (n_rows, n_trees)
+        
+        All the (row, tree) pairs move down a level at once, with flat
+        indices into X and the interleaved children. If `trees' is given,
+        a slice or an index array, only those trees are traversed.
+        '''
+        roots = self.roots if trees is None else self.roots[trees]
+        X = np.ascontiguousarray(X)
+        m, d = X.shape
+        n_trees = roots.shape[0]
+        node = np.tile(roots, m)
+        row_start = np.repeat(np.arange(m) * d, n_trees)
+        X_flat = X.ravel()
+        children = self.children.ravel()
+        for _ in range(self.max_depth):
+            go_right = (X_flat.take(row_start + self.split_attribute.take(node)) >=
+                        self.split_value.take(node))
+            node = children.take(2 * node + go_right)
+        return node.reshape(m, n_trees)
+    
+    def path_lengths(self, X, trees=None):
+        '''
+        Return the path length of every row of X in every tree, adjusted by
+        the size of the leaf reached, an array of shape (n_rows, n_trees)
+        '''
+        return self.path_length.take(self.apply(X, trees))
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 
+from ._config import get_config
 from .base import BaseAnomalyDetector
 
 from sklearn.neighbors import NearestNeighbors
+from sklearn.utils import check_random_state
+from sklearn.utils.extmath import randomized_svd
 import numpy as np
 from numpy.linalg import eigh
+from scipy.sparse.linalg import eigsh
+
+from .utils import predict_in_chunks, iter_chunks
 
 class KPCA(BaseAnomalyDetector):
     """Kernel PCA for novelty detection
@@ -17,19 +23,64 @@ class KPCA(BaseAnomalyDetector):
             Width of Gaussian kernel
     n_eigval : int
                Number of eigenvalues to be extracted
+    chunk_size : int, optional (default=1000)
+                 Number of rows of new data scored at a time. The
+                 (chunk_size, n_train) cross-kernel of a chunk is computed
+                 with one matrix product. If None, all rows at once.
+    eigen_solver : {'dense', 'arpack', 'randomized'}, optional (default='dense')
+                   'dense' computes all eigenpairs of the centered kernel
+                   matrix with numpy.linalg.eigh, in O(n^3) time. 'arpack'
+                   (scipy.sparse.linalg.eigsh) and 'randomized'
+                   (sklearn.utils.extmath.randomized_svd) compute only the
+                   top n_eigval eigenpairs, in O(n^2 n_eigval) time. All
+                   three store the n x n kernel matrix while fitting.
+    n_landmarks : int, optional (default=None)
+                  If given, use the Nystroem approximation with n_landmarks
+                  training samples drawn at random as landmarks. The
+                  training data are mapped to n_landmarks features
+                  `chunk_size` rows at a time, and KPCA reduces to PCA of
+                  an n_landmarks x n_landmarks covariance matrix, so fitting
+                  takes O(n m^2) time and O(m^2) memory, and scoring O(m)
+                  per sample and training sample independent. The
+                  eigen_solver is not used.
+    random_state : int, RandomState instance or None, optional (default=None)
+                   Seeds the 'randomized' eigen_solver and the choice of the
+                   landmarks.
+
+    The kernel matrix is computed in the dtype configured with
+    `anomdet.set_config`.
 
     References
     ----------
     Heiko Hoffmann "Kernel PCA for novelty detection"
     http://www.heikohoffmann.de/kpca.html
+    
+    C. K. I. Williams, M. Seeger "Using the Nystroem Method to Speed Up
+    Kernel Machines", NIPS 2001
     """
     
-    def __init__(self, sigma, n_eigval):
+    def __init__(self, sigma, n_eigval, chunk_size=1000, eigen_solver='dense',
+                 n_landmarks=None, random_state=None):
         self.sigma = sigma
         self.n_eigval = n_eigval  # number of eigenvalues to use during pred.
+        self.chunk_size = chunk_size
+        self.eigen_solver = eigen_solver
+        self.n_landmarks = n_landmarks
+        self.random_state = random_state
     
-    def predict(self, A):
-        return self._reconstruction_error(A, self.n_eigval)
+    def predict(self, A, out=None):
+        '''
+        Reconstruction error of each row of A, computed `chunk_size` rows
+        at a time, so A can be an np.memmap which does not fit in memory.
+        
+        out : array-like, shape (n_samples,), optional (default=None)
+              Preallocated output, e.g. an np.memmap.
+        '''
+        if self._landmarks is None:
+            predict_chunk = self._reconstruction_error
+        else:
+            predict_chunk = self._nystroem_reconstruction_error
+        return predict_in_chunks(predict_chunk, A, self.chunk_size, out)
     
     def _gaussian_kernel(self, A, sigma):
         '''
@@ -45,49 +96,68 @@ class KPCA(BaseAnomalyDetector):
         squares = squares.reshape(n, 1) + squares.reshape(1, n)
         return np.exp(-(squares - 2*A.dot(A.T)) / (2*sigma*sigma))
     
-    def _z_data_projection(self, z):
+    def _z_data_projection(self, Z, data=None):
         '''
-        Projects z using kernel function onto data
+        Projects the rows of Z using kernel function onto data, with one
+        matrix product for the (n_rows, n_train) cross-kernel
         '''
-        n, d = self.data.shape
-        z = z.reshape(1, d)
+        if data is None:
+            data = self.data
+        Z = np.asarray(Z, dtype=data.dtype).reshape(-1, data.shape[1])
         sigma = self.sigma
-        return np.exp(- (z.dot(z.T) - 2*self.data.dot(z.T) + np.sum(self.data**2, axis=1).reshape(n, 1)) /(2*sigma*sigma)).flatten()
+        sq_dists = (np.sum(Z**2, axis=1)[:, None] - 2*Z.dot(data.T) +
+                    np.sum(data**2, axis=1)[None, :])
+        return np.exp(-sq_dists / (2*sigma*sigma))
     
-    def _reconstruction_error(self, data, n_components):
+    def _reconstruction_error(self, data):
         '''
-        Returns the reconstruction error for KPCA
+        Returns the reconstruction error for KPCA of the rows of data
         '''
-
-        n = data.shape[0]
         N = self.data.shape[0]  # number of data in training
         
-        lambda_ = self._kernel_eigvals[:self.n_eigval]
-        alpha = self._kernel_eigvecs[:, :self.n_eigval]
-        alpha = alpha / np.sqrt(lambda_)
-        
-        #precompute helper vectors
-        sumalpha = np.sum(alpha, 0)
-        alphaKrow = self._mean_uncentered_K_row.dot(alpha)
-        #Ksum = np.sum(self.K)
-        #Kavg = np.sum(self.K)/n/n
-        
-        err = np.empty(n)
-        for i in range(n):
-            z = data[i, :]
-            proj_on_data = self._z_data_projection(z)
-            
-            # Projections onto components
-            f = proj_on_data.dot(alpha) - alphaKrow - np.sum(proj_on_data)/N * sumalpha + self._mean_uncentered_K * sumalpha
-
-            # Spherical Potential
-            s = self._gaussian_kernel(z[None,:], self.sigma) - 2.*np.sum(proj_on_data)/N + self._mean_uncentered_K
-
-            err[i] = s - f.dot(f)
+        proj_on_data = self._z_data_projection(data)
+        proj_mean = np.sum(proj_on_data, axis=1) / N
+        
+        # Projections onto components
+        f = (proj_on_data.dot(self._alpha) - self._alphaKrow -
+             np.outer(proj_mean, self._sumalpha) +
+             self._mean_uncentered_K * self._sumalpha)
+        
+        # Spherical Potential, the Gaussian kernel of z with itself is 1
+        s = 1. - 2.*proj_mean + self._mean_uncentered_K
+        
+        return s - np.sum(f**2, axis=1)
+    
+    def _nystroem_features(self, data):
+        '''
+        Nystroem feature map, whose dot products approximate the kernel
+        '''
+        return self._z_data_projection(data, self._landmarks).dot(
+            self._normalization)
+    
+    def _nystroem_reconstruction_error(self, data):
+        '''
+        Returns the reconstruction error for Nystroem KPCA of the rows of
+        data. The kernel of z with itself is exactly 1, so the part of z
+        outside the span of the landmarks counts as error.
+        '''
+        features = self._nystroem_features(data)
         
-        return err
+        # Projections onto components
+        f = (features - self._feature_mean).dot(self._components)
         
+        # Spherical Potential
+        s = (1. - 2.*features.dot(self._feature_mean) +
+             self._feature_mean.dot(self._feature_mean))
+        
+        return s - np.sum(f**2, axis=1)
+    
     def fit(self, data, y=None):
+        data = np.asarray(data, dtype=get_config()['dtype'])
+        
+        if self.n_landmarks is not None:
+            return self._fit_nystroem(data)
+        
         n, d = data.shape
         
         # Kernel matrix
@@ -97,21 +167,82 @@ class KPCA(BaseAnomalyDetector):
         Krow = np.sum(K, axis=1) / n
         Ksum = np.sum(Krow) / n
         
-        for i in range(n):
-            for j in range(n):
-                K[i, j] = K[i, j] - Krow[i] - Krow[j] + Ksum
+        K -= Krow[:, None]
+        K -= Krow[None, :]
+        K += Ksum
+        
+        # Calculate sorted eigen-vals/vecs, only the n_eigval largest are
+        # kept
+        eigvals, eigvecs = self._top_eigenpairs(K)
+        del K
         
-        # Calculate sorted eigen-vals/vecs
-        eigvals, eigvecs = eigh(K)
-        ind = np.argsort(eigvals)[-1::-1]  # reverse to put largest first
-        eigvals = eigvals[ind]
-        eigvecs = eigvecs[:, ind]
+        alpha = eigvecs / np.sqrt(eigvals)
         
         self._kernel_eigvals = eigvals
-        self._kernel_eigvecs = eigvecs
-        self.K = K
+        self._alpha = alpha
+        self._sumalpha = np.sum(alpha, 0)
+        self._alphaKrow = Krow.dot(alpha)
         self._mean_uncentered_K_row = Krow
         self._mean_uncentered_K = Ksum
+        self._landmarks = None
         self.data = data
         return self
-    
\ No newline at end of file
+    
+    def _top_eigenpairs(self, K):
+        '''
+        The n_eigval largest eigenvalues of K, in decreasing order, and
+        their eigenvectors
+        '''
+        n_eigval = self.n_eigval
+        if self.eigen_solver == 'dense':
+            eigvals, eigvecs = eigh(K)
+        elif self.eigen_solver == 'arpack':
+            eigvals, eigvecs = eigsh(K, n_eigval, which='LA')
+        elif self.eigen_solver == 'randomized':
+            # K is positive semi-definite, so its singular vectors are its
+            # eigenvectors
+            eigvecs, eigvals, _ = randomized_svd(
+                K, n_eigval, random_state=self.random_state)
+        else:
+            raise ValueError("eigen_solver should be 'dense', 'arpack' or "
+                             "'randomized'!")
+        
+        ind = np.argsort(eigvals)[-1::-1][:n_eigval]  # largest first
+        return eigvals[ind], eigvecs[:, ind]
+    
+    def _fit_nystroem(self, data):
+        n, d = data.shape
+        rs = check_random_state(self.random_state)
+        
+        landmarks = data[rs.choice(n, min(self.n_landmarks, n),
+                                   replace=False)]
+        
+        # K_mm^(-1/2), leaving out the directions of tiny eigenvalues
+        eigvals, eigvecs = eigh(self._gaussian_kernel(landmarks, self.sigma))
+        keep = eigvals > 1e-12 * eigvals.max()
+        self._landmarks = landmarks
+        self._normalization = eigvecs[:, keep] / np.sqrt(eigvals[keep])
+        
+        # Mean and scatter matrix of the features, a chunk at a time
+        n_features = self._normalization.shape[1]
+        feature_sum = np.zeros(n_features)
+        scatter = np.zeros((n_features, n_features))
+        for start, stop in iter_chunks(n, self.chunk_size):
+            features = self._nystroem_features(data[start:stop])
+            feature_sum += features.sum(axis=0)
+            scatter += features.T.dot(features)
+        
+        feature_mean = feature_sum / n
+        scatter -= n * np.outer(feature_mean, feature_mean)
+        
+        # The eigenvalues of the scatter matrix are those of the centered
+        # kernel matrix of the features
+        eigvals, eigvecs = eigh(scatter)
+        ind = np.argsort(eigvals)[-1::-1][:self.n_eigval]
+        
+        self._kernel_eigvals = eigvals[ind]
+        self._components = eigvecs[:, ind].astype(data.dtype)
+        self._feature_mean = feature_mean.astype(data.dtype)
+        self._normalization = self._normalization.astype(data.dtype)
+        self.data = None
+        return self
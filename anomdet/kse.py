@@ -4,12 +4,105 @@ from .base import BaseAnomalyDetector
 
 import numpy as np
 
+from sklearn.externals.joblib import Parallel, delayed
 from sklearn.utils import check_random_state
-from scipy.stats import ks_2samp
 from scipy.spatial.distance import cdist
 
+from .utils import iter_chunks, effective_n_jobs
+
+
+def ks_statistics(reference, samples):
+    """Two-sample Kolmogorov-Smirnov statistics of one reference sample
+    against many samples, equal to scipy.stats.ks_2samp(reference, row)[0]
+    for every row.
+
+    Each sample is sorted once, and the empirical distribution of the
+    reference is evaluated at all the sample values with two
+    np.searchsorted calls. Between two consecutive values of a sample its
+    distribution is constant, so the largest differences are found at its
+    values, using the reference distribution just before (side='left') and
+    at (side='right') each value.
+
+    Parameters
+    ----------
+    reference : array, shape (n_reference,)
+
+    samples : array, shape (n_samples, n_values)
+
+    Returns
+    -------
+    statistics : array, shape (n_samples,)
+    """
+    reference = np.sort(reference)
+    samples = np.sort(samples, axis=1)
+    n1 = float(reference.shape[0])
+    n2 = float(samples.shape[1])
+
+    # Distribution of the samples at their p-th value, ignoring ties, which
+    # never exceeds the largest difference with ties
+    steps = np.arange(1, samples.shape[1] + 1) / n2
+    below = np.searchsorted(reference, samples, side='left') / n1
+    upto = np.searchsorted(reference, samples, side='right') / n1
+
+    d_samples = (steps - upto).max(axis=1)
+    d_reference = (below - (steps - 1. / n2)).max(axis=1)
+    return np.maximum(d_samples, d_reference)
+
+
+def _kse_scores(X, rows, dpop_indices, bpop_indices):
+    # Average KS statistic of the distances from each point to its dpop
+    # sample against the distances from its bpop sample to the dpop sample
+    scores = np.empty(len(rows))
+    for t, i in enumerate(rows):
+        dpop = X[dpop_indices[t]]
+        dist_sample0 = cdist(X[i:i+1, :], dpop).ravel()
+        dist_sample_temp = cdist(X[bpop_indices[t]], dpop)
+        scores[t] = ks_statistics(dist_sample0, dist_sample_temp).mean()
+    return scores
+
+
+def _kse(X, nsample, random_state, n_jobs=1, chunk_size=1000):
+    rs = check_random_state(random_state)
+    nrows = X.shape[0]
+
+    def jobs():
+        # The samples are drawn here, one point after the other, so the
+        # scores do not depend on n_jobs
+        for start, stop in iter_chunks(nrows, chunk_size):
+            draws = [(rs.choice(nrows, nsample, replace=False),
+                      rs.choice(nrows, nsample, replace=False))
+                     for _ in xrange(start, stop)]
+            dpop_indices, bpop_indices = map(np.array, zip(*draws))
+            yield np.arange(start, stop), dpop_indices, bpop_indices
+
+    n_jobs = effective_n_jobs(n_jobs)
+    if n_jobs == 1:
+        scores = [_kse_scores(X, *job) for job in jobs()]
+    else:
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_kse_scores)(X, *job) for job in jobs())
+    return np.concatenate(scores)
+
+
 class KSE(BaseAnomalyDetector):
     """KSE - Average Kolmogorov-Smirnov Statistic for Outlier Detection
+
+    Parameters
+    ----------
+    subsample_size : int or float, optional (default=0.25)
+        Size of the random samples drawn for every point. A float <= 1.0 is
+        a fraction of the number of samples.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+
+    n_jobs : int, optional (default=1)
+        Number of worker processes the points are distributed over. -1
+        means all CPUs. The scores do not depend on n_jobs.
+
+    chunk_size : int, optional (default=1000)
+        Number of points whose random samples are drawn and scored at a
+        time, per job.
+
     References
     ----------
 
@@ -17,66 +110,36 @@ class KSE(BaseAnomalyDetector):
 
     .. [2] MATLAB implementation by author : http://fr.mathworks.com/matlabcentral/fileexchange/39593-anomaly-detection/content/kse_test_matlab/kse_test.m
     """
-    
-    def __init__(self, subsample_size=0.25, random_state=None):
+
+    def __init__(self, subsample_size=0.25, random_state=None, n_jobs=1,
+                 chunk_size=1000):
         self.random_state = random_state
         self.subsample_size = subsample_size
-        
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
     def fit(self, X, y=None):
         return self
-        
-    def predict(self, X):
-        rs = check_random_state(self.random_state)
 
+    def predict(self, X):
         nrows, dcols = X.shape
-        scores = np.zeros(nrows)
 
         if self.subsample_size <= 1.0:
             nsample = int(np.ceil(self.subsample_size * nrows))
         else:
             nsample = self.subsample_size
-            
-        for i in range(nrows):
-            # sample points to build dpop
-            tmp1 = rs.choice(nrows, nsample, replace=False)
-            dpop = X[tmp1, :]
-            
-            #dist_sample0 = np.zeros(nsample)
-            #for j in range(nsample): # build distances from point i to sampled points
-            #    dist_sample0[j] = np.sqrt(np.sum((dpop[j,:] - X[i,:])**2))
-            dist_sample0 = cdist(X[i:i+1, :], dpop).flatten()
-            
-            
-            tmp2 = rs.choice(nrows, nsample, replace=False)
-            bpop = X[tmp2, :]
-            
-            #for k in range(nsample):
-            #    dist_sample_temp = np.zeros(nsample)
-            #    for j in range(nsample):
-            #        dist_sample_temp[j] = np.sqrt(np.sum((dpop[j,:] - bpop[k,:])**2)) 
-            #        
-            #
-            #    ks2stat, _ = ks_2samp(dist_sample0, dist_sample_temp)
-            #    scores[i] += ks2stat / nsample
-                
-            dist_sample_temp = cdist(bpop, dpop)
-            for row in dist_sample_temp:
-                ks2stat, _ = ks_2samp(dist_sample0, row)
-                scores[i] += ks2stat
-            scores[i] /= nsample
-        return scores
-        
-        
-def kse_test(X, nsample=0.95, random_state=None):
+
+        return _kse(X, nsample, self.random_state, self.n_jobs,
+                    self.chunk_size)
+
+
+def kse_test(X, nsample=0.95, random_state=None, n_jobs=1):
     # Compute the outlier score for each p-dimensional data point
     # The highest scores are possible outliers, scores between [0,1]
     # Original scoring algorithm by Michael S Kim (mikeskim@gmail.com)
     # Version 1.00 (12/22/2012) for Matlab ported from R
     # not fully tested on Matlab, tested on GNU Octave and R
-    rs = check_random_state(random_state)
-
     nrows, dcols = X.shape
-    scores = np.zeros(nrows)
 
     if nrows <= 300:
         nsample = nrows
@@ -86,33 +149,5 @@ def kse_test(X, nsample=0.95, random_state=None):
 
     if nsample > 300:
         nsample = 300
-        
-    for i in range(nrows):
-        # sample points to build dpop
-        tmp1 = rs.choice(nrows, nsample, replace=False)
-        dpop = X[tmp1, :]
-        
-        #dist_sample0 = np.zeros(nsample)
-        #for j in range(nsample): # build distances from point i to sampled points
-        #    dist_sample0[j] = np.sqrt(np.sum((dpop[j,:] - X[i,:])**2))
-        dist_sample0 = cdist(X[i:i+1, :], dpop).flatten()
-        
-        
-        tmp2 = rs.choice(nrows, nsample, replace=False)
-        bpop = X[tmp2, :]
-        
-        #for k in range(nsample):
-        #    dist_sample_temp = np.zeros(nsample)
-        #    for j in range(nsample):
-        #        dist_sample_temp[j] = np.sqrt(np.sum((dpop[j,:] - bpop[k,:])**2)) 
-        #        
-        #
-        #    ks2stat, _ = ks_2samp(dist_sample0, dist_sample_temp)
-        #    scores[i] += ks2stat / nsample
-            
-        dist_sample_temp = cdist(bpop, dpop)
-        for row in dist_sample_temp:
-            ks2stat, _ = ks_2samp(dist_sample0, row)
-            scores[i] += ks2stat
-        scores[i] /= nsample
-    return scores
\ No newline at end of file
+
+    return _kse(X, nsample, random_state, n_jobs)
@@ -2,9 +2,71 @@
 
 from .base import BaseAnomalyDetector
 
-from sklearn.neighbors import NearestNeighbors
 import numpy as np
 
+from .neighborhood.approximate import make_neighbors
+from .utils import maybe_default_random_state
+
+
+def _rowwise_searchsorted(a, v):
+    """np.searchsorted(a[i], v[i], side='right') for every row i.
+
+    The values are replaced by their rank among all values, which keeps the
+    order and the ties exactly, and row i is offset by i times the number of
+    ranks. The rows of `a` then form one sorted array and a single
+    np.searchsorted call counts every row at once.
+
+    Parameters
+    ----------
+    a : array, shape (n_rows, n_columns)
+        Every row sorted in increasing order.
+
+    v : array, shape (n_rows, n_values)
+
+    Returns
+    -------
+    counts : array, shape (n_rows, n_values)
+        Number of elements of a[i] which are <= v[i, j].
+    """
+    n_rows, n_columns = a.shape
+    _, ranks = np.unique(np.concatenate((a.ravel(), v.ravel())),
+                         return_inverse=True)
+    offsets = np.arange(n_rows)[:, None] * (ranks.max() + 1)
+    a_ranks = ranks[:a.size].reshape(a.shape) + offsets
+    v_ranks = ranks[a.size:].reshape(v.shape) + offsets
+
+    counts = np.searchsorted(a_ranks.ravel(), v_ranks.ravel(), side='right')
+    return counts.reshape(v.shape) - np.arange(n_rows)[:, None] * n_columns
+
+
+def _zscore_mdef(n, n_hat, sigma):
+    # MDEF / sigma_MDEF, or 0 where the point is not less dense than its
+    # neighborhood (k_sigma in the paper)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mdef = (n_hat - n) / n_hat
+        sigma_mdef = sigma / n_hat
+        return np.where(mdef < 1e-16, 0., mdef / sigma_mdef)
+
+
+def _unique_cells(coords, level):
+    """Unique rows of the cell coordinates at a level, which are < 2^level.
+
+    Returns the unique cells, the cell of every row and the number of rows
+    in every cell. When all coordinates fit in 62 bits they are packed into
+    one int64 key per row, which is much faster than np.unique(axis=0).
+    """
+    n_bits = level + 1
+    if coords.shape[1] * n_bits > 62:
+        return np.unique(coords, axis=0, return_inverse=True,
+                         return_counts=True)
+
+    keys = (coords << (n_bits * np.arange(coords.shape[1]))).sum(axis=1)
+    _, first, inverse, counts = np.unique(keys, return_index=True,
+                                          return_inverse=True,
+                                          return_counts=True)
+    return coords[first], inverse, counts
+
+
 class LOCI(BaseAnomalyDetector):
     """The LOCI method
 
@@ -14,27 +76,48 @@ class LOCI(BaseAnomalyDetector):
     n_min : int
         Number of neighbors that must be included in the smallest radius
         (default: 20)
-        
+
     alpha : float
         Ratio of counting neighborhood radius to sampling neighborhood radius
         (default: 0.5)
-    
+
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see neighborhood.NeighborhoodGraph.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index.
+
+    batch_size : int, optional (default=10000)
+        Bounds the number of neighbor distance rows, batch * n_max, whose
+        counts are computed at a time. The temporary arrays hold
+        batch_size * n_max elements.
 
     References
     ----------
     S. Papadimitriou, H. Kitagawa, P. B. Gibbons "LOCI: Fast Outlier Detection Using the Local Correlation Integral"
     """
-    
-    def __init__(self, n_max=100, alpha=0.5):
+
+    def __init__(self, n_max=100, alpha=0.5, algorithm='exact',
+                 algorithm_params=None, batch_size=10000):
         self.n_max = n_max
         self.alpha = alpha
-    
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
+        self.batch_size = batch_size
+
     def fit(self, X=None, y=None):
         return self
-    
+
     def predict(self, X):
         """Calculate MDEF vs sigma_mdef for each sample in X
 
+        The sampling radii of a sample are the distances to its n_max
+        nearest neighbors. The counts of the alpha * r neighborhoods of all
+        the samples in every sampling neighborhood are read off the sorted
+        neighbor distances with np.searchsorted, a batch of samples at a
+        time.
+
         Parameters
         ----------
         X : array-like, shape (n_samples, n_features)
@@ -45,41 +128,165 @@ class LOCI(BaseAnomalyDetector):
         lof : array, shape (n_samples,)
             Local outlier factor for each sample.
         """
-        
-        nbrs = NearestNeighbors(n_neighbors=self.n_max).fit(X)
+
+        nbrs = make_neighbors(self.algorithm, self.n_max,
+                              self.algorithm_params).fit(X)
+        # note that indices[i] includes i, and distances[i] is sorted
         distances, indices = nbrs.kneighbors(X)
-        
-        num_rows = X.shape[0]
-        
+
+        num_rows, m = distances.shape
+        rows_per_batch = max(1, self.batch_size // m)
+
+        # Sampling neighborhood of radius distances[i, j] holds the j+1
+        # nearest neighbors of point i
+        in_sampling = np.tri(m, dtype=bool).T
+        sampling_n = np.arange(1, m + 1)
+
         k_sigma = np.empty(num_rows)
-        for i in xrange(num_rows):
-            max_zscore_mdef = -np.inf
-            for j in range(0, distances.shape[1]):
-                r = distances[i, j]
-                
-                n = np.sum(distances[i] <=  self.alpha*r)
-                # note that indices[i] includes i
-                # indices[i, :(j+1)] => j+1 neighbors of point i (point i plus additional j neighbors)
-                # distances[...] the neighbor distances for point i and point i's j neighbors
-                # neighborhood_n => counts for the neighborhood size of each of the points in point i's neighborhood
-                neighborhood_n = (distances[indices[i, :(j+1)]] <= self.alpha*r).sum(axis=1)
-                n = neighborhood_n[0]
-                n_hat = np.mean(neighborhood_n)
-                sigma = np.std(neighborhood_n)
-                
-                mdef = (n_hat - n) / n_hat
-                sigma_mdef = sigma/n_hat
-                          
-                #k_sigma in paper
-                if mdef < 1e-16:
-                    zscore_mdef = 0.0
-                else:
-                    zscore_mdef = mdef / sigma_mdef
-
-                if max_zscore_mdef < zscore_mdef:
-                    max_zscore_mdef = zscore_mdef
-                    
-
-            k_sigma[i] = max_zscore_mdef
-            
-        return k_sigma
\ No newline at end of file
+        for start in xrange(0, num_rows, rows_per_batch):
+            stop = min(start + rows_per_batch, num_rows)
+            b = stop - start
+
+            # counts[i, p, j] : size of the alpha*r counting neighborhood of
+            # the p-th neighbor of point i, for r = distances[i, j]
+            radii = self.alpha * distances[start:stop]
+            neighbor_dists = distances[indices[start:stop]].reshape(b * m, m)
+            counts = _rowwise_searchsorted(
+                neighbor_dists, np.repeat(radii, m, axis=0)).reshape(b, m, m)
+            counts = np.where(in_sampling, counts, 0)
+
+            n = counts[:, 0, :]
+            n_hat = counts.sum(axis=1) / sampling_n.astype(float)
+            deviations = np.where(in_sampling,
+                                  (counts - n_hat[:, None, :])**2, 0.)
+            sigma = np.sqrt(deviations.sum(axis=1) / sampling_n)
+
+            k_sigma[start:stop] = _zscore_mdef(n, n_hat, sigma).max(axis=1)
+
+        return k_sigma
+
+
+class aLOCI(BaseAnomalyDetector):
+    """Approximate LOCI with box counting
+
+    The data are scaled to [0, 1/2)^d and covered by `n_grids` grids, the
+    first one aligned with the data and the others shifted by up to 1/2 in
+    every dimension. At level l a grid has cells of side 2^-l, so the one
+    cell at level 0 holds all points. The sampling neighborhood of
+    a point at level l is its cell at level l, and its counting
+    neighborhood its cell at level l + alpha_level, which is alpha =
+    2^-alpha_level times smaller. For each point and level the grid whose
+    sampling cell has its center closest to the point is used.
+
+    The average and the standard deviation of the counting neighborhood
+    sizes within a sampling cell are estimated from the sums S_q of the
+    q-th powers of the counts c of its counting cells, with
+    n_hat = S_2 / S_1 and sigma_n = sqrt(S_3 / S_1 - n_hat^2). Every level
+    is one pass of np.unique over the cell coordinates of each grid, so the
+    method runs in O(n_levels * n_grids * n log n) time.
+
+    Parameters
+    ----------
+    n_min : int, optional (default=20)
+        Sampling cells with fewer points are not used.
+
+    alpha_level : int, optional (default=4)
+        The ratio of counting to sampling radius is alpha = 2^-alpha_level.
+
+    n_grids : int, optional (default=10)
+        Number of grids. More grids give better centered neighborhoods.
+
+    max_level : int, optional (default=None)
+        The finest sampling level. If None, levels are added until no
+        sampling cell holds n_min points.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+        Seeds the shifts of the grids.
+
+    References
+    ----------
+    S. Papadimitriou, H. Kitagawa, P. B. Gibbons "LOCI: Fast Outlier Detection Using the Local Correlation Integral"
+    """
+
+    def __init__(self, n_min=20, alpha_level=4, n_grids=10, max_level=None,
+                 random_state=None):
+        self.n_min = n_min
+        self.alpha_level = alpha_level
+        self.n_grids = n_grids
+        self.max_level = max_level
+        self.random_state = random_state
+
+    def fit(self, X=None, y=None):
+        return self
+
+    def predict(self, X):
+        """Calculate the approximate MDEF vs sigma_mdef for each sample in X
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            New data to predict.
+
+        Returns
+        -------
+        k_sigma : array, shape (n_samples,)
+            Largest MDEF / sigma_MDEF of each sample over the levels.
+        """
+        X = np.asarray(X, dtype=float)
+        num_rows, d = X.shape
+        random_state = maybe_default_random_state(self.random_state)
+
+        # Scale to [0, 1/2)^d, keeping the aspect ratio, so the shifted
+        # points stay within the unit cube
+        span = (X.max(axis=0) - X.min(axis=0)).max()
+        scale = 2. * span * (1. + 1e-9) if span > 0 else 1.
+        X = (X - X.min(axis=0)) / scale
+        shifts = np.vstack((np.zeros(d),
+                            0.5 * random_state.rand(self.n_grids - 1, d)))
+
+        # Cell coordinates are int64
+        max_level = 62 - self.alpha_level
+        if self.max_level is not None:
+            max_level = min(self.max_level, max_level)
+
+        k_sigma = np.zeros(num_rows)
+        for level in xrange(max_level + 1):
+            counting_level = level + self.alpha_level
+            best_dist = np.full(num_rows, np.inf)
+            n, s1, s2, s3 = np.zeros((4, num_rows))
+
+            for shift in shifts:
+                Y = X + shift
+                counting = np.floor(Y * 2**counting_level).astype(np.int64)
+
+                # Counts of the counting cells, and the sampling cell of
+                # every counting cell
+                cells, cell_of_point, cell_counts = _unique_cells(
+                    counting, counting_level)
+                parent_of_cell = _unique_cells(cells >> self.alpha_level,
+                                               level)[1]
+                sums = [np.bincount(parent_of_cell, cell_counts**q)
+                        for q in (1, 2, 3)]
+
+                # Use the grid in which the point is closest to the center
+                # of its sampling cell
+                center = (np.floor(Y * 2**level) + 0.5) / 2**level
+                dist = np.abs(Y - center).max(axis=1)
+                closer = dist < best_dist
+                best_dist[closer] = dist[closer]
+                cell = cell_of_point[closer]
+                n[closer] = cell_counts[cell]
+                s1[closer], s2[closer], s3[closer] = [
+                    sum_q[parent_of_cell[cell]] for sum_q in sums]
+
+            populated = s1 >= self.n_min
+            if not populated.any():
+                break
+
+            n_hat = s2[populated] / s1[populated]
+            sigma = np.sqrt(np.maximum(s3[populated] / s1[populated] -
+                                       n_hat**2, 0.))
+            k_sigma[populated] = np.maximum(
+                k_sigma[populated], _zscore_mdef(n[populated], n_hat, sigma))
+
+        return k_sigma
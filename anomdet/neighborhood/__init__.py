@@ -1,4 +1,6 @@
+from .graph import NeighborhoodGraph, WeightedNeighborhoodGraph
 from .knn import KNN
 from .lof import LOF
+from .incremental_lof import IncrementalLOF
 from .cof import COF
 from .loop import LoOP
\ No newline at end of file
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils import check_random_state
+
+from .._config import get_config
+
+
+ALGORITHMS = ('exact', 'rp_forest', 'lsh')
+
+
+def make_neighbors(algorithm='exact', n_neighbors=5, algorithm_params=None):
+    '''
+    Create an unfitted nearest neighbor index.
+
+    Parameters
+    ----------
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        'exact' : sklearn's NearestNeighbors
+        'rp_forest' : RandomProjectionForest
+        'lsh' : RandomHyperplaneLSH
+
+    n_neighbors : int, optional (default=5)
+        Default number of neighbors returned by `kneighbors`.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the index, e.g.
+        {'n_trees': 20, 'random_state': 0} for 'rp_forest'.
+
+    Returns
+    -------
+    nbrs : object with `fit(X)` and `kneighbors(X, n_neighbors)` methods
+    '''
+    params = {} if algorithm_params is None else dict(algorithm_params)
+
+    if algorithm == 'exact':
+        return NearestNeighbors(n_neighbors=n_neighbors, **params)
+    elif algorithm == 'rp_forest':
+        return RandomProjectionForest(n_neighbors=n_neighbors, **params)
+    elif algorithm == 'lsh':
+        return RandomHyperplaneLSH(n_neighbors=n_neighbors, **params)
+    else:
+        raise ValueError("algorithm should be one of %s" % (ALGORITHMS,))
+
+
+class _CandidateNeighbors(object):
+    '''
+    Base class for approximate indices which return, for each query, a set
+    of candidate neighbors that are then ranked by their exact distance.
+
+    Subclasses implement `_fit(X)` and `_candidates(X)`. The latter returns
+    an int array of shape (n_queries, n_candidates) padded with -1.
+
+    The samples are stored, and the distances computed, in the dtype
+    configured with `anomdet.set_config`.
+    '''
+
+    def fit(self, X, y=None):
+        self._fit_X = np.asarray(X, dtype=get_config()['dtype'])
+        self._random_state = check_random_state(self.random_state)
+        self._exact = None
+        self._fit(self._fit_X)
+        return self
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        '''
+        Approximate nearest neighbors of each query.
+
+        Queries with fewer than `n_neighbors` distinct candidates fall back
+        to an exact search.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_queries, n_features), optional
+            Defaults to the fitted samples.
+
+        n_neighbors : int, optional
+            Defaults to the `n_neighbors` given at construction.
+
+        Returns
+        -------
+        distances : array, shape (n_queries, n_neighbors)
+
+        indices : array, shape (n_queries, n_neighbors)
+        '''
+        if X is None:
+            X = self._fit_X
+        X = np.asarray(X, dtype=self._fit_X.dtype)
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+
+        num_rows = X.shape[0]
+        distances = np.empty((num_rows, n_neighbors), dtype=X.dtype)
+        indices = np.empty((num_rows, n_neighbors), dtype=int)
+
+        for start in xrange(0, num_rows, self.batch_size):
+            stop = min(start + self.batch_size, num_rows)
+            distances[start:stop], indices[start:stop] = \
+                self._rank_candidates(X[start:stop],
+                                      self._candidates(X[start:stop]),
+                                      n_neighbors)
+
+        # Not enough candidates
+        missing = ~np.isfinite(distances[:, -1])
+        if missing.any():
+            if self._exact is None:
+                self._exact = NearestNeighbors().fit(self._fit_X)
+            distances[missing], indices[missing] = \
+                self._exact.kneighbors(X[missing], n_neighbors=n_neighbors)
+
+        if return_distance:
+            return distances, indices
+        return indices
+
+    def _rank_candidates(self, X, candidates, n_neighbors):
+        num_rows, n_candidates = candidates.shape
+
+        # Remove repeated candidates
+        candidates = np.sort(candidates, axis=1)
+        repeated = np.zeros(candidates.shape, dtype=bool)
+        repeated[:, 1:] = candidates[:, 1:] == candidates[:, :-1]
+        invalid = repeated | (candidates < 0)
+
+        diff = self._fit_X[candidates] - X[:, None, :]
+        distances = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+        distances[invalid] = np.inf
+
+        if n_candidates < n_neighbors:
+            pad = n_neighbors - n_candidates
+            distances = np.hstack((distances, np.inf * np.ones((num_rows, pad))))
+            candidates = np.hstack((candidates, -np.ones((num_rows, pad), dtype=int)))
+
+        rows = np.arange(num_rows)[:, None]
+        part = np.argpartition(distances, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        order = np.argsort(distances[rows, part], axis=1, kind='mergesort')
+        part = part[rows, order]
+
+        return distances[rows, part], candidates[rows, part]
+
+
+class RandomProjectionForest(_CandidateNeighbors):
+    """Approximate nearest neighbors with a forest of random projection trees
+
+    Each tree recursively splits the samples at the median of their
+    projections onto a random direction until at most `leaf_size` samples
+    remain. A query descends every tree to a leaf, and the samples in those
+    leaves are the candidate neighbors.
+
+    Parameters
+    ----------
+    n_neighbors : int, optional (default=5)
+        Default number of neighbors returned by `kneighbors`.
+
+    n_trees : int, optional (default=10)
+        Number of trees. More trees give a higher recall and slower queries.
+
+    leaf_size : int, optional (default=50)
+        Maximum number of samples in a leaf. It is raised to
+        2 * (n_neighbors + 1) if smaller, so each leaf holds enough samples.
+
+    batch_size : int, optional (default=100)
+        Number of queries processed at a time.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+
+    References
+    ----------
+    Dasgupta, S., Freund, Y. "Random projection trees and low dimensional
+    manifolds." Proceedings of the 40th annual ACM symposium on Theory of
+    computing, 2008.
+    """
+
+    def __init__(self, n_neighbors=5, n_trees=10, leaf_size=50,
+                 batch_size=100, random_state=None):
+        self.n_neighbors = n_neighbors
+        self.n_trees = n_trees
+        self.leaf_size = leaf_size
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def _fit(self, X):
+        leaf_size = max(self.leaf_size, 2 * (self.n_neighbors + 1))
+        self.trees = [self._build_tree(X, leaf_size)
+                      for _ in xrange(self.n_trees)]
+
+    def _build_tree(self, X, leaf_size):
+        rs = self._random_state
+        n, d = X.shape
+
+        # Nodes are numbered in the order they are created.
+        # children[node] = (left, right) for a split, (-1, leaf_id) for a leaf.
+        leaves = []
+        stack = [(0, np.arange(n))]
+        n_nodes = 1
+        node_data = {}
+        while stack:
+            node, members = stack.pop()
+            if len(members) <= leaf_size:
+                node_data[node] = (None, 0., -1, len(leaves))
+                leaves.append(members)
+                continue
+
+            direction = rs.randn(d)
+            proj = X[members].dot(direction)
+            threshold = np.median(proj)
+            go_left = proj <= threshold
+            if go_left.all() or not go_left.any():
+                # All projections are equal
+                node_data[node] = (None, 0., -1, len(leaves))
+                leaves.append(members)
+                continue
+
+            left, right = n_nodes, n_nodes + 1
+            n_nodes += 2
+            node_data[node] = (direction, threshold, left, right)
+            stack.append((left, members[go_left]))
+            stack.append((right, members[~go_left]))
+
+        directions = np.zeros((n_nodes, d))
+        thresholds = np.zeros(n_nodes)
+        children = np.empty((n_nodes, 2), dtype=int)
+        for node, (direction, threshold, left, right) in node_data.iteritems():
+            if direction is not None:
+                directions[node] = direction
+            thresholds[node] = threshold
+            children[node] = left, right
+
+        max_leaf = max(len(members) for members in leaves)
+        leaf_members = -np.ones((len(leaves), max_leaf), dtype=int)
+        for i, members in enumerate(leaves):
+            leaf_members[i, :len(members)] = members
+
+        return directions, thresholds, children, leaf_members
+
+    def _candidates(self, X):
+        candidates = []
+        for directions, thresholds, children, leaf_members in self.trees:
+            node = np.zeros(X.shape[0], dtype=int)
+            internal = children[node, 0] >= 0
+            while internal.any():
+                active = node[internal]
+                proj = np.einsum('ij,ij->i', X[internal], directions[active])
+                node[internal] = np.where(proj <= thresholds[active],
+                                          children[active, 0],
+                                          children[active, 1])
+                internal = children[node, 0] >= 0
+            candidates.append(leaf_members[children[node, 1]])
+        return np.hstack(candidates)
+
+
+class RandomHyperplaneLSH(_CandidateNeighbors):
+    """Approximate nearest neighbors with random hyperplane hashing
+
+    Each hash table assigns a sample an `n_bits` code given by the side of
+    `n_bits` random hyperplanes through the mean of the data it falls on.
+    The candidate neighbors of a query are the samples sharing its code in
+    any of the tables.
+
+    Parameters
+    ----------
+    n_neighbors : int, optional (default=5)
+        Default number of neighbors returned by `kneighbors`.
+
+    n_tables : int, optional (default=10)
+        Number of hash tables. More tables give a higher recall and slower
+        queries.
+
+    n_bits : int, optional (default=None)
+        Number of hyperplanes per table. If None, chosen so a bucket holds
+        about 2 * bucket_size samples on average.
+
+    bucket_size : int, optional (default=50)
+        At most this many samples are taken from a bucket as candidates.
+        It is raised to 2 * (n_neighbors + 1) if smaller.
+
+    batch_size : int, optional (default=100)
+        Number of queries processed at a time.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+
+    References
+    ----------
+    Charikar, M. S. "Similarity estimation techniques from rounding
+    algorithms." Proceedings of the 34th annual ACM symposium on Theory of
+    computing, 2002.
+    """
+
+    def __init__(self, n_neighbors=5, n_tables=10, n_bits=None,
+                 bucket_size=50, batch_size=100, random_state=None):
+        self.n_neighbors = n_neighbors
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.bucket_size = bucket_size
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def _fit(self, X):
+        rs = self._random_state
+        n, d = X.shape
+
+        self._bucket_size = max(self.bucket_size, 2 * (self.n_neighbors + 1))
+        n_bits = self.n_bits
+        if n_bits is None:
+            n_bits = int(np.log2(max(2., n / (2. * self._bucket_size))))
+        n_bits = max(1, min(n_bits, 62))
+
+        self._center = X.mean(axis=0)
+        self._powers = 2 ** np.arange(n_bits)
+
+        # Shuffle so truncated buckets are random subsets
+        self.tables = []
+        for _ in xrange(self.n_tables):
+            hyperplanes = rs.randn(d, n_bits)
+            codes = self._hash(X, hyperplanes)
+            order = rs.permutation(n)
+            order = order[np.argsort(codes[order], kind='mergesort')]
+            self.tables.append((hyperplanes, codes[order], order))
+
+    def _hash(self, X, hyperplanes):
+        bits = (X - self._center).dot(hyperplanes) > 0
+        return bits.dot(self._powers)
+
+    def _candidates(self, X):
+        offsets = np.arange(self._bucket_size)
+        candidates = []
+        for hyperplanes, sorted_codes, order in self.tables:
+            codes = self._hash(X, hyperplanes)
+            lo = np.searchsorted(sorted_codes, codes, side='left')
+            hi = np.searchsorted(sorted_codes, codes, side='right')
+            positions = lo[:, None] + offsets
+            valid = positions < hi[:, None]
+            members = order[np.minimum(positions, len(order) - 1)]
+            members[~valid] = -1
+            candidates.append(members)
+        return np.hstack(candidates)
@@ -0,0 +1,79 @@
+from sklearn.base import clone
+
+from ..utils.simple_timer import SimpleTimer
+from ..utils.tabulate import tabulate
+from .knn import KNN
+from .lof import LOF
+from .loop import LoOP
+
+
+def benchmark_approximate_neighbors(datasets, detectors=None,
+                                    algorithms=('rp_forest', 'lsh'),
+                                    algorithm_params=None, verbose=True):
+    '''
+    Compare the AUC and run time of neighborhood detectors using approximate
+    nearest neighbor search against the same detectors using exact search.
+
+    Parameters
+    ----------
+    datasets : list of OutlierDatasets
+        The datasets to compare on, e.g. `load_aloi()` and
+        `load_darpa_data()` once their data files have been downloaded.
+        Approximate search can only pay off on large, high-dimensional
+        data; on low-dimensional data the exact tree indices are faster.
+        Whether it does depends on the data and on `algorithm_params`, see
+        the speedup column.
+
+    detectors : list of detectors, optional
+        Detectors taking `algorithm` and `algorithm_params` parameters.
+        Defaults to KNN, LOF and LoOP with k=10.
+
+    algorithms : iterable of str, optional (default=('rp_forest', 'lsh'))
+        The approximate algorithms to compare.
+
+    algorithm_params : dict, optional (default=None)
+        Maps an algorithm to its `algorithm_params`, e.g.
+        {'rp_forest': {'n_trees': 5, 'random_state': 0}}.
+
+    verbose : boolean, optional (default=True)
+        Print a table of the results.
+
+    Returns
+    -------
+    rows : list of [dataset name, detector name, algorithm, exact AUC,
+                    approximate AUC, AUC difference, speedup]
+    '''
+    if detectors is None:
+        detectors = [KNN(k=10), LOF(k=10), LoOP(k=10)]
+    if algorithm_params is None:
+        algorithm_params = {}
+
+    timer = SimpleTimer()
+
+    rows = []
+    for dat in datasets:
+        for detector in detectors:
+            clf = clone(detector).set_params(algorithm='exact')
+            timer.tic()
+            exact_auc = dat.evaluate(clf.fit(dat.X).predict(dat.X))
+            exact_time = timer.toc()
+
+            for algorithm in algorithms:
+                clf = clone(detector).set_params(
+                    algorithm=algorithm,
+                    algorithm_params=algorithm_params.get(algorithm))
+                timer.tic()
+                auc = dat.evaluate(clf.fit(dat.X).predict(dat.X))
+                approx_time = timer.toc()
+
+                rows.append([dat.name, type(detector).__name__, algorithm,
+                             exact_auc, auc, auc - exact_auc,
+                             exact_time / max(approx_time, 1e-6)])
+
+    if verbose:
+        print tabulate(rows, headers=["Dataset", "Detector", "Algorithm",
+                                      "Exact AUC", "Approx. AUC",
+                                      "Difference", "Speedup"],
+                       tablefmt="pipe", floatfmt=".3f")
+
+    return rows
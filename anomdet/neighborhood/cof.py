@@ -1,11 +1,115 @@
 # -*- coding: utf-8 -*-
 
+from functools import partial
+
 import numpy as np
-from scipy.spatial.distance import squareform, pdist
-from sklearn.neighbors import NearestNeighbors
 
 from ..base import BaseAnomalyDetector
-from ..utils import check_n_neighbors
+from .._config import get_config
+from ..utils import check_n_neighbors, predict_in_chunks
+from .graph import NeighborhoodGraph, WeightedNeighborhoodGraph
+from .graph import _weighted_kneighbors, _neighbor_sum, _expand
+
+
+def _average_chaining_distances(X, X_ref, indices, batch_size=10000,
+                                counts=None):
+    """Compute the average chaining distance of each sample to its neighbors.
+
+    The set-based nearest path (SBN-path) through a sample and its k
+    neighbors is built greedily: starting from the sample, the point outside
+    the path closest to any point on the path is added next. This is Prim's
+    algorithm, which is run for a whole batch of samples at once on a
+    (batch, k+1, k+1) distance tensor.
+
+    Parameters
+    ----------
+    X : array, shape (n_samples, n_features)
+        The samples.
+
+    X_ref : array, shape (n_ref_samples, n_features)
+        The samples the neighbors are drawn from.
+
+    indices : array, shape (n_samples, k)
+        Indices into X_ref of the k nearest neighbors of each sample.
+
+    batch_size : int, optional (default=10000)
+        Bounds the number of points, batch * (k+1), processed at a time.
+
+    counts : array, shape (n_samples, m), optional (default=None)
+        Multiplicity of each neighbor, see WeightedNeighborhoodGraph, with
+        every row summing to k. The SBN-path runs through every copy of a
+        neighbor, so the copies after the first add edges of length zero
+        right after it. If None, every neighbor counts once.
+
+    Returns
+    -------
+    ac_dist : array, shape (n_samples,)
+        Average chaining distance of each sample, in the configured dtype.
+    """
+    num_rows, m = indices.shape
+    k = m if counts is None or num_rows == 0 else counts[0].sum()
+    dtype = get_config()['dtype']
+    rows_per_batch = max(1, batch_size // (m + 1))
+
+    # The i-th edge of the SBN-path gets weight 2(k+1-i) / (k(k+1))
+    weights = np.arange(k, 0, -1) * 2. / k / (k + 1)
+
+    ac_dist = np.empty(num_rows, dtype=dtype)
+    for start in xrange(0, num_rows, rows_per_batch):
+        stop = min(start + rows_per_batch, num_rows)
+        b = stop - start
+        rows = np.arange(b)
+
+        # points[:, 0] is the sample itself, points[:, 1:] its neighbors
+        points = np.concatenate((X[start:stop, None, :],
+                                 X_ref[indices[start:stop]]),
+                                axis=1).astype(dtype, copy=False)
+        dists = np.empty((b, m + 1, m + 1), dtype=dtype)
+        for j in xrange(m + 1):
+            diff = points - points[:, j:(j+1), :]
+            dists[:, :, j] = np.sqrt((diff**2).sum(axis=2))
+
+        # min_cost : distance from the SBN-path to each point outside of it
+        in_path = np.zeros((b, m + 1), dtype=bool)
+        in_path[:, 0] = True
+        if counts is not None:
+            # Neighbors beyond the k-th sample are left out of the path
+            in_path[:, 1:] = counts[start:stop] == 0
+            n_edges = np.zeros(b, dtype=int)
+        min_cost = dists[:, 0, :].copy()
+        sbn_cost = np.zeros((b, k), dtype=dtype)
+        for j in xrange(m):
+            cost = np.where(in_path, np.inf, min_cost)
+            nearest = np.argmin(cost, axis=1)
+            if counts is None:
+                sbn_cost[:, j] = cost[rows, nearest]
+            else:
+                added = rows[~in_path[rows, nearest]]
+                sbn_cost[added, n_edges[added]] = cost[added, nearest[added]]
+                n_edges[added] += counts[start + added, nearest[added] - 1]
+            in_path[rows, nearest] = True
+            min_cost = np.minimum(min_cost, dists[rows, nearest, :])
+
+        ac_dist[start:stop] = sbn_cost.dot(weights)
+
+    return ac_dist
+
+
+def _graph_rows(graph):
+    # The samples the neighbor indices of the graph point to
+    if isinstance(graph, WeightedNeighborhoodGraph):
+        return graph.X_unique
+    return graph.X
+
+
+def _predict_new(clf, X):
+    # COF of new samples, with chaining distances to the fitted samples
+    _, indices, weights = _weighted_kneighbors(clf.graph, X, clf.n_neighbors,
+                                               n_jobs=1)
+    ac_dist = _average_chaining_distances(X, _graph_rows(clf.graph), indices,
+                                          clf.batch_size, weights)
+    return (clf.n_neighbors * ac_dist /
+            _neighbor_sum(clf.ac_dist[indices], weights))
 
 
 class COF(BaseAnomalyDetector):
@@ -24,44 +128,111 @@ class COF(BaseAnomalyDetector):
                 Represents number of neighbors to use as a fraction of the
                 total number of samples.
 
+    batch_size : int, optional (default=10000)
+        Bounds the number of points processed at a time when building the
+        set-based nearest paths.
+
+    chunk_size : int, optional (default=None)
+        Number of rows of new data queried and scored at a time, see
+        `predict`. If None, all rows at once.
+
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see NeighborhoodGraph.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index.
+
+    n_jobs : int, optional (default=1)
+        Number of worker processes, see NeighborhoodGraph.
+
+    collapse_duplicates : boolean, optional (default=False)
+        Collapse exact duplicate rows to unique rows with counts, see
+        WeightedNeighborhoodGraph. The neighbors are searched and the scores
+        computed for the unique rows only, with each neighbor weighted by
+        its multiplicity, and the scores are expanded back to every sample.
+        The scores are those of the uncollapsed data, up to ties.
+
     References
     ----------
     "Enhancing Effectiveness of Outlier Detections for Low Density Patterns"
     Authors: Jian Tang, Zhixiang Chen, Ada Wai-chee Fu, David W. Cheung
     """
     
-    def __init__(self, k=5):
+    def __init__(self, k=5, batch_size=10000, chunk_size=None,
+                 algorithm='exact', algorithm_params=None, n_jobs=1,
+                 collapse_duplicates=False):
         self.k = k
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
+        self.n_jobs = n_jobs
+        self.collapse_duplicates = collapse_duplicates
     
-    def fit(self, X=None, y=None):
+    def fit(self, X=None, y=None, graph=None):
         '''
         Parameters
         ----------
         X : array-like, shape (n_samples, n_features)
         
         y : unused parameter
+        
+        graph : NeighborhoodGraph, optional (default=None)
+            Precomputed neighborhood graph, or WeightedNeighborhoodGraph, to
+            use instead of building one from X. Its k_max must be at least
+            the number of neighbors used by this detector.
         '''
         
         # Clear previous
-        if hasattr(self, 'n_neighbors'):
-            delattr(self, 'n_neighbors')
-        if hasattr(self, 'nbrs'):
-            delattr(self, 'nbrs')
+        for attr in ['n_neighbors', 'graph', 'ac_dist', 'cof']:
+            if hasattr(self, attr):
+                delattr(self, attr)
         
-        if X is not None:
+        if graph is not None:
+            self.n_neighbors = check_n_neighbors(self.k, graph.n_samples)
+            if self.n_neighbors > graph.n_neighbors:
+                raise ValueError("k is greater than the k_max of the "
+                                 "neighborhood graph!")
+            self.graph = graph
+        elif X is not None:
             n = X.shape[0]
             self.n_neighbors = check_n_neighbors(self.k, n)
-            self.nbrs = NearestNeighbors(n_neighbors=self.n_neighbors+1).fit(X)
+            graph_class = (WeightedNeighborhoodGraph
+                           if self.collapse_duplicates else NeighborhoodGraph)
+            self.graph = graph_class(
+                k_max=self.n_neighbors, algorithm=self.algorithm,
+                algorithm_params=self.algorithm_params,
+                n_jobs=self.n_jobs).fit(X)
+        
+        if hasattr(self, 'graph'):
+            # Statistics of the reference set, used to score new samples.
+            # With collapsed duplicates, ac_dist is that of the unique rows.
+            _, indices, weights = _weighted_kneighbors(self.graph, None,
+                                                       self.n_neighbors)
+            X_ref = _graph_rows(self.graph)
+            self.ac_dist = _average_chaining_distances(X_ref, X_ref, indices,
+                                                       self.batch_size,
+                                                       weights)
+            self.cof = _expand(self.graph,
+                               self.n_neighbors * self.ac_dist /
+                               _neighbor_sum(self.ac_dist[indices], weights))
         
         return self
         
-    def predict(self, X):
+    def predict(self, X=None, out=None):
         """Calculate connectivity-based outlier factor for each sample in X
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            New data to predict.
+        X : array-like, shape (n_samples, n_features), optional
+            New data to predict. If None, the samples the neighborhood graph
+            was fitted on are scored. New data is scored against the average
+            chaining distances of the fitted samples, `chunk_size` rows at a
+            time, so it can be an np.memmap which does not fit in memory.
+
+        out : array-like, shape (n_samples,), optional (default=None)
+            Preallocated output, e.g. an np.memmap.
 
         Returns
         -------
@@ -71,47 +242,11 @@ class COF(BaseAnomalyDetector):
         if not hasattr(self, 'n_neighbors'):
             self.fit(X)
         
-        nbrs = self.nbrs
-        distances, indices = nbrs.kneighbors(X)
-        
-        exists_dupl = distances[:, 0] == 0.
-        distances[exists_dupl, :-1] = distances[exists_dupl, 1:]
-        indices[exists_dupl, :-1] = indices[exists_dupl, 1:]
-        distances = distances[:, :-1]
-        indices = indices[:, :-1]
-        
-        k_dists = distances[:, -1]
-        
-        num_rows = X.shape[0]
-        
-        ac_dist = np.zeros((num_rows, 1));
-        for i in range(num_rows):
-            neigh_ind = np.append(i, indices[i, :])
-            dists = squareform(pdist(X[neigh_ind, :]))
-            sbn_path = [0]
-            out = np.arange(1, self.k+1)  # out : the points "outside" the sbn_path
-            sbn_cost = np.zeros((1, self.k))
-            
-            for j in range(self.k):
-                # distance from sbn_path to points outside
-                dist_path_out = dists[np.ix_(sbn_path, out)]  
-                min_cost = np.min(dist_path_out)
-                sbn_cost[0, j] = min_cost
-                
-                # min_X min_Y : coord of the minimum element 
-                # in the matrix dist_path_out
-                idx = np.argmin(dist_path_out)
-                min_X, min_Y = idx/dist_path_out.shape[1], idx%dist_path_out.shape[1]
-                
-                # add to the sbn_path and remove it from the set of points to consider
-                sbn_path.append(out[min_Y])
-                out = np.append(out[:min_Y], out[(min_Y+1):])
-
-            weight_vec = np.arange(self.k, 0, -1)
-            ac_dist[i] = np.dot(sbn_cost, weight_vec)*2/self.k/(self.k+1)
-        
-        cof = np.zeros(num_rows);
-        for i in range(num_rows):
-            cof[i] = self.k * ac_dist[i] / sum(ac_dist[indices[i]]);
+        if X is None or X is self.graph.X:
+            if out is None:
+                return self.cof.copy()
+            out[:] = self.cof
+            return out
         
-        return(cof)
+        return predict_in_chunks(partial(_predict_new, self), X,
+                                 self.chunk_size, out, self.n_jobs)
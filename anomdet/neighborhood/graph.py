@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+from functools import partial
+
+import numpy as np
+
+from .._config import get_config
+from ..utils import check_n_neighbors, iter_chunks, effective_n_jobs
+from ..utils import unique_rows, map_row_blocks
+from .approximate import make_neighbors
+
+
+def _kneighbors_excluding_self(nbrs, X, n_neighbors, dtype=np.float64):
+    distances, indices = nbrs.kneighbors(X, n_neighbors=n_neighbors+1)
+    distances = distances.astype(dtype, copy=False)
+
+    exists_dupl = distances[:, 0] == 0.
+    distances[exists_dupl, :-1] = distances[exists_dupl, 1:]
+    indices[exists_dupl, :-1] = indices[exists_dupl, 1:]
+
+    return distances[:, :-1], indices[:, :-1]
+
+
+def _kneighbors_with_counts(nbrs, X, n_columns, counts, dtype=np.float64):
+    distances, indices = nbrs.kneighbors(X, n_neighbors=n_columns)
+    distances = distances.astype(dtype, copy=False)
+
+    # A zero distance is the query itself, or one of its duplicates, which
+    # leaves the other copies as neighbors
+    neighbor_counts = counts[indices]
+    neighbor_counts[distances[:, 0] == 0., 0] -= 1
+
+    return distances, indices, neighbor_counts
+
+
+def _truncate_counts(neighbor_counts, n_neighbors):
+    # Multiplicity of each neighbor among the first n_neighbors samples
+    preceding = neighbor_counts.cumsum(axis=1) - neighbor_counts
+    return np.clip(n_neighbors - preceding, 0, neighbor_counts)
+
+
+def _weighted_kneighbors(graph, X=None, n_neighbors=None, n_jobs=None):
+    """Neighbors in either kind of graph, with the multiplicity of each
+    neighbor as weights, which are None for a NeighborhoodGraph."""
+    if isinstance(graph, WeightedNeighborhoodGraph):
+        return graph.kneighbors(X, n_neighbors, n_jobs)
+    distances, indices = graph.kneighbors(X, n_neighbors, n_jobs)
+    return distances, indices, None
+
+
+def _neighbor_sum(values, weights=None):
+    """Sum over the neighbors, axis 1, counting each neighbor weight times"""
+    if weights is None:
+        return values.sum(axis=1)
+    # Neighbors with weight 0 are left out, even if their value is inf
+    with np.errstate(invalid='ignore'):
+        weighted = weights * values
+    weighted[weights == 0] = 0
+    return weighted.sum(axis=1)
+
+
+def _neighbor_mean(values, weights=None):
+    """Mean over the neighbors, axis 1, counting each neighbor weight times"""
+    if weights is None:
+        return values.mean(axis=1)
+    return _neighbor_sum(values, weights) / weights.sum(axis=1)
+
+
+def _k_distances(distances, weights=None):
+    """Distance to the k-th nearest neighbor, the last one with a weight"""
+    if weights is None:
+        return distances[:, -1]
+    last = weights.shape[1] - 1 - np.argmax(weights[:, ::-1] > 0, axis=1)
+    return distances[np.arange(distances.shape[0]), last]
+
+
+def _expand(graph, values):
+    """Values of the fitted samples from the values of the rows of the graph"""
+    if isinstance(graph, WeightedNeighborhoodGraph):
+        return values[graph.inverse]
+    return values
+
+
+class NeighborhoodGraph(object):
+    """k-nearest neighbor graph which can be shared between detectors
+
+    The neighbors of the fitted samples are queried once, for `k_max`
+    neighbors, and every detector fitted with the graph slices the
+    neighborhoods to its own k. A sample's zero distance to itself (or to one
+    of its duplicates) is removed once here instead of in each detector.
+
+    Parameters
+    ----------
+    k_max : int or float, optional (default=10)
+
+        The largest number of neighbors any detector will use.
+
+        If
+            int : 1 <= k_max < n_samples
+                The exact number of neighbors
+            float : Then 0.0 < k_max < 1.0
+                Represents number of neighbors to use as a fraction of the
+                total number of samples.
+
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see RandomProjectionForest and RandomHyperplaneLSH.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index, e.g.
+        {'n_trees': 20} to trade speed for recall with 'rp_forest'.
+
+    n_jobs : int, optional (default=1)
+        Number of worker processes the query rows are split over, both for
+        the neighbors of the fitted samples and for new data. -1 means all
+        CPUs. The fitted index and the query rows are dumped once to a
+        temporary folder and memory-mapped by the workers, so each job only
+        carries a row range, see `anomdet.utils.map_row_blocks`. Detectors
+        taking `n_jobs` score new data in the same way.
+
+    The distances are returned in the dtype configured with
+    `anomdet.set_config`.
+
+    Examples
+    --------
+    >>> graph = NeighborhoodGraph(k_max=20).fit(X)
+    >>> lof = LOF(k=10).fit(graph=graph).predict(X)
+    >>> knn = KNN(k=5).fit(graph=graph).predict(X)
+    """
+
+    def __init__(self, k_max=10, algorithm='exact', algorithm_params=None,
+                 n_jobs=1):
+        self.k_max = k_max
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
+        self.n_jobs = n_jobs
+
+    def fit(self, X):
+        '''
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+        '''
+        self.X = X
+        self.n_samples = X.shape[0]
+        self.n_neighbors = check_n_neighbors(self.k_max, self.n_samples)
+        self.nbrs = make_neighbors(self.algorithm, self.n_neighbors+1,
+                                   self.algorithm_params).fit(X)
+
+        # Neighbors of the fitted samples are computed lazily, on first use
+        self.distances = None
+        self.indices = None
+
+        return self
+
+    def kneighbors(self, X=None, n_neighbors=None, n_jobs=None):
+        """Find the nearest neighbors of each sample, excluding the sample
+        itself
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features), optional
+            Query samples. If None, or if X is the array the graph was fitted
+            on, the precomputed neighborhoods are returned.
+
+        n_neighbors : int, optional (default=None)
+            Number of neighbors to return. Defaults to `k_max`.
+
+        n_jobs : int, optional (default=None)
+            Number of worker processes for the query. Defaults to the
+            `n_jobs` of the graph.
+
+        Returns
+        -------
+        distances : array, shape (n_samples, n_neighbors)
+
+        indices : array, shape (n_samples, n_neighbors)
+        """
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+
+        if X is None and n_neighbors > self.n_neighbors:
+            raise ValueError("n_neighbors is greater than the k_max of "
+                             "the neighborhood graph!")
+
+        if (X is None or X is self.X) and n_neighbors <= self.n_neighbors:
+            if self.distances is None:
+                self.distances, self.indices = self._query(self.X,
+                                                           self.n_neighbors,
+                                                           n_jobs)
+            return (self.distances[:, :n_neighbors],
+                    self.indices[:, :n_neighbors])
+
+        return self._query(X, n_neighbors, n_jobs)
+
+    def _query(self, X, n_neighbors, n_jobs=None):
+        query = partial(_kneighbors_excluding_self, self.nbrs,
+                        n_neighbors=n_neighbors, dtype=get_config()['dtype'])
+        return self._sharded(query, X, n_jobs)
+
+    def _sharded(self, query, X, n_jobs=None):
+        n_jobs = effective_n_jobs(self.n_jobs if n_jobs is None else n_jobs)
+        if n_jobs == 1:
+            return query(X)
+
+        # Shard the query rows over the workers and stitch them back in order
+        chunk_size = int(np.ceil(X.shape[0] / float(n_jobs)))
+        results = map_row_blocks(query, X,
+                                 list(iter_chunks(X.shape[0], chunk_size)),
+                                 n_jobs)
+
+        return tuple(np.vstack(parts) for parts in zip(*results))
+
+
+class WeightedNeighborhoodGraph(NeighborhoodGraph):
+    """k-nearest neighbor graph of the unique rows of the data
+
+    Exact duplicate rows are collapsed to unique rows with counts, and the
+    neighbors are searched among the unique rows only. Each neighbor comes
+    with its multiplicity, so the k nearest neighbors of a sample are those
+    of the uncollapsed data: the other copies of the sample itself first,
+    then the copies of the nearest unique rows, until k samples are
+    counted. Detectors weighting their density estimates by these
+    multiplicities give the same scores as on the uncollapsed data, up to
+    ties between equally distant neighbors.
+
+    Parameters are those of NeighborhoodGraph.
+
+    Attributes
+    ----------
+    X_unique : array, shape (n_unique, n_features)
+        The unique rows of X.
+
+    counts : array, shape (n_unique,)
+        The number of copies of each unique row in X.
+
+    inverse : array, shape (n_samples,)
+        The unique row of each sample, X = X_unique[inverse].
+    """
+
+    def fit(self, X):
+        '''
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+        '''
+        self.X = X
+        self.n_samples = X.shape[0]
+        self.n_neighbors = check_n_neighbors(self.k_max, self.n_samples)
+        self.X_unique, self.inverse, self.counts = unique_rows(
+            np.asarray(X), return_inverse=True, return_counts=True)
+        self.nbrs = make_neighbors(self.algorithm, self._n_columns(),
+                                   self.algorithm_params).fit(self.X_unique)
+
+        # Neighbors of the unique rows are computed lazily, on first use
+        self.distances = None
+        self.indices = None
+        self.neighbor_counts = None
+
+        return self
+
+    def kneighbors(self, X=None, n_neighbors=None, n_jobs=None):
+        """Find the nearest unique rows of each sample, with their
+        multiplicity
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features), optional
+            Query samples. If None, the precomputed neighborhoods of the
+            unique rows are returned, and if X is the array the graph was
+            fitted on, those of its samples.
+
+        n_neighbors : int, optional (default=None)
+            Number of neighbors, counted with multiplicity. Defaults to
+            `k_max`.
+
+        n_jobs : int, optional (default=None)
+            Number of worker processes for the query. Defaults to the
+            `n_jobs` of the graph.
+
+        Returns
+        -------
+        distances : array, shape (n_samples, n_columns)
+
+        indices : array, shape (n_samples, n_columns)
+            Indices into X_unique.
+
+        weights : array, shape (n_samples, n_columns)
+            Multiplicity of each neighbor among the n_neighbors nearest
+            samples. Each row sums to n_neighbors.
+        """
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+
+        if X is None and n_neighbors > self.n_neighbors:
+            raise ValueError("n_neighbors is greater than the k_max of "
+                             "the neighborhood graph!")
+
+        if (X is None or X is self.X) and n_neighbors <= self.n_neighbors:
+            if self.distances is None:
+                self.distances, self.indices, self.neighbor_counts = \
+                    self._query(self.X_unique, self.n_neighbors, n_jobs)
+            rows = slice(None) if X is None else self.inverse
+            n_columns = self._n_columns(n_neighbors)
+            distances = self.distances[rows, :n_columns]
+            indices = self.indices[rows, :n_columns]
+            neighbor_counts = self.neighbor_counts[rows, :n_columns]
+        else:
+            distances, indices, neighbor_counts = self._query(X, n_neighbors,
+                                                              n_jobs)
+
+        return (distances, indices,
+                _truncate_counts(neighbor_counts, n_neighbors))
+
+    def _n_columns(self, n_neighbors=None):
+        # The query itself and n_neighbors unique rows always hold at least
+        # n_neighbors other samples
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+        return min(n_neighbors + 1, self.X_unique.shape[0])
+
+    def _query(self, X, n_neighbors, n_jobs=None):
+        query = partial(_kneighbors_with_counts, self.nbrs,
+                        n_columns=self._n_columns(n_neighbors),
+                        counts=self.counts, dtype=get_config()['dtype'])
+        return self._sharded(query, X, n_jobs)
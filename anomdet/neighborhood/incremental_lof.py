@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from ..base import BaseAnomalyDetector
+from ..utils import check_n_neighbors
+from .graph import NeighborhoodGraph
+
+
+class IncrementalLOF(BaseAnomalyDetector):
+    """Local Outlier Factor with incremental insertion and deletion of samples
+
+    Keeps the k-nearest neighbor lists, the reverse k-nearest neighbor sets,
+    the k-distances, the local reachability densities and the local outlier
+    factors of the stored samples. When samples are inserted or deleted only
+    the samples whose neighborhoods are affected are updated:
+
+        1. the samples whose k-nearest neighbors change (the reverse
+           k-nearest neighbors of the inserted or deleted samples),
+        2. the samples whose lrd changes (1. and their reverse k-nearest
+           neighbors),
+        3. the samples whose LOF changes (2. and their reverse k-nearest
+           neighbors).
+
+    The nearest and reverse nearest neighbor queries are answered by an
+    index of KD-trees over the samples stored when it was last built, and a
+    buffer of the samples inserted since, which is scanned by brute force.
+    The index is rebuilt once `buffer_size` samples have been inserted,
+    deleted or have seen their k-distance grow, so the cost of an update
+    grows with the size of the change and the buffer, not with the number
+    of stored samples.
+
+    Samples are identified by the integer id they were given when they were
+    stored. Ids are assigned in order of insertion, starting at 0 for the
+    first sample given to `fit`, and are never reused.
+
+    Parameters
+    ----------
+    k : int, optional (default=5)
+        The number of neighbors to use.
+
+    buffer_size : int, optional (default=None)
+        Number of pending changes after which the neighbor index is
+        rebuilt. If None, ten times the square root of the number of stored
+        samples, and at least 1000.
+
+    References
+    ----------
+    Pokrajac, D., Lazarevic, A., Latecki, L. J. "Incremental local outlier
+    detection for data streams." IEEE Symposium on Computational Intelligence
+    and Data Mining, 2007.
+    """
+
+    def __init__(self, k=5, buffer_size=None):
+        self.k = k
+        self.buffer_size = buffer_size
+
+    def fit(self, X=None, y=None):
+        '''
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+
+        y : unused parameter
+        '''
+
+        # Clear previous
+        if hasattr(self, 'n_neighbors'):
+            delattr(self, 'n_neighbors')
+
+        if X is not None:
+            X = np.asarray(X, dtype=float)
+            n = X.shape[0]
+            self.n_neighbors = check_n_neighbors(self.k, n)
+            k = self.n_neighbors
+
+            self.X = X.copy()
+            self.alive = np.ones(n, dtype=bool)
+            self.n_stored = n
+
+            distances, indices = NeighborhoodGraph(k_max=k).fit(X).kneighbors()
+            self.knn_dist = np.array(distances)
+            self.knn_ind = np.array(indices)
+
+            self.rknn = [set() for _ in xrange(n)]
+            for p in xrange(n):
+                for o in self.knn_ind[p]:
+                    self.rknn[o].add(p)
+
+            self.lrd = np.empty(n)
+            self.lof = np.empty(n)
+            all_ids = np.arange(n)
+            self._update_lrd(all_ids)
+            self._update_lof(all_ids)
+            self._build_index()
+
+        return self
+
+    def partial_fit(self, X, y=None):
+        '''
+        Insert the samples in X, or fit on X if nothing is stored yet.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+
+        y : unused parameter
+        '''
+        if not hasattr(self, 'n_neighbors'):
+            return self.fit(X)
+
+        self.insert(X)
+        return self
+
+    @property
+    def ids(self):
+        '''Ids of the stored samples, in increasing order.'''
+        return np.flatnonzero(self.alive[:self.n_stored])
+
+    def insert(self, X_new):
+        """Insert samples and update the affected LOF values
+
+        Parameters
+        ----------
+        X_new : array-like, shape (n_new_samples, n_features)
+
+        Returns
+        -------
+        new_ids : array, shape (n_new_samples,)
+            Ids assigned to the inserted samples.
+        """
+        X_new = np.atleast_2d(np.asarray(X_new, dtype=float))
+        m = X_new.shape[0]
+        k = self.n_neighbors
+
+        first_new = self.n_stored
+        new_ids = np.arange(first_new, first_new + m)
+        self._reserve(self.n_stored + m)
+        self.X[new_ids] = X_new
+        self.alive[new_ids] = True
+        self.n_stored += m
+        for _ in xrange(m):
+            self.rknn.append(set())
+        self._index.add(new_ids)
+
+        # Stored samples which may have a new sample among their k nearest
+        # neighbors, found before the new samples get a k-distance
+        candidates = self._index.reverse_candidates(X_new)
+        candidates = candidates[candidates < first_new]
+        candidates = candidates[self.alive[candidates]]
+
+        # Neighbors of the new samples among all stored samples
+        self._set_neighbors(new_ids, *self._kneighbors(X_new, new_ids))
+
+        # Stored samples which have a new sample among their k nearest
+        # neighbors: d(p, q) <= k-distance(p)
+        D_old = _distances(self.X[candidates], X_new)
+        changed = (D_old <= self.knn_dist[candidates, -1][:, None]).any(axis=1)
+        changed_ids = candidates[changed]
+        if changed.any():
+            merged_dist = np.hstack((self.knn_dist[changed_ids],
+                                     D_old[changed]))
+            merged_ind = np.hstack((self.knn_ind[changed_ids],
+                                    np.tile(new_ids, (changed.sum(), 1))))
+            order = np.argsort(merged_dist, axis=1, kind='mergesort')[:, :k]
+            rows = np.arange(order.shape[0])[:, None]
+            self._set_neighbors(changed_ids,
+                                merged_dist[rows, order],
+                                merged_ind[rows, order])
+
+        self._propagate(np.append(changed_ids, new_ids))
+        self._maybe_rebuild_index()
+
+        return new_ids
+
+    def delete(self, ids):
+        """Delete samples and update the affected LOF values
+
+        Parameters
+        ----------
+        ids : int or array-like of int
+            Ids of the samples to delete.
+        """
+        ids = np.unique(np.atleast_1d(ids))
+        if np.any(ids >= self.n_stored) or not self.alive[ids].all():
+            raise ValueError("Can only delete samples which are stored!")
+        if self.alive[:self.n_stored].sum() - len(ids) <= self.n_neighbors:
+            raise ValueError("Too few samples would remain for k neighbors!")
+
+        self.alive[ids] = False
+        self._index.remove(ids)
+
+        # Samples which lose a neighbor
+        affected = set()
+        for c in ids:
+            affected.update(self.rknn[c])
+            for o in self.knn_ind[c]:
+                self.rknn[o].discard(c)
+            self.rknn[c] = set()
+        affected = np.array(sorted(p for p in affected if self.alive[p]),
+                            dtype=int)
+
+        if len(affected) > 0:
+            self._set_neighbors(affected,
+                                *self._kneighbors(self.X[affected], affected))
+            # Their k-distances grew, so their reverse queries are answered
+            # by the buffer until the index is rebuilt
+            self._index.widen(affected)
+
+        self._propagate(affected)
+        self._maybe_rebuild_index()
+
+    def predict(self, X=None):
+        """Calculate local outlier factor
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features), optional
+            New data to predict against the stored samples, without inserting
+            it. If None, the local outlier factors of the stored samples are
+            returned, in the order of `ids`.
+
+        Returns
+        -------
+        lof : array, shape (n_samples,)
+            Local outlier factor for each sample.
+        """
+        if X is None:
+            return self.lof[self.ids]
+
+        k = self.n_neighbors
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        distances, indices = self._kneighbors(X)
+
+        reachability_dists = np.maximum(distances,
+                                        self.knn_dist[indices, -1])
+        lrd_value = k / reachability_dists.sum(axis=1)
+        return self.lrd[indices].sum(axis=1) / lrd_value / k
+
+    def _propagate(self, changed):
+        # lrd changes for samples whose neighbors changed and for samples
+        # which have those among their neighbors; LOF changes one step further
+        update_lrd = self._with_reverse_neighbors(changed)
+        self._update_lrd(update_lrd)
+        self._update_lof(self._with_reverse_neighbors(update_lrd))
+
+    def _with_reverse_neighbors(self, ids):
+        result = set(ids)
+        for p in ids:
+            result.update(self.rknn[p])
+        return np.array(sorted(result), dtype=int)
+
+    def _update_lrd(self, ids):
+        if len(ids) == 0:
+            return
+        k = self.n_neighbors
+        indices = self.knn_ind[ids]
+        reachability_dists = np.maximum(self.knn_dist[ids],
+                                        self.knn_dist[indices, -1])
+        self.lrd[ids] = k / reachability_dists.sum(axis=1)
+
+    def _update_lof(self, ids):
+        if len(ids) == 0:
+            return
+        k = self.n_neighbors
+        self.lof[ids] = (self.lrd[self.knn_ind[ids]].sum(axis=1) /
+                         self.lrd[ids] / k)
+
+    def _kneighbors(self, X, ids=None):
+        # Sorted k nearest stored samples of the rows of X, excluding the
+        # samples `ids` the rows are, and their ids
+        k = self.n_neighbors
+        n_self = 0 if ids is None else 1
+        candidates = self._index.kneighbors_candidates(X, k + n_self)
+        D = np.sqrt(np.maximum(
+            ((self.X[candidates] - X[:, None, :])**2).sum(axis=2), 0.))
+        D[~self.alive[candidates]] = np.inf
+        if ids is not None:
+            D[candidates == ids[:, None]] = np.inf
+
+        part = np.argpartition(D, k - 1, axis=1)[:, :k]
+        rows = np.arange(D.shape[0])[:, None]
+        order = np.argsort(D[rows, part], axis=1, kind='mergesort')
+        part = part[rows, order]
+        return D[rows, part], candidates[rows, part]
+
+    def _build_index(self):
+        ids = self.ids
+        self._index = _NeighborIndex(self.X, ids, self.knn_dist[ids, -1])
+
+    def _maybe_rebuild_index(self):
+        buffer_size = self.buffer_size
+        if buffer_size is None:
+            buffer_size = max(1000, int(10 * np.sqrt(len(self._index.ids))))
+        if self._index.n_pending > buffer_size:
+            self._build_index()
+
+    def _set_neighbors(self, ids, distances, indices):
+        for p, new in zip(ids, indices):
+            old = self.knn_ind[p]
+            for o in set(old).difference(new):
+                self.rknn[o].discard(p)
+            for o in new:
+                self.rknn[o].add(p)
+        self.knn_dist[ids] = distances
+        self.knn_ind[ids] = indices
+
+    def _reserve(self, n):
+        # Grow the storage geometrically so insertions are amortized O(1)
+        capacity = self.X.shape[0]
+        if n <= capacity:
+            return
+        capacity = max(n, 2 * capacity)
+        extra = capacity - self.X.shape[0]
+
+        self.X = np.vstack((self.X, np.zeros((extra, self.X.shape[1]))))
+        self.alive = np.append(self.alive, np.zeros(extra, dtype=bool))
+        self.knn_dist = np.vstack((self.knn_dist,
+                                   np.zeros((extra, self.n_neighbors))))
+        self.knn_ind = np.vstack((self.knn_ind,
+                                  np.zeros((extra, self.n_neighbors), dtype=int)))
+        self.lrd = np.append(self.lrd, np.zeros(extra))
+        self.lof = np.append(self.lof, np.zeros(extra))
+
+
+def _distances(A, B):
+    # Euclidean distances between the rows of A and the rows of B
+    D = ((A**2).sum(axis=1)[:, None] - 2 * A.dot(B.T) +
+         (B**2).sum(axis=1)[None, :])
+    return np.sqrt(np.maximum(D, 0.))
+
+
+class _NeighborIndex(object):
+    """Nearest and reverse nearest neighbor candidates of stored samples
+
+    A KD-tree over the samples `ids` answers the nearest neighbor queries.
+    The reverse nearest neighbors of q are the samples p with
+    d(p, q) <= k-distance(p). They are found with one KD-tree per binary
+    order of magnitude of the k-distances, queried with the largest
+    k-distance it holds, so a sample with a large k-distance does not widen
+    the queries of the others.
+
+    Samples added afterwards are kept in a buffer, which is returned as
+    candidates of every query, as are the samples whose k-distance grew
+    beyond the one they were indexed with. Removed samples stay in the
+    trees, so nearest neighbor queries ask for that many more neighbors.
+    The caller filters the candidates with exact distances.
+
+    Parameters
+    ----------
+    X : array, shape (n_stored, n_features)
+
+    ids : array of int, shape (n_samples,)
+        Rows of X to index.
+
+    k_dists : array, shape (n_samples,)
+        Their k-distances.
+    """
+
+    def __init__(self, X, ids, k_dists):
+        self.ids = ids
+        self.tree = KDTree(X[ids])
+        self.buffer = []
+        self.wide = set()
+        self.n_removed = 0
+
+        exponents = np.frexp(k_dists)[1]
+        self.radius_trees = []
+        for exponent in np.unique(exponents):
+            members = exponents == exponent
+            self.radius_trees.append((KDTree(X[ids[members]]), ids[members],
+                                      k_dists[members].max()))
+
+    @property
+    def n_pending(self):
+        return len(self.buffer) + len(self.wide) + self.n_removed
+
+    def add(self, ids):
+        self.buffer.extend(ids)
+
+    def remove(self, ids):
+        self.n_removed += len(ids)
+
+    def widen(self, ids):
+        self.wide.update(ids)
+
+    def kneighbors_candidates(self, X, n_neighbors):
+        '''
+        Candidate nearest neighbors of the rows of X, an array of ids of
+        shape (n_rows, n_candidates)
+        '''
+        n_query = min(n_neighbors + self.n_removed, len(self.ids))
+        candidates = self.ids[self.tree.query(X, n_query,
+                                              return_distance=False)]
+        if self.buffer:
+            buffered = np.tile(self.buffer, (X.shape[0], 1))
+            candidates = np.hstack((candidates, buffered))
+        return candidates
+
+    def reverse_candidates(self, X):
+        '''
+        Ids of the samples which may have a row of X among their k nearest
+        neighbors
+        '''
+        candidates = [np.array(self.buffer, dtype=int),
+                      np.array(sorted(self.wide), dtype=int)]
+        for tree, ids, radius in self.radius_trees:
+            # Widened a little for the rounding of the distances
+            found = tree.query_radius(X, radius * (1 + 1e-9) + 1e-12)
+            candidates.extend(ids[ind] for ind in found)
+        return np.unique(np.concatenate(candidates))
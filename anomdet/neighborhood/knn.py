@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 
-import numpy as np
-from sklearn.neighbors import NearestNeighbors
+from functools import partial
 
 from ..base import BaseAnomalyDetector
-from ..utils import check_n_neighbors
+from ..utils import check_n_neighbors, predict_in_chunks
+from .graph import NeighborhoodGraph, WeightedNeighborhoodGraph
+from .graph import _weighted_kneighbors, _neighbor_mean, _expand
+
+
+def _predict_new(clf, k, X):
+    # Module level, rather than a method or closure, so it can be pickled
+    # and sent to worker processes
+    distances, _, weights = _weighted_kneighbors(clf.graph, X, k, n_jobs=1)
+    return _neighbor_mean(distances, weights)
 
 
 class KNN(BaseAnomalyDetector):
     """Distance to nearest neighbors
 
-    Note: Assumes none of the data are duplicated.
+    Note: Duplicates of a sample are among its neighbors, at distance zero.
+    Use `collapse_duplicates` on data with many duplicated rows.
     
     Parameters
     ----------
@@ -25,40 +34,87 @@ class KNN(BaseAnomalyDetector):
                 Represents number of neighbors to use as a fraction of the
                 total number of samples.
 
+    chunk_size : int, optional (default=None)
+        Number of rows of new data queried and scored at a time, see
+        `predict`. If None, all rows at once.
+
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see NeighborhoodGraph.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index.
+
+    n_jobs : int, optional (default=1)
+        Number of worker processes, see NeighborhoodGraph.
+
+    collapse_duplicates : boolean, optional (default=False)
+        Collapse exact duplicate rows to unique rows with counts, see
+        WeightedNeighborhoodGraph. The neighbors are searched and the scores
+        computed for the unique rows only, with each neighbor weighted by
+        its multiplicity, and the scores are expanded back to every sample.
+        The scores are those of the uncollapsed data, up to ties.
+
     """
     
-    def __init__(self, k=1):
+    def __init__(self, k=1, chunk_size=None, algorithm='exact',
+                 algorithm_params=None, n_jobs=1,
+                 collapse_duplicates=False):
         self.k = k
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
+        self.n_jobs = n_jobs
+        self.collapse_duplicates = collapse_duplicates
     
-    def fit(self, X=None, y=None):
+    def fit(self, X=None, y=None, graph=None):
         '''
         Parameters
         ----------
         X : array-like, shape (n_samples, n_features)
         
         y : unused parameter
+        
+        graph : NeighborhoodGraph, optional (default=None)
+            Precomputed neighborhood graph, or WeightedNeighborhoodGraph, to
+            use instead of building one from X. Its k_max must be at least
+            the number of neighbors used by this detector.
         '''
         
         # Clear previous
         if hasattr(self, 'n_neighbors'):
             delattr(self, 'n_neighbors')
-        if hasattr(self, 'nbrs'):
-            delattr(self, 'nbrs')
+        if hasattr(self, 'graph'):
+            delattr(self, 'graph')
         
-        if X is not None:
+        if graph is not None:
+            self.n_neighbors = check_n_neighbors(self.k, graph.n_samples)
+            if self.n_neighbors > graph.n_neighbors:
+                raise ValueError("k is greater than the k_max of the "
+                                 "neighborhood graph!")
+            self.graph = graph
+        elif X is not None:
             n = X.shape[0]
             self.n_neighbors = check_n_neighbors(self.k, n)
-            self.nbrs = NearestNeighbors(n_neighbors=self.n_neighbors+1).fit(X)
+            graph_class = (WeightedNeighborhoodGraph
+                           if self.collapse_duplicates else NeighborhoodGraph)
+            self.graph = graph_class(
+                k_max=self.n_neighbors, algorithm=self.algorithm,
+                algorithm_params=self.algorithm_params,
+                n_jobs=self.n_jobs).fit(X)
         
         return self
     
-    def predict(self, X, k=None):
+    def predict(self, X=None, k=None, out=None):
         """Calculate KNN outlier factor for each sample in X
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            New data to predict.
+        X : array-like, shape (n_samples, n_features), optional
+            New data to predict. If None, the samples the neighborhood graph
+            was fitted on are scored. New data is scored `chunk_size` rows
+            at a time, so it can be an np.memmap which does not fit in
+            memory.
 
         k : int or float, optional (default=None)
         
@@ -71,6 +127,9 @@ class KNN(BaseAnomalyDetector):
                 float : Then 0.0 < k < 1.0
                     Represents number of neighbors to use as a fraction of the
                     total number of samples.
+        
+        out : array-like, shape (n_samples,), optional (default=None)
+            Preallocated output, e.g. an np.memmap.
             
         Returns
         -------
@@ -84,11 +143,18 @@ class KNN(BaseAnomalyDetector):
         if k is None:
             k = self.n_neighbors
         else:
-            k = check_n_neighbors(k, X.shape[0])
+            n = self.graph.n_samples if X is None else X.shape[0]
+            k = check_n_neighbors(k, n)
                 
-        distances, _ = self.nbrs.kneighbors(X, n_neighbors=k+1)
-        #distances = distances[:, 1:]
-        distances[distances[:, 0] == 0., :-1] = distances[distances[:, 0] == 0., 1:]
-        distances = distances[:, :-1]
+        if X is None or X is self.graph.X:
+            distances, _, weights = _weighted_kneighbors(self.graph, X, k)
+            knn = _neighbor_mean(distances, weights)
+            if X is None:
+                knn = _expand(self.graph, knn)
+            if out is None:
+                return knn
+            out[:] = knn
+            return out
         
-        return distances.mean(axis=1)
+        return predict_in_chunks(partial(_predict_new, self, k), X,
+                                 self.chunk_size, out, self.n_jobs)
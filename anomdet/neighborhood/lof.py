@@ -1,10 +1,158 @@
 # -*- coding: utf-8 -*-
 
+from functools import partial
+
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
 
 from ..base import BaseAnomalyDetector
-from ..utils import check_n_neighbors
+from ..utils import check_n_neighbors, predict_in_chunks
+from .graph import NeighborhoodGraph, WeightedNeighborhoodGraph
+from .graph import (_weighted_kneighbors, _neighbor_sum, _k_distances,
+                    _expand)
+
+
+def _lof_from_neighbors(distances, indices, batch_size=10000, return_lrd=False):
+    """Compute the local outlier factor from a kNN graph.
+
+    Parameters
+    ----------
+    distances : array, shape (n_samples, k)
+        Distances to the k nearest neighbors of each sample, sorted in
+        increasing order. The sample itself should not be included.
+
+    indices : array, shape (n_samples, k)
+        Indices of the k nearest neighbors of each sample.
+
+    batch_size : int, optional (default=10000)
+        Number of rows to process at a time.
+
+    return_lrd : boolean, optional (default=False)
+        Whether to also return the local reachability densities.
+
+    Returns
+    -------
+    lof : array, shape (n_samples,)
+        Local outlier factor for each sample.
+
+    lrd : array, shape (n_samples,)
+        Local reachability density of each sample. Only returned if
+        `return_lrd` is True.
+    """
+    k = distances.shape[1]
+    lofs, lrd_value = _lof_range_from_neighbors(distances, indices, [k],
+                                                batch_size, return_lrd=True)
+    if return_lrd:
+        return lofs[:, 0], lrd_value[:, 0]
+    return lofs[:, 0]
+
+
+def _lof_range_from_neighbors(distances, indices, k_range, batch_size=10000,
+                              return_lrd=False):
+    """Compute the local outlier factor for several k from one kNN graph.
+
+    The reachability distances and the neighbors' lrd values for every k are
+    laid out along a (batch, k_max, len(k_range)) tensor and reduced with a
+    cumulative sum over the neighbor axis, so all k are handled in one pass.
+
+    Parameters
+    ----------
+    distances : array, shape (n_samples, k_max)
+        Distances to the nearest neighbors of each sample, sorted in
+        increasing order. The sample itself should not be included.
+
+    indices : array, shape (n_samples, k_max)
+        Indices of the nearest neighbors of each sample.
+
+    k_range : sorted sequence of int
+        The numbers of neighbors to use. Each must be at most k_max.
+
+    batch_size : int, optional (default=10000)
+        Bounds the number of elements per neighbor column in the temporary
+        arrays. The number of rows processed at a time is
+        batch_size // len(k_range).
+
+    return_lrd : boolean, optional (default=False)
+        Whether to also return the local reachability densities.
+
+    Returns
+    -------
+    lofs : array, shape (n_samples, len(k_range))
+        Local outlier factor for each sample and each k.
+
+    lrd : array, shape (n_samples, len(k_range))
+        Local reachability density of each sample for each k. Only returned
+        if `return_lrd` is True.
+    """
+    k_range = np.asarray(k_range)
+    cols = k_range - 1
+    k_max = k_range[-1]
+    distances = distances[:, :k_max]
+    indices = indices[:, :k_max]
+
+    num_rows = distances.shape[0]
+    rows_per_batch = max(1, batch_size // len(k_range))
+
+    # k-distance of every sample for every k
+    k_dists = distances[:, cols]
+
+    # reach-dist_k(p, o) = max(k-distance(o), d(p, o))
+    lrd_value = np.empty((num_rows, len(k_range)), dtype=distances.dtype)
+    for start in xrange(0, num_rows, rows_per_batch):
+        stop = min(start + rows_per_batch, num_rows)
+        reachability_dists = np.maximum(distances[start:stop, :, None],
+                                        k_dists[indices[start:stop]])
+        lrd_value[start:stop] = k_range / _prefix_sums(reachability_dists, cols)
+
+    lofs = np.empty((num_rows, len(k_range)), dtype=distances.dtype)
+    for start in xrange(0, num_rows, rows_per_batch):
+        stop = min(start + rows_per_batch, num_rows)
+        lrd_sums = _prefix_sums(lrd_value[indices[start:stop]], cols)
+        lofs[start:stop] = lrd_sums / lrd_value[start:stop] / k_range
+
+    if return_lrd:
+        return lofs, lrd_value
+    return lofs
+
+
+def _prefix_sums(values, cols):
+    """Sum values[:, :(cols[e]+1), e] for every e.
+
+    values has shape (n_rows, k_max, len(cols)); the result has shape
+    (n_rows, len(cols)).
+    """
+    return values.cumsum(axis=1)[:, cols, np.arange(len(cols))]
+
+
+def _reachability_density(distances, indices, weights, k_dists, k):
+    # reach-dist_k(p, o) = max(k-distance(o), d(p, o)), summed with the
+    # multiplicity of each neighbor o
+    reachability_dists = np.maximum(distances, k_dists[indices])
+    return k / _neighbor_sum(reachability_dists, weights)
+
+
+def _weighted_lof(distances, indices, weights, k):
+    """Compute the local outlier factor from a WeightedNeighborhoodGraph.
+
+    Returns
+    -------
+    lof, lrd, k_dists : arrays, shape (n_unique,)
+        Local outlier factor, local reachability density and k-distance of
+        each unique row.
+    """
+    k_dists = _k_distances(distances, weights)
+    lrd_value = _reachability_density(distances, indices, weights, k_dists, k)
+    lof = _neighbor_sum(lrd_value[indices], weights) / lrd_value / k
+    return lof, lrd_value, k_dists
+
+
+def _predict_new(clf, X):
+    # LOF of new samples with respect to the fitted samples
+    k = clf.n_neighbors
+    distances, indices, weights = _weighted_kneighbors(clf.graph, X, k,
+                                                       n_jobs=1)
+    lrd_value = _reachability_density(distances, indices, weights,
+                                      clf.k_dists, k)
+    return _neighbor_sum(clf.lrd[indices], weights) / lrd_value / k
 
 
 class LOF(BaseAnomalyDetector):
@@ -23,43 +171,114 @@ class LOF(BaseAnomalyDetector):
                 Represents number of neighbors to use as a fraction of the
                 total number of samples.
 
+    batch_size : int, optional (default=10000)
+        Number of rows processed at a time when computing the reachability
+        distances. Bounds the size of the temporary (batch_size, k) arrays.
+
+    chunk_size : int, optional (default=None)
+        Number of rows of new data queried and scored at a time, see
+        `predict`. If None, all rows at once.
+
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see NeighborhoodGraph.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index.
+
+    n_jobs : int, optional (default=1)
+        Number of worker processes, see NeighborhoodGraph.
+
+    collapse_duplicates : boolean, optional (default=False)
+        Collapse exact duplicate rows to unique rows with counts, see
+        WeightedNeighborhoodGraph. The neighbors are searched and the scores
+        computed for the unique rows only, with each neighbor weighted by
+        its multiplicity, and the scores are expanded back to every sample.
+        The scores are those of the uncollapsed data, up to ties.
+
     References
     ----------
     Markus M. Breunig, Hans-Peter Kriegel, Raymond T. Ng, and Jörg Sander. 2000. LOF: identifying density-based local outliers. SIGMOD Rec. 29, 2 (May 2000), 93-104. DOI=10.1145/335191.335388 http://doi.acm.org/10.1145/335191.335388
     """
     
-    def __init__(self, k=5):
+    def __init__(self, k=5, batch_size=10000, chunk_size=None,
+                 algorithm='exact', algorithm_params=None, n_jobs=1,
+                 collapse_duplicates=False):
         self.k = k
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
+        self.n_jobs = n_jobs
+        self.collapse_duplicates = collapse_duplicates
     
-    def fit(self, X=None, y=None):
+    def fit(self, X=None, y=None, graph=None):
         '''
         Parameters
         ----------
         X : array-like, shape (n_samples, n_features)
         
         y : unused parameter
+        
+        graph : NeighborhoodGraph, optional (default=None)
+            Precomputed neighborhood graph, or WeightedNeighborhoodGraph, to
+            use instead of building one from X. Its k_max must be at least
+            the number of neighbors used by this detector.
         '''
         
         # Clear previous
-        if hasattr(self, 'n_neighbors'):
-            delattr(self, 'n_neighbors')
-        if hasattr(self, 'nbrs'):
-            delattr(self, 'nbrs')
+        for attr in ['n_neighbors', 'graph', 'k_dists', 'lrd', 'lof']:
+            if hasattr(self, attr):
+                delattr(self, attr)
         
-        if X is not None:
+        if graph is not None:
+            self.n_neighbors = check_n_neighbors(self.k, graph.n_samples)
+            if self.n_neighbors > graph.n_neighbors:
+                raise ValueError("k is greater than the k_max of the "
+                                 "neighborhood graph!")
+            self.graph = graph
+        elif X is not None:
             n = X.shape[0]
             self.n_neighbors = check_n_neighbors(self.k, n)
-            self.nbrs = NearestNeighbors(n_neighbors=self.n_neighbors+1).fit(X)
+            graph_class = (WeightedNeighborhoodGraph
+                           if self.collapse_duplicates else NeighborhoodGraph)
+            self.graph = graph_class(
+                k_max=self.n_neighbors, algorithm=self.algorithm,
+                algorithm_params=self.algorithm_params,
+                n_jobs=self.n_jobs).fit(X)
+        
+        if hasattr(self, 'graph'):
+            # Statistics of the reference set, used to score new samples.
+            # With collapsed duplicates, k_dists and lrd are those of the
+            # unique rows.
+            distances, indices, weights = _weighted_kneighbors(
+                self.graph, None, self.n_neighbors)
+            if weights is None:
+                self.k_dists = distances[:, -1].copy()
+                self.lof, self.lrd = _lof_from_neighbors(distances, indices,
+                                                         self.batch_size,
+                                                         return_lrd=True)
+            else:
+                lof, self.lrd, self.k_dists = _weighted_lof(
+                    distances, indices, weights, self.n_neighbors)
+                self.lof = _expand(self.graph, lof)
         
         return self
         
-    def predict(self, X):
+    def predict(self, X=None, out=None):
         """Calculate local outlier factor for each sample in X
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            New data to predict.
+        X : array-like, shape (n_samples, n_features), optional
+            New data to predict. If None, the samples the neighborhood graph
+            was fitted on are scored. New data is scored against the
+            k-distances and lrd values of the fitted samples, `chunk_size`
+            rows at a time, so it can be an np.memmap which does not fit in
+            memory.
+
+        out : array-like, shape (n_samples,), optional (default=None)
+            Preallocated output, e.g. an np.memmap.
 
         Returns
         -------
@@ -69,77 +288,63 @@ class LOF(BaseAnomalyDetector):
         if not hasattr(self, 'n_neighbors'):
             self.fit(X)
         
-        nbrs = self.nbrs
-        distances, indices = nbrs.kneighbors(X)
-        
-        exists_dupl = distances[:, 0] == 0.
-        distances[exists_dupl, :-1] = distances[exists_dupl, 1:]
-        indices[exists_dupl, :-1] = indices[exists_dupl, 1:]
-        distances = distances[:, :-1]
-        indices = indices[:, :-1]
-        
-        k_dists = distances[:, -1]
+        if X is None or X is self.graph.X:
+            if out is None:
+                return self.lof.copy()
+            out[:] = self.lof
+            return out
         
-        num_rows = X.shape[0]
-        
-        lrd_value = np.zeros((num_rows, 1));
-        lrd_value = np.zeros(num_rows)
-        for i in xrange(num_rows):
-            temp = X[i, :] - X[indices[i], :]
-            temp = np.sqrt(np.sum(temp**2, 1))
-            reachability_dists = np.max(np.vstack([temp, k_dists[indices[i]]]), 0)
-            lrd_value[i] = self.k/sum(reachability_dists);
-        
-        lof = np.zeros(num_rows)
-        for i in xrange(num_rows):
-            lof[i] = np.sum(lrd_value[indices[i]]) / lrd_value[i] / self.k
-        
-        return(lof)
+        return predict_in_chunks(partial(_predict_new, self), X,
+                                 self.chunk_size, out, self.n_jobs)
         
     def range_predict(self, X, k_range):
         """Calculate local outlier factor for each sample in X over a range of
            k's
 
+        The neighbors are queried once for the largest k and the local
+        outlier factors for all k are computed in a single pass.
+
         Parameters
         ----------
         X : array-like, shape (n_samples, n_features)
-            New data to predict.
+            New data to predict. If None, the samples the neighborhood graph
+            was fitted on are scored, which requires a fitted graph with
+            k_max >= max(k_range).
 
         k_range : iterable
             
         Returns
         -------
-        lof : array, shape (n_samples,)
-            Local outlier factor for each sample.
+        lofs : array, shape (n_samples, len(k_range))
+            Local outlier factor for each sample and each k in sorted
+            k_range.
         """
-        #if not self.X_:
-        #    self.fit(X)
-        
         k_range = sorted(list(k_range))
         k_max = k_range[-1]
         
-        nbrs = NearestNeighbors(n_neighbors=k_max+1).fit(X)
-        distances_, indices_ = nbrs.kneighbors(X)
+        graph = getattr(self, 'graph', None)
+        if (graph is None or graph.n_neighbors < k_max or
+                (X is not None and X is not graph.X)):
+            if X is None:
+                raise ValueError("X is None but no neighborhood graph with "
+                                 "k_max >= max(k_range) was fitted!")
+            graph_class = (WeightedNeighborhoodGraph
+                           if self.collapse_duplicates else NeighborhoodGraph)
+            graph = graph_class(
+                k_max=k_max, algorithm=self.algorithm,
+                algorithm_params=self.algorithm_params,
+                n_jobs=self.n_jobs).fit(X)
         
-        lofs = np.empty((X.shape[0], len(k_range)))
-        for e, k in enumerate(k_range):
-            indices = indices_[:, 1:(k+1)]
-            distances = distances_[:, 1:(k+1)]
+        if isinstance(graph, WeightedNeighborhoodGraph):
+            # The weights depend on k, so each k is a pass over the cached
+            # neighbors of the unique rows
+            lofs = []
+            for k in k_range:
+                distances, indices, weights = graph.kneighbors(n_neighbors=k)
+                lofs.append(_weighted_lof(distances, indices, weights, k)[0])
+            return _expand(graph, np.column_stack(lofs))
         
-            k_dists = distances[:, -1]
-            
-            num_rows = X.shape[0]
-            
-            lrd_value = np.zeros(num_rows)
-            for i in xrange(num_rows):
-                temp = X[i, :] - X[indices[i], :]
-                temp = np.sqrt(np.sum(temp**2, 1))
-                reachability_dists = np.max(np.vstack([temp, k_dists[indices[i]]]), 0)
-                lrd_value[i] = k/sum(reachability_dists);
-            
-            lof = np.zeros(num_rows)
-            for i in xrange(num_rows):
-                lof[i] = np.sum(lrd_value[indices[i]]) / lrd_value[i] / k
-            
-            lofs[:, e] = lof
-        return(lofs)
\ No newline at end of file
+        distances, indices = graph.kneighbors(n_neighbors=k_max)
+        
+        return _lof_range_from_neighbors(distances, indices, k_range,
+                                         self.batch_size)
@@ -1,11 +1,53 @@
 # -*- coding: utf-8 -*-
 
+from functools import partial
+
 import numpy as np
 from scipy.special import erf
-from sklearn.neighbors import NearestNeighbors
 
 from ..base import BaseAnomalyDetector
-from ..utils import check_n_neighbors
+from ..utils import check_n_neighbors, predict_in_chunks
+from .graph import NeighborhoodGraph, WeightedNeighborhoodGraph
+from .graph import _weighted_kneighbors, _neighbor_mean, _expand
+
+
+def _plof(prob_dist, prob_dist_ref, indices, weights=None):
+    """Probabilistic local outlier factor.
+
+    Parameters
+    ----------
+    prob_dist : array, shape (n_samples,)
+        Probabilistic distance of each sample to its neighbors.
+
+    prob_dist_ref : array, shape (n_ref_samples,)
+        Probabilistic distance of each reference sample to its neighbors.
+
+    indices : array, shape (n_samples, k)
+        Indices of the reference neighbors of each sample.
+
+    weights : array, shape (n_samples, k), optional (default=None)
+        Multiplicity of each neighbor, see WeightedNeighborhoodGraph.
+
+    Returns
+    -------
+    plof : array, shape (n_samples,)
+        nan where undefined because of duplicated points.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plof = (prob_dist / _neighbor_mean(prob_dist_ref[indices], weights) -
+                1.0)
+    plof[np.isinf(plof)] = np.nan
+    return plof
+
+
+def _predict_new(clf, X):
+    # Local outlier probabilities of new samples, given the fitted ones
+    distances, indices, weights = _weighted_kneighbors(
+        clf.graph, X, clf.n_neighbors, n_jobs=1)
+    prob_dist = np.sqrt(_neighbor_mean(distances**2, weights))
+    plof = _plof(prob_dist, clf.prob_dist, indices, weights)
+    return erf(plof / clf.nplof / np.sqrt(2)).clip(0)
+
 
 class LoOP(BaseAnomalyDetector):
     """LoOP : Local Outlier Probabilites
@@ -26,38 +68,94 @@ class LoOP(BaseAnomalyDetector):
     lambda_ : float, optional (default=3.0)
         Scaling parameter for the outlier probabilities.
 
+    chunk_size : int, optional (default=None)
+        Number of rows of new data queried and scored at a time, see
+        `predict`. If None, all rows at once.
+
+    algorithm : {'exact', 'rp_forest', 'lsh'}, optional (default='exact')
+        Nearest neighbor search to use. 'rp_forest' and 'lsh' are
+        approximate, see NeighborhoodGraph.
+
+    algorithm_params : dict, optional (default=None)
+        Additional keyword arguments for the nearest neighbor index.
+
+    n_jobs : int, optional (default=1)
+        Number of worker processes, see NeighborhoodGraph.
+
+    collapse_duplicates : boolean, optional (default=False)
+        Collapse exact duplicate rows to unique rows with counts, see
+        WeightedNeighborhoodGraph. The neighbors are searched and the scores
+        computed for the unique rows only, with each neighbor weighted by
+        its multiplicity, and the scores are expanded back to every sample.
+        The scores are those of the uncollapsed data, up to ties.
+
     References
     ----------
     Kriegel, Hans-Peter, et al. "LoOP: local outlier probabilities." Proceedings of the 18th ACM conference on Information and knowledge management. ACM, 2009.
     """
     
-    def __init__(self, k=5, lambda_=3.0):
+    def __init__(self, k=5, lambda_=3.0, chunk_size=None, algorithm='exact',
+                 algorithm_params=None, n_jobs=1,
+                 collapse_duplicates=False):
         self.k = k
         self.lambda_ = lambda_
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.algorithm_params = algorithm_params
+        self.n_jobs = n_jobs
+        self.collapse_duplicates = collapse_duplicates
     
-    def fit(self, X=None, y=None):
+    def fit(self, X=None, y=None, graph=None):
         '''
         Parameters
         ----------
         X : array-like, shape (n_samples, n_features)
         
         y : unused parameter
+        
+        graph : NeighborhoodGraph, optional (default=None)
+            Precomputed neighborhood graph, or WeightedNeighborhoodGraph, to
+            use instead of building one from X. Its k_max must be at least
+            the number of neighbors used by this detector.
         '''
         
         # Clear previous
-        if hasattr(self, 'n_neighbors'):
-            delattr(self, 'n_neighbors')
-        if hasattr(self, 'nbrs'):
-            delattr(self, 'nbrs')
+        for attr in ['n_neighbors', 'graph', 'prob_dist', 'plof', 'nplof']:
+            if hasattr(self, attr):
+                delattr(self, attr)
         
-        if X is not None:
+        if graph is not None:
+            self.n_neighbors = check_n_neighbors(self.k, graph.n_samples)
+            if self.n_neighbors > graph.n_neighbors:
+                raise ValueError("k is greater than the k_max of the "
+                                 "neighborhood graph!")
+            self.graph = graph
+        elif X is not None:
             n = X.shape[0]
             self.n_neighbors = check_n_neighbors(self.k, n)
-            self.nbrs = NearestNeighbors(n_neighbors=self.n_neighbors+1).fit(X)
+            graph_class = (WeightedNeighborhoodGraph
+                           if self.collapse_duplicates else NeighborhoodGraph)
+            self.graph = graph_class(
+                k_max=self.n_neighbors, algorithm=self.algorithm,
+                algorithm_params=self.algorithm_params,
+                n_jobs=self.n_jobs).fit(X)
+        
+        if hasattr(self, 'graph'):
+            # Statistics of the reference set, used to score new samples.
+            # With collapsed duplicates, prob_dist is that of the unique rows.
+            distances, indices, weights = _weighted_kneighbors(
+                self.graph, None, self.n_neighbors)
+            self.prob_dist = np.sqrt(_neighbor_mean(distances**2, weights))
+            self.plof = _expand(self.graph, _plof(self.prob_dist,
+                                                  self.prob_dist, indices,
+                                                  weights))
+            
+            # nplof : the std of plof assuming mean is zero
+            self.nplof = self.lambda_ * np.sqrt(np.nanmean(self.plof**2))
         
         return self
     
-    def predict(self, X):
+    def predict(self, X=None, out=None):
         """Calculate local outlier probability for each sample in X
 
         Note: the local outlier probability is undefined for duplicated points
@@ -65,39 +163,30 @@ class LoOP(BaseAnomalyDetector):
         
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            New data to predict.
+        X : array-like, shape (n_samples, n_features), optional
+            New data to predict. If None, the samples the neighborhood graph
+            was fitted on are scored. New data is scored against the
+            probabilistic distances of the fitted samples, which are not
+            recomputed, `chunk_size` rows at a time, so it can be an
+            np.memmap which does not fit in memory.
+
+        out : array-like, shape (n_samples,), optional (default=None)
+            Preallocated output, e.g. an np.memmap.
 
         Returns
         -------
-        lof : array, shape (n_samples,)
-            Local outlier factor for each sample.
+        loop : array, shape (n_samples,)
+            Local outlier probability for each sample.
         """
         if not hasattr(self, 'n_neighbors'):
             self.fit(X)
         
-        nbrs = self.nbrs
-        distances, indices = nbrs.kneighbors(X)
-        
-        exists_dupl = distances[:, 0] == 0.
-        distances[exists_dupl, :-1] = distances[exists_dupl, 1:]
-        indices[exists_dupl, :-1] = indices[exists_dupl, 1:]
-        distances = distances[:, :-1]
-        indices = indices[:, :-1]
-        
-        num_rows = X.shape[0]
-        
-        prob_dist = np.sqrt((distances**2).mean(axis=1))
+        if X is None or X is self.graph.X:
+            loop = erf(self.plof / self.nplof / np.sqrt(2)).clip(0)
+            if out is None:
+                return loop
+            out[:] = loop
+            return out
         
-        plof = np.empty(num_rows)
-        for i in range(num_rows):
-            plof[i] = prob_dist[i] / np.mean(prob_dist[indices[i]])
-            plof[i] -= 1.0
-        plof[np.isinf(plof)] = np.nan
-        
-        # nplof : the std of plof assuming mean is zero
-        nplof = self.lambda_ * np.sqrt(np.nanmean(plof**2))
-        
-        loop = erf(plof / nplof / np.sqrt(2)).clip(0)
-
-        return loop
+        return predict_in_chunks(partial(_predict_new, self), X,
+                                 self.chunk_size, out, self.n_jobs)
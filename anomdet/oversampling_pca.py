@@ -42,14 +42,130 @@ def power_method(A, x=None, tol=1e-19, maxiter=500, random_state=None):
     v = z
     return (lambda_, v)
 
+def batched_power_method(A, Y, c, x, tol=1e-19, maxiter=500):
+    '''
+    Run power_method on the n matrices A + c * Y[i, :, None] * Y[i, :] at
+    once, without forming them
+    
+    Every product with a rank-one updated matrix is A.dot(z) + c*(Y[i].z)*Y[i],
+    so an iteration over all the problems is one (n, d) x (d, d) matrix
+    product. Each problem stops on its own once converged, with the same
+    criterion as power_method.
+    
+    Input:
+        A : symmetric matrix, shape (d, d)
+        Y : the rank-one updates, shape (n, d)
+        c : weight of the updates
+        x : initial vector of all the problems, shape (d,)
+        tol, maxiter : as in power_method
+    
+    Output:
+        lambdas : the resulting eigenvalues, shape (n,)
+        V : the resulting eigenvectors, shape (n, d)
+    '''
+    n = Y.shape[0]
+    X = np.tile(x, (n, 1))
+    Z = np.empty_like(X)
+    alpha0 = np.empty(n)
+    active = np.arange(n)
+    niter = 1
+    
+    while active.size and niter < maxiter:
+        z = X[active] / np.linalg.norm(X[active], axis=1)[:, None]
+        Ya = Y[active]
+        x = z.dot(A) + c * np.sum(Ya*z, axis=1)[:, None] * Ya
+        alpha1 = np.sum(z*x, axis=1)
+        Z[active] = z
+        X[active] = x
+        if niter > 1:
+            relerr = np.abs(alpha1-alpha0[active])/np.abs(alpha0[active])
+        else:
+            relerr = np.full(active.size, np.inf)
+        alpha0[active] = alpha1
+        active = active[relerr >= tol]
+        niter += 1
+    
+    return (alpha0, Z)
+
+def rank_one_dominant_similarity(eigvals, W, rho, n_bisect=100):
+    '''
+    Absolute cosine between the dominant eigenvector of
+    diag(eigvals) + rho * W[i, :, None] * W[i, :] and that of diag(eigvals),
+    for every row of W
+    
+    The largest eigenvalue mu of the updated matrix is the root above
+    max(eigvals) of the secular equation 1 = rho * sum_j W[i,j]^2/(mu - eigvals[j]),
+    which lies in [max(eigvals), max(eigvals) + rho*|W[i]|^2] and is found by
+    bisection for all rows at once. Its eigenvector is proportional to
+    W[i] / (mu - eigvals).
+    
+    Refererence:
+    G. H. Golub "Some modified matrix eigenvalue problems", SIAM Review, 1973
+    '''
+    top = np.argmax(eigvals)
+    W2 = rho * W**2
+    lower = np.full(W.shape[0], eigvals[top])
+    upper = eigvals[top] + W2.sum(axis=1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(n_bisect):
+            mu = (lower + upper) / 2.
+            secular = np.sum(W2 / (mu[:, None] - eigvals), axis=1)
+            above = secular < 1.  # mu is above the root
+            upper = np.where(above, mu, upper)
+            lower = np.where(above, lower, mu)
+        
+        V = W / (upper[:, None] - eigvals)
+        similarities = np.abs(V[:, top]) / np.linalg.norm(V, axis=1)
+    
+    # A point which does not change the dominant eigenvector
+    similarities[~np.isfinite(similarities)] = 1.
+    return similarities
+
 class OversamplingPCA(BaseAnomalyDetector):
     """Outlier Detection via Over-sampling PCA
     Measure outlier-ness of data as the perturbation in the first principal
     component after oversampling.
+    
+    Oversampling a point x by a ratio r changes the covariance matrix C
+    into C/(1+r) + r/(1+r)^2 * (x - mean)(x - mean)^T, a rank-one update, so
+    no covariance matrix is formed per point.
+    
+    Parameters
+    ----------
+    oversampling_ratio : float
+        Weight r of the oversampled point relative to the whole data.
+    
+    solver : {'rank_one', 'power'}, optional (default='rank_one')
+        'rank_one' computes the dominant eigenvector of every updated
+        covariance in closed form from the eigendecomposition of C, in
+        O(n d) per bisection step. 'power' runs the power iterations of all
+        points at once, warm started from the dominant eigenvector of C, as
+        in the original algorithm.
+    
+    forgetting_factor : float, optional (default=1.)
+        Weight in (0, 1] of the data seen so far when `partial_fit` adds a
+        batch. With 1. all the samples weigh the same, and smaller values
+        forget old batches exponentially, to follow a drifting
+        distribution.
+    
+    Attributes
+    ----------
+    n_samples_seen_ : float
+        Total weight of the samples seen, their number if
+        forgetting_factor is 1.
+    
+    References
+    ----------
+    Y.-J. Lee, Y.-R. Yeh, Y.-C. F. Wang "Anomaly Detection via Online
+    Oversampling Principal Component Analysis", IEEE TKDE, 2013
     """
     
-    def __init__(self, oversampling_ratio):
+    def __init__(self, oversampling_ratio, solver='rank_one',
+                 forgetting_factor=1.):
         self.oversampling_ratio = oversampling_ratio
+        self.solver = solver
+        self.forgetting_factor = forgetting_factor
     
     def predict(self, A):
         """Calculate outlier score for each sample in A
@@ -66,22 +182,27 @@ class OversamplingPCA(BaseAnomalyDetector):
         
         ratio = self.oversampling_ratio
         
-        (n, _) = A.shape
         A_m = self._A_m
-        out_prod = self._out_prod
-        u = self._u
-
-        # Start the Leave-One-Out procedure with over-sampling PCA
-        similarities = np.zeros(n)
-        for i in range(n):
-            # Update the mean and covariance with weighted x_i
-            temp_mu = (A_m + ratio*A[i, :]) / (1 + ratio)
-            temp_cov = (out_prod + ratio*A[i, :, None] * A[i, :]) / (1 + ratio) - temp_mu[:,None] * temp_mu
-            _, u_temp = power_method(temp_cov, x=u)
+        
+        # Leave-One-Out with over-sampling PCA: the covariance with x_i
+        # oversampled is cov/(1+ratio) + ratio/(1+ratio)^2 * y_i y_i^T
+        Y = A - A_m
+        
+        if self.solver == 'rank_one':
+            if self._eigvals is None:
+                self._eigvals, self._eigvecs = np.linalg.eigh(self._cov)
+            similarities = rank_one_dominant_similarity(
+                self._eigvals, Y.dot(self._eigvecs), ratio / (1 + ratio))
+        elif self.solver == 'power':
+            u = self._dominant_eigenvector()
+            _, U_temp = batched_power_method(self._cov / (1 + ratio), Y,
+                                             ratio / (1 + ratio)**2, u)
             
             # Compute absolute cosine similarity between eigenvector with
             #oversampled point and the original dominant eigenvector.
-            similarities[i] = np.abs(u.T.dot(u_temp))  
+            similarities = np.abs(U_temp.dot(u))
+        else:
+            raise ValueError("solver should be 'rank_one' or 'power'!")
         
         # Return cosine distances as outlier scores
         return 1. - similarities
@@ -95,16 +216,60 @@ class OversamplingPCA(BaseAnomalyDetector):
         A : array-like shape (n_samples, n_features)
         
         '''
+        self.n_samples_seen_ = 0
+        return self.partial_fit(A)
+    
+    def partial_fit(self, A):
+        '''
+        Update OversamplingPCA with a batch of samples.
+        
+        The running mean and second-moment matrix are updated with the
+        batch, the old ones weighted by forgetting_factor. This takes
+        O(n_batch d^2) time and O(d^2) memory, independent of the number of
+        samples seen. The decomposition the solver needs, the dominant
+        eigenvector for 'power', warm started from the previous one, or all
+        the eigenpairs for 'rank_one', is recomputed on the next call to
+        predict.
+        
+        Parameters
+        ----------
+        A : array-like shape (n_batch, n_features)
+        
+        '''
+        if not 0. < self.forgetting_factor <= 1.:
+            raise ValueError("forgetting_factor should be in (0, 1]!")
+        
         (n, _) = A.shape
-        A_m = A.mean(axis=0)
-        out_prod = A.T.dot(A)/n  # outer product
         
-        # Find top eigenvector of covariance matrix.
+        if getattr(self, 'n_samples_seen_', 0) == 0:
+            n_old = 0.
+            A_m = A.mean(axis=0)
+            out_prod = A.T.dot(A)/n  # outer product
+            self._u = None
+        else:
+            n_old = self.forgetting_factor * self.n_samples_seen_
+            A_m = (n_old * self._A_m + A.sum(axis=0)) / (n_old + n)
+            out_prod = (n_old * self._out_prod + A.T.dot(A)) / (n_old + n)
+        
         # outer product of A minus outer product of mean = empirical covariance
-        _, u = power_method(out_prod - A_m[:,None] * A_m)
+        cov = out_prod - A_m[:,None] * A_m
         
+        self.n_samples_seen_ = n_old + n
         self._A_m = A_m
         self._out_prod = out_prod
-        self._u = u
+        self._cov = cov
+        self._u_stale = True
+        self._eigvals = None
+        self._eigvecs = None
         
-        return self
\ No newline at end of file
+        return self
+    
+    def _dominant_eigenvector(self):
+        '''
+        Top eigenvector of the covariance matrix, found with power_method
+        warm started from the previous one
+        '''
+        if self._u_stale:
+            _, self._u = power_method(self._cov, x=self._u)
+            self._u_stale = False
+        return self._u
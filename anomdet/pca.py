@@ -1,84 +1,232 @@
 # -*- coding: utf-8 -*-
 import numpy as np
+from numpy.linalg import eigh
 from sklearn.decomposition import PCA
 
 from .base import BaseAnomalyDetector
+from .utils import iter_chunks, predict_in_chunks
 
-def pca_reconstruction_error(X, k, sum_top=False):
+def _sum_of_scores(X_proj, explained_variance, k, sum_top=False):
+    '''
+    Sum of the standardized scores of the components after the k-th, or of
+    the top k components if sum_top.
+    '''
+    if not sum_top:
+        return np.sum(np.sqrt(X_proj[:,k:]**2 / explained_variance[k:]), axis=1)
+    else:
+        return np.sum(np.sqrt(X_proj[:,:k]**2 / explained_variance[:k]), axis=1)
+
+def pca_reconstruction_error(X, k, sum_top=False, svd_solver='auto', random_state=None):
     '''
     The sum of the squares of the standarized principal component scores of the unused components.
-    
+
     X : data
     k : number of eigvals to use for reconstruction
         So (total - k) is the number of pca scores which will be summed
     sum_top : bool (default: False)
         By default, take the sum of the bottom scores, which is equivalent to calculating the reconstruction using the top k principal components.
-        If true, will sum the top k scores instead.
+        If true, will sum the top k scores instead, and only the top k components are computed.
+    svd_solver : string (default: 'auto')
+        Passed to sklearn.decomposition.PCA. 'randomized' computes the top k components of wide data quickly when sum_top is True.
+    random_state : int, RandomState instance or None (default: None)
+        Seeds the 'randomized' svd_solver.
     '''
-    
-    pca = PCA().fit(X)
-    
+
+    n_top = k if sum_top else None
+    pca = PCA(n_components=n_top, svd_solver=svd_solver, random_state=random_state).fit(X)
+
     X_proj = pca.transform(X)
-    if not sum_top:
-        sum_of_scores = np.sum(np.sqrt(X_proj[:,k:]**2 / pca.explained_variance_[k:]), axis=1)
-    else:
-        sum_of_scores = np.sum(np.sqrt(X_proj[:,:k]**2 / pca.explained_variance_[:k]), axis=1)
-    return sum_of_scores
-    
+    return _sum_of_scores(X_proj, pca.explained_variance_, k, sum_top)
+
 class PrincipalComponentReconstructionError(BaseAnomalyDetector):
     '''
     Estimating outlier-ness as the error made when reconstruction the data using
     only the top (or bottom) k principal components.
-    
+
     This is calculated by taking the sum of the projection onto the unused
     components.
-    
+
     Parameters
     ----------
     n_components : int or float, optional (default=2)
-        
+
         The number of components to use for reconstruction
         Then, assuming sum_top=False, (total_n_components - n_components) is the
         number of PCA projection scores which will be summed.
-        
-        If 
+
+        If
             int : 1 <= n_components < n_dimensions
                 The exact number of components
             float : Then 0.0 < n_components < 1.0
                 Is the fraction of the total number of principal components to
                 use.
-        
+
     sum_top : bool, optional (default=False)
         By default, take the sum of the bottom projection scores,
         which is equivalent to calculating the reconstruction using the top-k
         principal components.
-        If True, will sum the top projection scores instead.
+        If True, will sum the top projection scores instead, and only the
+        top k components are kept.
+
+    svd_solver : string, optional (default='auto')
+        Passed to sklearn.decomposition.PCA by `fit` on in-memory data.
+        'randomized' computes only the top k components of wide data when
+        sum_top is True.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+        Seeds the 'randomized' svd_solver.
+
+    chunk_size : int, optional (default=None)
+        If given, `fit` streams X `chunk_size` rows at a time through
+        `partial_fit`, so X can be an np.memmap which does not fit in
+        memory, and `predict` scores `chunk_size` rows at a time.
+
+    Attributes
+    ----------
+    mean_ : array, shape (n_features,)
+
+    components_ : array, shape (n_kept_components, n_features)
+        Principal axes, sorted by decreasing explained variance.
+
+    explained_variance_ : array, shape (n_kept_components,)
+
+    n_samples_seen_ : int
+        Number of samples seen by `fit` and `partial_fit`.
+
+    `partial_fit` only updates the running mean and scatter matrix. The
+    attributes above are recomputed from them once, on the next call to
+    `predict`.
+
+    `partial_fit` after an in-memory `fit` adds to the fitted samples, whose
+    scatter matrix is rebuilt from the fitted components. This is exact if
+    all the components were kept. With sum_top, only the variance along the
+    top k components of the fitted samples is carried over, as in
+    incremental PCA.
+
+    Examples
+    --------
+    Fit on batches read one at a time, then score new batches:
+
+    >>> clf = PrincipalComponentReconstructionError(n_components=3)
+    >>> for batch in batches:
+    ...     clf.partial_fit(batch)
+    >>> scores = clf.predict(new_batch)
     '''
-    
-    def __init__(self, n_components, sum_top=False):
+
+    def __init__(self, n_components, sum_top=False, svd_solver='auto',
+                 random_state=None, chunk_size=None):
         self.n_components = n_components
         self.sum_top = sum_top
-        
-    def fit(self, X, y=None):
-        
+        self.svd_solver = svd_solver
+        self.random_state = random_state
+        self.chunk_size = chunk_size
+
+    def _n_top(self, n_features):
         if self.n_components < 1.0:
-            k = int(np.round(X.shape[1]))
+            return int(np.round(self.n_components * n_features))
         else:
-            k = self.n_components
-        
-        pca = PCA().fit(X)
+            return self.n_components
+
+    def fit(self, X, y=None):
+
+        # Forget the samples of earlier calls to partial_fit
+        self._reset()
+
+        if self.chunk_size is not None:
+            for start, stop in iter_chunks(X.shape[0], self.chunk_size):
+                self.partial_fit(X[start:stop])
+            self._update_components()
+            return self
+
+        k = self._n_top(X.shape[1])
+        n_top = k if self.sum_top else None
+
+        pca = PCA(n_components=n_top, svd_solver=self.svd_solver,
+                  random_state=self.random_state).fit(X)
         self.pca = pca
         self.k = k
+        self.mean_ = pca.mean_
+        self.components_ = pca.components_
+        self.explained_variance_ = pca.explained_variance_
+
+        # Later calls to partial_fit add to X. The scatter matrix is only
+        # built from the fitted components if they do.
+        self.n_samples_seen_ = X.shape[0]
+        self._mean = pca.mean_
+        self._scatter = None
+        self._stale = False
         return self
-    
-    def predict(self, X):
-        pca = self.pca
-        X_proj = pca.transform(X)
-        k = self.k
-        
-        if not self.sum_top:
-            sum_of_scores = np.sum(np.sqrt(X_proj[:,k:]**2 / pca.explained_variance_[k:]), axis=1)
+
+    def partial_fit(self, X, y=None):
+        '''
+        Update the mean and the covariance matrix with a batch of samples.
+
+        The mean and the scatter matrix of the batch are merged with the
+        running ones, which keeps the update numerically stable. Memory and
+        time per batch are O(n_batch * d^2), independent of the number of
+        samples seen. The principal components are recomputed, in O(d^3),
+        once before the next `predict`.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_batch, n_features)
+        '''
+        X = np.asarray(X, dtype=np.float64)
+        n_new = X.shape[0]
+        mean_new = X.mean(axis=0)
+        centered = X - mean_new
+        scatter_new = centered.T.dot(centered)
+
+        if getattr(self, 'n_samples_seen_', 0) == 0:
+            self.n_samples_seen_ = n_new
+            self._mean = mean_new
+            self._scatter = scatter_new
         else:
-            sum_of_scores = np.sum(np.sqrt(X_proj[:,:k]**2 / pca.explained_variance_[:k]), axis=1)
-            
-        return sum_of_scores         
\ No newline at end of file
+            if self._scatter is None:
+                self._scatter = self._fitted_scatter()
+            n_old = self.n_samples_seen_
+            n = n_old + n_new
+            delta = mean_new - self._mean
+            self._mean = self._mean + delta * n_new / float(n)
+            self._scatter = (self._scatter + scatter_new +
+                             np.outer(delta, delta) * n_old * n_new / float(n))
+            self.n_samples_seen_ = n
+
+        self._stale = True
+        return self
+
+    def _reset(self):
+        self.n_samples_seen_ = 0
+        self._stale = False
+
+    def _fitted_scatter(self):
+        # Scatter matrix of the samples of an in-memory fit, from its
+        # components, O(k * d^2)
+        pca = self.pca
+        weights = pca.explained_variance_ * max(self.n_samples_seen_ - 1, 1)
+        return (pca.components_.T * weights).dot(pca.components_)
+
+    def _update_components(self):
+        n_features = self._mean.shape[0]
+        self.k = self._n_top(n_features)
+
+        covariance = self._scatter / max(self.n_samples_seen_ - 1, 1)
+        eigvals, eigvecs = eigh(covariance)
+        ind = np.argsort(eigvals)[-1::-1]  # largest first
+        if self.sum_top:
+            ind = ind[:self.k]
+
+        self.mean_ = self._mean
+        self.components_ = eigvecs[:, ind].T
+        self.explained_variance_ = np.maximum(eigvals[ind], 0.)
+        self._stale = False
+
+    def predict(self, X):
+        if self._stale:
+            self._update_components()
+        return predict_in_chunks(self._predict_chunk, X, self.chunk_size)
+
+    def _predict_chunk(self, X):
+        X_proj = (X - self.mean_).dot(self.components_.T)
+        return _sum_of_scores(X_proj, self.explained_variance_, self.k,
+                              self.sum_top)
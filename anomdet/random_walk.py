@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from base import BaseAnomalyDetector
+from _config import get_config
 
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity, rbf_kernel
@@ -12,6 +13,10 @@ class RandomWalkOutlier(BaseAnomalyDetector):
     similarity_function : str, the similarity measure to use
         'cosine' - Cosine Similarity
         'rbf' - RBF Similarity
+
+    The similarity matrix is computed in the dtype configured with
+    `anomdet.set_config`.
+
     References
     ----------
 
@@ -35,14 +40,17 @@ class RandomWalkOutlier(BaseAnomalyDetector):
         except ValueError as err:
             print "similarity_measure should be one of: %s" % " ".join(RandomWalkOutlier.POSSIBLE_SIMILARITY_MEASURES)
             raise
+        X = np.asarray(X, dtype=get_config()['dtype'])
         if sim == 0:
             S = cosine_similarity(X)
         elif sim == 1:
             S = rbf_kernel(X)
         S[range(S.shape[0]), range(S.shape[1])] = 0.
         # normalize rows and add in damping factor
-        A = (S / S.sum(axis=1)[:,None])
-        A = A * (1. - self.damping_factor) + (self.damping_factor / A.shape[1])
+        A = S
+        A /= S.sum(axis=1)[:,None]
+        A *= 1. - self.damping_factor
+        A += self.damping_factor / A.shape[1]
         
         # power method for finding eigenvector
         c = np.ones(X.shape[0]) / X.shape[0]
@@ -32,8 +32,13 @@ import sys
 #log = logging.getLogger('SOS')
 
 
-def x2d(X, metric, logger=None):
-    """Computer dissimilarity matrix."""
+def x2d(X, metric, logger=None, dtype=np.float64, batch_size=1000):
+    """Computer dissimilarity matrix.
+
+    The matrix is filled `batch_size` rows at a time, so only a
+    (batch_size, n) block is ever held in float64 when dtype is np.float32.
+
+    """
 
     metric = metric.lower()
     (n, d) = X.shape
@@ -45,7 +50,7 @@ def x2d(X, metric, logger=None):
             exit(1)
         else:
             logger.debug("The data set is a dissimilarity matrix")
-            D = X
+            D = np.array(X, dtype=dtype)
     #elif metric == 'euclidean':
         #logger.debug("Computing dissimilarity matrix using Euclidean metric")
         #sumX = np.sum(np.square(X), 1)
@@ -61,7 +66,10 @@ def x2d(X, metric, logger=None):
         else:
             logger.debug("Computing dissimilarity matrix using %s metric",
                 metric.capitalize())
-            D = distance.squareform(distance.pdist(X, metric))
+            D = np.empty((n, n), dtype=dtype)
+            for start in range(0, n, batch_size):
+                stop = min(start + batch_size, n)
+                D[start:stop] = distance.cdist(X[start:stop], X, metric)
     return D
 
 def init_nonzero(n):
@@ -83,7 +91,7 @@ def d2a(D, perplexity, tol=1e-5, logger=None):
     """
 
     (n, _) = D.shape
-    A = np.zeros((n, n))
+    A = np.zeros((n, n), dtype=D.dtype)
     beta = 10.0 + np.abs(np.random.randn(n))
     ##beta = init_nonzero(n) 
     #beta = np.ones((n, 1))
@@ -143,25 +151,31 @@ def get_perplexity(D, beta, logger=None):
 
 
 def a2b(A, logger=None):
+    """Return binding matrix. Overwrites A."""
     logger.debug("Computing binding probabilities")
-    B = A / A.sum(axis=1)[:,np.newaxis]
+    B = A
+    B /= A.sum(axis=1)[:,np.newaxis]
     return B
 
 
 def b2o(B, logger=None):
+    """Return outlier probabilities. Overwrites B."""
     logger.debug("Computing outlier probabilities")
-    O = np.prod(1-B, 0)
+    np.subtract(1, B, out=B)
+    O = np.prod(B, 0)
     return O
 
 
-def sos(X, metric, perplexity, logger=None):
-    D = x2d(X, metric, logger=logger)
+def sos(X, metric, perplexity, logger=None, dtype=np.float64):
+    D = x2d(X, metric, logger=logger, dtype=dtype)
     
     # Normalize distance matrix so that distances aren't too large
     # (for numerical reasons)
-    D = D / np.mean(D)
+    D /= np.mean(D)
     
     A = d2a(D, perplexity, logger=logger)
+    # Only one (n, n) matrix besides A is alive at a time
+    del D
     B = a2b(A, logger=logger)
     #if args.binding_matrix:
     #    np.savetxt(args.output, B, '%1.8f', delimiter=',')
@@ -1,5 +1,6 @@
 # Wrapper for Stochastic Outlier Selection
 
+from .._config import get_config
 from ..base import BaseAnomalyDetector
 from .sos import sos
 import logging
@@ -23,6 +24,9 @@ class StochasticOutlierSelection(BaseAnomalyDetector):
     
     verbose : bool, default : False
     
+    The dissimilarity and affinity matrices are computed in the dtype
+    configured with `anomdet.set_config`.
+    
     Returns
     -------
 
@@ -71,7 +75,8 @@ class StochasticOutlierSelection(BaseAnomalyDetector):
         
         if self.standard_scale:
             X = StandardScaler().fit_transform(X.copy())
-        return sos(X, self.metric, self.perplexity, logger=logger)
+        return sos(X, self.metric, self.perplexity, logger=logger,
+                   dtype=get_config()['dtype'])
     
     def fit(self, X=None, y=None):
         self.X_ = X
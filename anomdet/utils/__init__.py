@@ -8,6 +8,9 @@ from sklearn.utils import check_random_state
 from simple_timer import SimpleTimer, my_timer
 from .rankings import scores_to_ranks, rank_distances
 from .check_n_neighbors import check_n_neighbors
+from .chunked import iter_chunks, predict_in_chunks, effective_n_jobs
+from .chunked import map_row_blocks
+from .precision import check_dtype_precision
 
 DEFAULT_SEED = 888
 
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from sklearn.externals.joblib import Parallel, delayed, cpu_count, dump, load
+
+from .._config import get_config
+
+
+def iter_chunks(n, chunk_size=None):
+    '''
+    Iterate over row blocks of an array with `n` rows.
+    
+    Parameters
+    ----------
+    n : int
+        Number of rows.
+        
+    chunk_size : int, optional (default=None)
+        Number of rows per block. If None, a single block of all rows.
+    
+    Yields
+    ------
+    (start, stop) : the rows of the block are start:stop
+    '''
+    if chunk_size is None:
+        chunk_size = max(n, 1)
+    for start in xrange(0, n, chunk_size):
+        yield start, min(start + chunk_size, n)
+
+
+def effective_n_jobs(n_jobs=1):
+    '''
+    Number of worker processes for `n_jobs`, where negative values count
+    back from the number of CPUs (-1 means all CPUs).
+    '''
+    if n_jobs == 0:
+        raise ValueError("n_jobs should not be 0!")
+    if n_jobs < 0:
+        return max(cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def _call_shared(path, start, stop, X=None):
+    # Runs in a worker: load what map_row_blocks dumped, with its arrays
+    # memory-mapped copy-on-write, and apply the function to the rows
+    func, X_shared = load(path, mmap_mode='c')
+    if X is None:
+        X = X_shared[start:stop]
+    return func(np.asarray(X))
+
+
+def _shared_jobs(path, X, blocks):
+    if isinstance(X, np.memmap):
+        # Already on disk, joblib passes the blocks as references to it
+        return [delayed(_call_shared)(path, start, stop, X[start:stop])
+                for start, stop in blocks]
+    return [delayed(_call_shared)(path, start, stop) for start, stop in blocks]
+
+
+def map_row_blocks(func, X, blocks, n_jobs):
+    '''
+    Apply `func` to the row blocks X[start:stop] in worker processes.
+    
+    `func`, with the fitted model it references, and X are dumped once to a
+    temporary folder. Every worker loads them back with their arrays
+    memory-mapped, so the fitted samples, the index and the query rows are
+    shared through the page cache instead of being pickled for every job.
+    A job only carries the path of the dump and its row range. An np.memmap
+    X is not dumped again; joblib passes its blocks as references to the
+    file, as it does for any array larger than `max_nbytes`.
+    
+    Parameters
+    ----------
+    func : callable
+        Takes an array of shape (n_block_rows, n_features). Must be
+        picklable, e.g. a module level function or a functools.partial of
+        one.
+    
+    X : array-like, shape (n_samples, n_features)
+    
+    blocks : list of (start, stop)
+    
+    n_jobs : int
+        Number of worker processes.
+    
+    Returns
+    -------
+    results : list
+        The results of `func` for the blocks, in order.
+    '''
+    folder = tempfile.mkdtemp(prefix='anomdet_')
+    try:
+        path = os.path.join(folder, 'shared.pkl')
+        dump((func, None if isinstance(X, np.memmap) else np.asarray(X)), path)
+        return Parallel(n_jobs=n_jobs, max_nbytes='1M')(
+            _shared_jobs(path, X, blocks))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def predict_in_chunks(predict_chunk, X, chunk_size=None, out=None, n_jobs=1):
+    '''
+    Score the rows of X one block at a time.
+    
+    Only one block of X is loaded into memory at a time, so X can be an
+    np.memmap, or any array-like supporting row slicing, which does not fit
+    in memory.
+    
+    Parameters
+    ----------
+    predict_chunk : callable
+        Takes an array of shape (n_block_rows, n_features) and returns the
+        scores of its rows. Must be picklable if `n_jobs` is not 1, e.g. a
+        module level function or a functools.partial of one.
+    
+    X : array-like, shape (n_samples, n_features)
+    
+    chunk_size : int, optional (default=None)
+        Number of rows scored at a time. If None, all rows at once.
+    
+    out : array-like, shape (n_samples,), optional (default=None)
+        Preallocated output, e.g. an np.memmap. If None, a new array of the
+        configured dtype is allocated, see `anomdet.set_config`.
+    
+    n_jobs : int, optional (default=1)
+        Number of worker processes the blocks are distributed over. If
+        `chunk_size` is None, X is split into one block per worker. The
+        fitted model is shared with the workers, see `map_row_blocks`.
+        
+    Returns
+    -------
+    out : array-like, shape (n_samples,)
+    
+    Examples
+    --------
+    >>> X = np.load('data.npy', mmap_mode='r')
+    >>> out = np.lib.format.open_memmap('scores.npy', mode='w+',
+    ...                                 shape=(X.shape[0],))
+    >>> predict_in_chunks(clf.predict, X, chunk_size=100000, out=out)
+    '''
+    n = X.shape[0]
+    if out is None:
+        out = np.empty(n, dtype=get_config()['dtype'])
+    elif out.shape[0] != n:
+        raise ValueError("out should have one element per row of X!")
+    
+    n_jobs = effective_n_jobs(n_jobs)
+    if n_jobs == 1:
+        for start, stop in iter_chunks(n, chunk_size):
+            out[start:stop] = predict_chunk(np.asarray(X[start:stop]))
+        return out
+    
+    if chunk_size is None:
+        chunk_size = int(np.ceil(n / float(n_jobs)))
+    chunks = list(iter_chunks(n, chunk_size))
+    
+    results = map_row_blocks(predict_chunk, X, chunks, n_jobs)
+    for (start, stop), scores in zip(chunks, results):
+        out[start:stop] = scores
+    
+    return out
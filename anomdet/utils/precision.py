@@ -0,0 +1,51 @@
+import numpy as np
+from scipy.stats import spearmanr
+from sklearn.base import clone
+
+from .._config import config_context
+
+
+def check_dtype_precision(detector, X, dtype=np.float32):
+    '''
+    Compare the scores of a detector computed in `dtype` with its scores
+    computed in float64.
+    
+    Parameters
+    ----------
+    detector : detector
+        Unfitted detector, cloned for each run.
+    
+    X : array-like, shape (n_samples, n_features)
+        Data the detector is fitted on and scores.
+    
+    dtype : np.float32 or np.float64, optional (default=np.float32)
+    
+    Returns
+    -------
+    max_error : float
+        Largest absolute difference of the scores, relative to the largest
+        absolute float64 score.
+    
+    rank_correlation : float
+        Spearman rank correlation of the two scores. Detection only depends
+        on the ranking, so a value close to 1 means `dtype` is safe to use.
+    
+    Examples
+    --------
+    >>> max_error, rank_correlation = check_dtype_precision(KPCA(1., 10), X)
+    '''
+    with config_context(dtype=np.float64):
+        expected = np.asarray(clone(detector).fit(X).predict(X), dtype=float)
+    with config_context(dtype=dtype):
+        scores = np.asarray(clone(detector).fit(X).predict(X), dtype=float)
+    
+    finite = np.isfinite(expected) & np.isfinite(scores)
+    if not finite.any():
+        raise ValueError("No finite scores to compare!")
+    expected, scores = expected[finite], scores[finite]
+    
+    max_error = np.abs(scores - expected).max() / max(np.abs(expected).max(),
+                                                      np.finfo(float).tiny)
+    rank_correlation = spearmanr(scores, expected)[0]
+    
+    return max_error, rank_correlation
@@ -8,8 +8,9 @@ from sklearn.utils.testing import assert_array_almost_equal
 from sklearn.utils.testing import assert_equal
 from sklearn.utils.testing import assert_raises
 from sklearn.utils.testing import assert_greater
+from sklearn.utils.testing import assert_true
 
-from .. import ABOD
+from .. import ABOD, LBABOD
 
 def test_abod():
     '''
@@ -20,3 +21,56 @@ def test_abod():
     assert_array_almost_equal(ABOD().fit().predict(A),
                               np.array([0.2431, 0.2431, 1.0000, 0.1894, 0.1894, 0]),
                               decimal=3)
+
+
+def _abod_loop(A, n_k):
+    # Reference implementation, looping over the pairs of neighbors
+    var_array = []
+    for i in range(A.shape[0]):
+        index = np.argsort(np.sum((A[i] - A)**2, axis=1))[1:n_k]
+        wx2 = wx = w = 0.
+        for count, j in enumerate(index):
+            for k in index[count + 1:]:
+                v1, v2 = A[j] - A[i], A[k] - A[i]
+                nn = np.sqrt(v1.dot(v1) * v2.dot(v2))
+                wx2 += (1. / nn) * (v1.dot(v2) / nn**2)**2
+                wx += v1.dot(v2) / nn**3
+                w += 1. / nn
+        var_array.append(wx2 / w - (wx / w)**2)
+    return np.array(var_array)
+
+
+def test_abod_batches():
+    '''
+    Test that batched ABOD matches the loop over pairs of neighbors.
+    '''
+    rs = np.random.RandomState(0)
+    A = np.vstack((rs.randn(60, 4), rs.uniform(-6, 6, size=(5, 4))))
+
+    var_array = _abod_loop(A, 8)
+    expected = ((var_array - var_array.min()) /
+                (var_array.max() - var_array.min()))
+    for batch_size in (1, 1000):
+        assert_array_almost_equal(
+            ABOD(n_k=8, batch_size=batch_size).fit().predict(A), expected)
+
+
+def test_lbabod():
+    '''
+    Test that LB-ABOD finds the top_n outliers of the exact ABOD while
+    refining fewer than all the points.
+    '''
+    rs = np.random.RandomState(0)
+    A = np.vstack((rs.randn(45, 3), rs.uniform(-6, 6, size=(5, 3))))
+
+    exact = _abod_loop(A, A.shape[0])
+    clf = LBABOD(n_k=10, top_n=5, batch_size=100).fit()
+    abof = clf.predict(A)
+
+    assert_array_equal(np.sort(clf.outliers_), np.sort(np.argsort(exact)[:5]))
+    assert_greater(A.shape[0], clf.n_refined_)
+
+    # Exact on the outliers, a lower bound on the others
+    assert_array_almost_equal(abof[clf.outliers_] / exact[clf.outliers_],
+                              np.ones(5))
+    assert_true(np.all(abof <= exact * (1 + 1e-9)))
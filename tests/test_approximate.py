@@ -0,0 +1,76 @@
+import numpy as np
+
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils.testing import assert_array_equal
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_greater
+from sklearn.utils.testing import assert_raises
+
+from ..datasets import OutlierDataset
+from ..neighborhood import KNN, LOF, NeighborhoodGraph
+from ..neighborhood.approximate import make_neighbors
+from ..neighborhood.approximate_benchmark import benchmark_approximate_neighbors
+
+def test_approximate_neighbors():
+    '''
+    Test that the approximate indices return sorted, exact distances to
+    their neighbors and find most of the true neighbors.
+    '''
+    X = np.random.RandomState(0).rand(2000, 3)
+    Q = np.random.RandomState(1).rand(100, 3)
+    _, true_indices = NearestNeighbors(n_neighbors=5).fit(X).kneighbors(Q)
+    
+    for algorithm in ['rp_forest', 'lsh']:
+        nbrs = make_neighbors(algorithm, 5, {'random_state': 0}).fit(X)
+        distances, indices = nbrs.kneighbors(Q)
+        
+        assert_array_equal(distances.shape, (100, 5))
+        assert np.all(np.diff(distances, axis=1) >= 0)
+        assert_array_almost_equal(distances,
+                                  np.sqrt(((X[indices] - Q[:, None, :])**2).sum(axis=2)))
+        
+        recall = np.mean([len(set(a).intersection(b)) for a, b in zip(indices, true_indices)]) / 5.
+        assert_greater(recall, 0.8)
+
+def test_approximate_neighbors_few_candidates():
+    '''
+    Test that queries with too few candidates fall back to exact search.
+    '''
+    X = np.random.RandomState(0).rand(50, 2)
+    nbrs = make_neighbors('rp_forest', 3, {'n_trees': 1, 'random_state': 0}).fit(X)
+    distances, indices = nbrs.kneighbors(X[:5], n_neighbors=40)
+    true_distances, _ = NearestNeighbors().fit(X).kneighbors(X[:5], n_neighbors=40)
+    assert_array_almost_equal(distances, true_distances)
+
+def test_approximate_lof():
+    '''
+    Test detectors and graphs with an approximate algorithm.
+    '''
+    X = np.random.RandomState(0).rand(300, 2)
+    exact = LOF(k=5).fit(X).predict(X)
+    approx = LOF(k=5, algorithm='rp_forest',
+                 algorithm_params={'random_state': 0}).fit(X).predict(X)
+    assert_greater(np.corrcoef(exact, approx)[0, 1], 0.9)
+    
+    assert_raises(ValueError, NeighborhoodGraph(algorithm='kd').fit, X)
+
+def test_benchmark_approximate_neighbors():
+    '''
+    Smoke test of the benchmark on a tiny synthetic dataset.
+    '''
+    rs = np.random.RandomState(0)
+    X = np.vstack((rs.randn(100, 5), rs.uniform(-6, 6, size=(5, 5))))
+    y = np.arange(105) >= 100
+    dat = OutlierDataset(X, y=y, name="Tiny")
+    
+    rows = benchmark_approximate_neighbors(
+        [dat], detectors=[KNN(k=5), LOF(k=5)],
+        algorithm_params={'rp_forest': {'random_state': 0},
+                          'lsh': {'random_state': 0}},
+        verbose=False)
+    assert_array_equal([row[:3] for row in rows],
+                       [["Tiny", "KNN", "rp_forest"], ["Tiny", "KNN", "lsh"],
+                        ["Tiny", "LOF", "rp_forest"], ["Tiny", "LOF", "lsh"]])
+    for row in rows:
+        assert_greater(row[4], 0.9)
+        assert_array_almost_equal(row[5], row[4] - row[3])
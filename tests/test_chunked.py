@@ -0,0 +1,108 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_equal
+from sklearn.utils.testing import assert_greater
+from sklearn.utils.testing import assert_raises
+
+from ..neighborhood import KNN, LOF, COF, LoOP
+from ..utils import predict_in_chunks
+from ..utils import chunked
+
+def test_chunked_memmap_predict():
+    '''
+    Test that scoring a memmap in chunks into a memmapped output gives the
+    same scores as scoring it at once.
+    '''
+    rs = np.random.RandomState(0)
+    X = rs.rand(100, 3)
+    Y = rs.rand(55, 3)
+    
+    tmpdir = tempfile.mkdtemp()
+    try:
+        Y_mm = np.lib.format.open_memmap(os.path.join(tmpdir, 'Y.npy'), mode='w+',
+                                         dtype=Y.dtype, shape=Y.shape)
+        Y_mm[:] = Y
+        Y_mm.flush()
+        Y_mm = np.load(os.path.join(tmpdir, 'Y.npy'), mmap_mode='r')
+        
+        for detector in [KNN(k=3), LOF(k=5), COF(k=5), LoOP(k=5)]:
+            expected = detector.fit(X).predict(Y)
+            
+            detector.set_params(chunk_size=10).fit(X)
+            out = np.lib.format.open_memmap(os.path.join(tmpdir, 'out.npy'), mode='w+',
+                                            dtype=float, shape=(55,))
+            result = detector.predict(Y_mm, out=out)
+            assert result is out
+            assert_array_almost_equal(out, expected)
+            del out, result
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_lof_novelty():
+    '''
+    Test that copies of the fitted samples score the same as the samples
+    '''
+    X = np.random.RandomState(0).rand(100, 2)
+    lof = LOF(k=5).fit(X)
+    assert_array_almost_equal(lof.predict(X.copy()), lof.predict())
+
+def test_predict_in_chunks_out_shape():
+    assert_raises(ValueError, predict_in_chunks, np.ones, np.ones((5, 2)), 2, np.empty(4))
+
+def test_parallel_predict():
+    '''
+    Test that sharding the queries over worker processes gives the same
+    scores as a single process, for the fitted samples and for new data.
+    '''
+    rs = np.random.RandomState(0)
+    X = rs.rand(100, 3)
+    Y = rs.rand(55, 3)
+    
+    for detector in [KNN(k=3), LOF(k=5), COF(k=5), LoOP(k=5)]:
+        detector.fit(X)
+        expected_X, expected_Y = detector.predict(), detector.predict(Y)
+        
+        detector.set_params(n_jobs=2).fit(X)
+        assert_array_almost_equal(detector.predict(), expected_X)
+        assert_array_almost_equal(detector.predict(Y), expected_Y)
+        detector.set_params(chunk_size=10)
+        assert_array_almost_equal(detector.predict(Y), expected_Y)
+
+
+def test_parallel_payload():
+    '''
+    Test that the jobs sent to the workers carry the path of the shared
+    model and their query rows only, so they do not grow with the number
+    of fitted samples.
+    '''
+    rs = np.random.RandomState(0)
+    Y = rs.rand(40, 3)
+    
+    payloads = []
+    def recording_jobs(path, X, blocks):
+        jobs = shared_jobs(path, X, blocks)
+        payloads[-1].extend(len(pickle.dumps(job, -1)) for job in jobs)
+        return jobs
+    
+    shared_jobs = chunked._shared_jobs
+    chunked._shared_jobs = recording_jobs
+    try:
+        for n_samples in (100, 5000):
+            payloads.append([])
+            X = rs.rand(n_samples, 3)
+            for detector in [KNN(k=3), LOF(k=5), COF(k=5), LoOP(k=5)]:
+                expected = detector.fit(X).predict(Y)
+                detector.set_params(n_jobs=2, chunk_size=10).fit(X)
+                assert_array_almost_equal(detector.predict(Y), expected)
+    finally:
+        chunked._shared_jobs = shared_jobs
+    
+    # Only the row ranges, whose numbers grow, take a few more bytes
+    assert_equal(len(payloads[0]), len(payloads[1]))
+    assert_greater(max(payloads[0]) + 10, max(payloads[1]))
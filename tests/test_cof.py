@@ -21,4 +21,14 @@ def test_cof():
     
     assert_array_almost_equal(COF(k=k).fit().predict(data),
                               np.array([0.9874, 0.9874, 0.9875, 0.9872, 0.9871, 0.9869, 0.9868, 0.9868, 0.9868, 0.9868, 1.0918, 1.0692, 1.0642, 1.0642, 1.0660, 1.0653, 1.0673, 1.0690]),
-                              decimal=2)
\ No newline at end of file
+                              decimal=2)
+
+
+def test_cof_batch_size():
+    '''
+    Test that COF does not depend on the batch size used
+    '''
+    X = np.random.RandomState(0).rand(200, 3)
+    cof = COF(k=10).fit(X).predict(X)
+    for batch_size in [1, 11, 500, 100000]:
+        assert_array_almost_equal(COF(k=10, batch_size=batch_size).fit(X).predict(X), cof)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from sklearn.utils.testing import assert_equal
+from sklearn.utils.testing import assert_greater
+from sklearn.utils.testing import assert_less
+from sklearn.utils.testing import assert_raises
+
+from .._config import get_config, set_config, config_context
+from ..kpca import KPCA
+from ..neighborhood import KNN, LOF, COF, LoOP
+from ..sos import StochasticOutlierSelection
+from ..utils import check_dtype_precision
+
+def test_config_context():
+    assert_equal(get_config()['dtype'], np.float64)
+    with config_context(dtype='float32'):
+        assert_equal(get_config()['dtype'], np.float32)
+    assert_equal(get_config()['dtype'], np.float64)
+    
+    assert_raises(ValueError, set_config, dtype=np.int32)
+
+def test_float32_scores():
+    '''
+    Test that float32 scores are float32 and rank the samples like the
+    float64 scores.
+    '''
+    X = np.random.RandomState(0).rand(200, 3)
+    
+    detectors = [KNN(k=3), LOF(k=5), COF(k=5), LoOP(k=5),
+                 StochasticOutlierSelection(), KPCA(sigma=0.5, n_eigval=10)]
+    for detector in detectors:
+        with config_context(dtype=np.float32):
+            assert_equal(detector.fit(X).predict(X).dtype, np.float32)
+        
+        max_error, rank_correlation = check_dtype_precision(detector, X)
+        assert_less(max_error, 1e-3)
+        assert_greater(rank_correlation, 0.999)
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_array_equal
+from sklearn.utils.testing import assert_greater
+from sklearn.utils.testing import assert_raises
+
+from .. import IForest, StreamingIForest
+from ..iforest import _adjustment, _reservoir_samples
+
+
+def _iforest_loop(clf, X):
+    # Reference scores, walking every tree one point at a time
+    scores = np.zeros(X.shape[0])
+    for i in range(X.shape[0]):
+        for tree in clf.trees:
+            path_length, leaf_size = tree.path_length_and_leaf_size(X[i])
+            scores[i] += path_length + _adjustment(leaf_size)
+    return 2**(-scores / len(clf.trees) / _adjustment(clf.psi))
+
+
+def test_iforest_flat_traversal():
+    rs = np.random.RandomState(0)
+    X = np.vstack((rs.randn(300, 3), rs.uniform(-6, 6, size=(5, 3))))
+
+    clf = IForest(num_trees=10, subsample_size=64, random_state=0,
+                  chunk_size=70).fit(X)
+    scores = clf.predict(X)
+    assert_array_almost_equal(scores, _iforest_loop(clf, X))
+    assert_greater(scores[-5:].mean(), scores[:-5].mean())
+
+    # The leaves reached in the forest are those of the single trees
+    leaves = clf._forest.apply(X)
+    for t, tree in enumerate(clf.trees):
+        assert_array_equal(leaves[:, t] - clf._forest.roots[t], tree.apply(X))
+
+
+def test_adjustment():
+    assert_array_almost_equal(_adjustment([0, 1, 2, 256]),
+                              [0., 0., 1., 2 * (np.log(255) + 0.5772156649) - 2 * 255 / 256.])
+    assert_array_almost_equal(_adjustment(256), 10.244770)
+    # 2(n-1)/n is not truncated to an integer
+    assert_array_almost_equal(_adjustment([3, 4]), [2 * (np.log(2) + 0.5772156649) - 4 / 3.,
+                                                    2 * (np.log(3) + 0.5772156649) - 6 / 4.])
+
+
+def test_iforest_n_jobs():
+    rs = np.random.RandomState(0)
+    X = rs.randn(200, 3)
+
+    forests = [IForest(num_trees=7, subsample_size=32, random_state=0,
+                       n_jobs=n_jobs).fit(X) for n_jobs in (1, 2, 3)]
+    for clf in forests[1:]:
+        for name in ('split_attribute', 'split_value', 'children'):
+            assert_array_equal(getattr(clf._forest, name),
+                               getattr(forests[0]._forest, name))
+        assert_array_equal(clf.predict(X), forests[0].predict(X))
+
+
+def test_streaming_iforest():
+    rs = np.random.RandomState(0)
+    clf = StreamingIForest(num_trees=10, subsample_size=64, window_size=300,
+                           replace_fraction=0.2, random_state=0)
+
+    # All the trees are rebuilt until the window holds subsample_size points
+    clf.partial_fit(rs.randn(20, 2))
+    assert_array_equal([clf.psi, len(clf.trees)], [20, 10])
+
+    # An empty mini-batch changes nothing
+    trees = list(clf.trees)
+    clf.partial_fit(np.empty((0, 2)))
+    assert all(tree is old for tree, old in zip(clf.trees, trees))
+
+    # and on the batch which fills it to subsample_size points
+    clf.partial_fit(rs.randn(100, 2))
+    assert_array_equal([clf.psi, len(clf.trees)], [64, 10])
+    assert_array_equal([tree.leaf_size.sum() for tree in clf.trees], 64)
+
+    trees = list(clf.trees)
+    clf.partial_fit(rs.randn(100, 2))
+    assert_array_equal([clf.psi, len(clf.trees), clf._window_count], [64, 10, 220])
+    assert all(tree is old for tree, old in zip(clf.trees[:8], trees[2:]))
+    assert not any(tree is old for tree in clf.trees[8:] for old in trees)
+
+    # After a drift, the window and the forest follow the new points
+    for _ in range(10):
+        batch = rs.randn(100, 2) + 10
+        clf.partial_fit(batch)
+    assert_greater(clf.predict(np.zeros((1, 2)))[0], clf.predict(batch).mean())
+    assert_greater(clf._window.min(), 5)
+
+
+def test_reservoir_samples():
+    X = np.arange(40.)[:, None]
+
+    def samples(chunk_size):
+        random_states = [np.random.RandomState(seed) for seed in range(2000)]
+        chunks = (X[i:i + chunk_size] for i in range(0, 40, chunk_size))
+        return _reservoir_samples(chunks, 4, random_states)[:, :, 0]
+
+    # The samples do not depend on the chunks, have no repeated rows and
+    # draw every row about equally often
+    sample = samples(3)
+    assert_array_equal(sample, samples(40))
+    assert_array_equal(np.sort(sample, axis=1)[:, 1:] > np.sort(sample, axis=1)[:, :-1], True)
+    counts = np.bincount(sample.astype(int).ravel(), minlength=40)
+    assert_greater(counts.min(), 0.7 * 2000 * 4 / 40.)
+
+    # Fewer rows than psi
+    random_states = [np.random.RandomState(0)]
+    assert_array_equal(_reservoir_samples([X[:2]], 4, random_states), [X[:2]])
+
+
+def test_iforest_out_of_core():
+    rs = np.random.RandomState(0)
+    X = rs.randn(500, 3)
+
+    clf = IForest(num_trees=5, subsample_size=64, random_state=0)
+    scores = clf.fit(iter(np.array_split(X, 7))).predict(X)
+    assert_array_equal(clf.psi, 64)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        np.save(os.path.join(tmpdir, 'X.npy'), X)
+        X_mm = np.load(os.path.join(tmpdir, 'X.npy'), mmap_mode='r')
+        clf = IForest(num_trees=5, subsample_size=64, random_state=0, chunk_size=100)
+        assert_array_equal(clf.fit(X_mm).predict(X), scores)
+        assert_raises(ValueError, IForest(subsample_size=0.25).fit, X_mm)
+        del X_mm
+    finally:
+        shutil.rmtree(tmpdir)
+
+    assert_raises(ValueError, IForest(subsample_size=0.5).fit, iter([X]))
+
+    # A short stream does not fix the height limit of later fits
+    clf = IForest(num_trees=5, subsample_size=64, random_state=0)
+    clf.fit(iter([X[:4]]))
+    assert clf.height_limit is None
+    depths = [tree.depth.max() for tree in clf.fit(X).trees]
+    assert_greater(min(depths), 2)
+
+
+def test_iforest_save_load():
+    rs = np.random.RandomState(0)
+    X = rs.randn(200, 3)
+    clf = IForest(num_trees=8, subsample_size=32, random_state=0).fit(X)
+    expected = clf.predict(X)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'forest')
+        clf.save(path)
+        loaded = IForest.load(path, chunk_size=50)
+        assert isinstance(loaded._forest.children, np.memmap)
+        assert_array_equal([loaded.psi, loaded.num_trees], [32, 8])
+        assert_array_equal(loaded.predict(X), expected)
+
+        loaded = IForest.load(path, mmap=False)
+        assert not isinstance(loaded._forest.children, np.memmap)
+        assert_array_equal(loaded.predict(X), expected)
+
+        path = os.path.join(tmpdir, 'forest.npz')
+        clf.save(path)
+        assert_array_equal(IForest.load(path).predict(X), expected)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_iforest_predict_anytime():
+    rs = np.random.RandomState(0)
+    X = np.vstack((rs.randn(2000, 3), rs.uniform(-8, 8, size=(10, 3))))
+    clf = IForest(num_trees=40, subsample_size=128, random_state=0,
+                  chunk_size=300).fit(X)
+    expected = clf.predict(X)
+
+    scores, n_trees = clf.predict_anytime(X, threshold=0.5, block_size=5)
+    assert_greater(40, n_trees.mean())
+    assert_array_equal(n_trees[-10:], 40)
+
+    # The rows which went down all the trees have the full scores, and
+    # the dropped ones are below the threshold
+    full = n_trees == 40
+    assert_array_almost_equal(scores[full], expected[full])
+    assert (scores[~full] < 0.5).all()
+
+    # Without dropping, the scores are those of predict
+    scores, n_trees = clf.predict_anytime(X, threshold=1e-6)
+    assert_array_almost_equal(scores, expected)
+    assert_array_equal(n_trees, 40)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from sklearn.utils.testing import assert_array_equal
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_raises
+
+from ..neighborhood import LOF, IncrementalLOF
+
+def test_incremental_lof_fit():
+    '''
+    Test that IncrementalLOF agrees with LOF on a static dataset
+    '''
+    X = np.random.RandomState(0).rand(100, 3)
+    for k in [1, 5, 10]:
+        assert_array_almost_equal(IncrementalLOF(k=k).fit(X).predict(),
+                                  LOF(k=k).fit(X).predict(X))
+
+def test_incremental_lof_insert():
+    '''
+    Test that inserting samples gives the same LOF as refitting
+    '''
+    X = np.random.RandomState(0).rand(150, 3)
+    ilof = IncrementalLOF(k=7).fit(X[:100])
+    new_ids = ilof.insert(X[100:120])
+    assert_array_equal(new_ids, np.arange(100, 120))
+    for i in range(120, 150):
+        ilof.partial_fit(X[i:(i+1)])
+    
+    assert_array_equal(ilof.ids, np.arange(150))
+    assert_array_almost_equal(ilof.predict(), LOF(k=7).fit(X).predict(X))
+
+def test_incremental_lof_delete():
+    '''
+    Test that deleting samples gives the same LOF as refitting
+    '''
+    X = np.random.RandomState(1).rand(150, 2)
+    ilof = IncrementalLOF(k=5).fit(X)
+    deleted = np.arange(0, 150, 3)
+    ilof.delete(deleted[:10])
+    ilof.delete(deleted[10:])
+    
+    kept = np.setdiff1d(np.arange(150), deleted)
+    assert_array_equal(ilof.ids, kept)
+    assert_array_almost_equal(ilof.predict(), LOF(k=5).fit(X[kept]).predict(X[kept]))
+    
+    assert_raises(ValueError, ilof.delete, [0])
+
+def test_incremental_lof_novelty():
+    '''
+    Test that predicting new data does not change the stored samples
+    '''
+    rs = np.random.RandomState(2)
+    X = rs.rand(100, 2)
+    ilof = IncrementalLOF(k=5).fit(X)
+    before = ilof.predict()
+    scores = ilof.predict(np.array([[0.5, 0.5], [3.0, 3.0]]))
+    assert_array_equal(ilof.predict(), before)
+    assert scores[1] > scores[0]
+
+def test_incremental_lof_rebuild():
+    '''
+    Test that updates across rebuilds of the neighbor index, and a
+    fractional k, give the same LOF as refitting
+    '''
+    rs = np.random.RandomState(3)
+    X = rs.rand(400, 3)
+    ilof = IncrementalLOF(k=6, buffer_size=7).fit(X[:100])
+    for start in range(100, 400, 25):
+        ilof.insert(X[start:start+25])
+        ilof.delete(np.arange(start - 100, start - 90))
+    
+    ids = ilof.ids
+    assert_array_almost_equal(ilof.predict(), LOF(k=6).fit(X[ids]).predict(X[ids]))
+    Y = rs.rand(20, 3)
+    assert_array_almost_equal(ilof.predict(Y), LOF(k=6).fit(X[ids]).predict(Y))
+    
+    X = X[:10]
+    assert_array_almost_equal(IncrementalLOF(k=0.5).fit(X).predict(),
+                              LOF(k=0.5).fit(X).predict(X))
@@ -57,4 +57,35 @@ def test_kpca_ring_line_square():
     X = load_ring_line_square()
     recerr = KPCA(sigma=0.1, n_eigval=2).fit(X).predict(X)
     matlab_recerr = np.loadtxt(os.path.join(HERE, 'ring-line-square.out'))
-    assert_almost_equal(recerr, matlab_recerr, decimal=4)
\ No newline at end of file
+    assert_almost_equal(recerr, matlab_recerr, decimal=4)
+
+def test_kpca_chunks():
+    '''
+    Test that KPCA scores the same in chunks, into a preallocated output
+    '''
+    X = load_square().X
+    matlab_recerr = np.loadtxt(os.path.join(HERE, 'square.out'))
+    clf = KPCA(sigma=0.1, n_eigval=2, chunk_size=37).fit(X)
+    out = np.empty(X.shape[0])
+    assert clf.predict(X, out=out) is out
+    assert_almost_equal(out, matlab_recerr, decimal=4)
+
+
+def test_kpca_eigen_solvers():
+    '''
+    Test the partial eigensolvers and Nystroem KPCA against the dense fit
+    '''
+    rs = np.random.RandomState(0)
+    X = rs.randn(300, 3)
+    recerr = KPCA(sigma=1., n_eigval=5).fit(X).predict(X)
+
+    for params in [dict(eigen_solver='arpack'),
+                   dict(eigen_solver='randomized', random_state=0),
+                   dict(n_landmarks=300, chunk_size=70, random_state=0)]:
+        clf = KPCA(sigma=1., n_eigval=5, **params).fit(X)
+        assert_almost_equal(clf.predict(X), recerr, decimal=6)
+
+    # With fewer landmarks, the scores are close to the exact ones
+    clf = KPCA(sigma=1., n_eigval=5, n_landmarks=60, random_state=0).fit(X)
+    assert np.corrcoef(clf.predict(X), recerr)[0, 1] > 0.99
+    assert clf.data is None
@@ -0,0 +1,32 @@
+import numpy as np
+
+from scipy.stats import ks_2samp
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_greater
+
+from .. import KSE
+from ..kse import ks_statistics
+
+
+def test_ks_statistics():
+    rs = np.random.RandomState(0)
+
+    # With ties, and with samples of a single value
+    for shape in [(30, 9), (30, 1)]:
+        reference = rs.randint(0, 5, size=7).astype(float)
+        samples = rs.randint(0, 5, size=shape).astype(float)
+        assert_array_almost_equal(
+            ks_statistics(reference, samples),
+            [ks_2samp(reference, row)[0] for row in samples])
+
+
+def test_kse_n_jobs():
+    rs = np.random.RandomState(0)
+    X = np.vstack((rs.randn(100, 2), [[6, 6]]))
+
+    scores = KSE(random_state=0).fit(X).predict(X)
+    assert_greater(scores[-1], scores[:-1].max())
+
+    for n_jobs, chunk_size in [(1, 7), (2, 30)]:
+        clf = KSE(random_state=0, n_jobs=n_jobs, chunk_size=chunk_size)
+        assert_array_almost_equal(clf.fit(X).predict(X), scores)
@@ -0,0 +1,57 @@
+import numpy as np
+
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_array_equal
+from sklearn.utils.testing import assert_greater
+
+from ..loci import LOCI, aLOCI, _rowwise_searchsorted
+
+def _loci_loop(X, n_max, alpha):
+    # The point by point LOCI the vectorized one replaced
+    distances, indices = NearestNeighbors(n_neighbors=n_max).fit(X).kneighbors(X)
+    k_sigma = np.empty(X.shape[0])
+    for i in xrange(X.shape[0]):
+        max_zscore_mdef = -np.inf
+        for j in range(distances.shape[1]):
+            r = distances[i, j]
+            neighborhood_n = (distances[indices[i, :(j+1)]] <= alpha*r).sum(axis=1)
+            n = neighborhood_n[0]
+            n_hat = np.mean(neighborhood_n)
+            mdef = (n_hat - n) / n_hat
+            if mdef < 1e-16:
+                zscore_mdef = 0.0
+            else:
+                zscore_mdef = mdef / (np.std(neighborhood_n) / n_hat)
+            max_zscore_mdef = max(max_zscore_mdef, zscore_mdef)
+        k_sigma[i] = max_zscore_mdef
+    return k_sigma
+
+def test_rowwise_searchsorted():
+    rs = np.random.RandomState(0)
+    a = np.sort(rs.randint(0, 10, (20, 8)), axis=1).astype(float)
+    v = rs.randint(-1, 11, (20, 5)).astype(float)
+    expected = [np.searchsorted(a[i], v[i], side='right') for i in range(20)]
+    assert_array_equal(_rowwise_searchsorted(a, v), expected)
+
+def test_loci():
+    '''
+    Test that the batched LOCI gives the scores of the point by point LOCI
+    '''
+    rs = np.random.RandomState(0)
+    X = np.vstack((rs.randn(150, 2), np.repeat(rs.randn(5, 2), 2, axis=0)))
+    
+    expected = _loci_loop(X, 20, 0.5)
+    assert_array_almost_equal(LOCI(n_max=20).predict(X), expected)
+    assert_array_almost_equal(LOCI(n_max=20, batch_size=50).predict(X),
+                              expected)
+
+def test_aloci():
+    '''
+    Test that aLOCI flags an isolated point
+    '''
+    rs = np.random.RandomState(0)
+    X = np.vstack((rs.randn(500, 2), [[6, 6]]))
+    
+    k_sigma = aLOCI(random_state=0).predict(X)
+    assert_greater(k_sigma[-1], np.percentile(k_sigma, 95))
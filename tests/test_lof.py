@@ -8,9 +8,29 @@ from sklearn.utils.testing import assert_array_almost_equal
 from sklearn.utils.testing import assert_equal
 from sklearn.utils.testing import assert_raises
 from sklearn.utils.testing import assert_greater
+from sklearn.neighbors import NearestNeighbors
 
 from ..neighborhood import LOF
 
+
+def _lof_loop(X, k):
+    # Reference LOF of the rows of X, one row at a time, with the baseline
+    # formulation and no code shared with LOF
+    distances, indices = NearestNeighbors(n_neighbors=k+1).fit(X).kneighbors(X)
+    distances, indices = distances[:, 1:], indices[:, 1:]
+    k_dists = distances[:, -1]
+    
+    n = X.shape[0]
+    lrd = np.zeros(n)
+    for i in range(n):
+        dists = np.sqrt(np.sum((X[i] - X[indices[i]])**2, axis=1))
+        lrd[i] = k / np.sum(np.maximum(dists, k_dists[indices[i]]))
+    
+    lof = np.zeros(n)
+    for i in range(n):
+        lof[i] = np.sum(lrd[indices[i]]) / lrd[i] / k
+    return lof
+
 def test_lof():
     '''
     Test LOF with a simple toy dataset.
@@ -103,4 +123,26 @@ def test_lof_range_predict_with_more_complex_range():
     lof_over_range = LOF().range_predict(X, k_range=range(5, 50, 3))
     for j, k in enumerate(range(5, 50, 3)):
         lof = LOF(k=k).fit().predict(X)
-        assert_array_equal(lof_over_range[:, j], lof)
\ No newline at end of file
+        assert_array_equal(lof_over_range[:, j], lof)
+
+def test_lof_range_predict_reference():
+    '''
+    Test LOF's k range_predict against an independent loop for every k
+    '''
+    X = np.random.RandomState(1).rand(150, 4)
+    k_range = [1, 2, 5, 9, 20]
+    lof_over_range = LOF().range_predict(X, k_range=k_range)
+    for j, k in enumerate(k_range):
+        assert_array_almost_equal(lof_over_range[:, j], _lof_loop(X, k))
+
+    assert_raises(ValueError, LOF().range_predict, None, k_range)
+
+
+def test_lof_batch_size():
+    '''
+    Test that LOF does not depend on the batch size used
+    '''
+    X = np.random.RandomState(0).rand(200, 3)
+    lof = LOF(k=10).fit().predict(X)
+    for batch_size in [1, 7, 199, 200, 1000]:
+        assert_array_almost_equal(LOF(k=10, batch_size=batch_size).fit().predict(X), lof)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from scipy.special import erf
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_greater
+
+from ..neighborhood import LoOP
+
+def test_loop():
+    '''
+    Test LoOP against a direct computation
+    '''
+    X = np.random.RandomState(0).rand(100, 2)
+    k = 5
+    distances, indices = NearestNeighbors(n_neighbors=k+1).fit(X).kneighbors(X)
+    distances, indices = distances[:, 1:], indices[:, 1:]
+    
+    prob_dist = np.sqrt((distances**2).mean(axis=1))
+    plof = np.array([prob_dist[i] / prob_dist[indices[i]].mean() - 1. for i in range(100)])
+    nplof = 3. * np.sqrt(np.mean(plof**2))
+    expected = erf(plof / nplof / np.sqrt(2)).clip(0)
+    
+    assert_array_almost_equal(LoOP(k=k).fit().predict(X), expected)
+    assert_array_almost_equal(LoOP(k=k).fit(X).predict(), expected)
+
+def test_loop_novelty():
+    '''
+    Test scoring new data against a fitted reference set
+    '''
+    rs = np.random.RandomState(0)
+    X = rs.rand(200, 2)
+    loop = LoOP(k=10).fit(X)
+    
+    # Copies of the reference samples score the same as the samples
+    assert_array_almost_equal(loop.predict(X[:20].copy()), loop.predict()[:20])
+    
+    scores = loop.predict(np.array([[0.5, 0.5], [5., 5.]]))
+    assert_greater(scores[1], 0.9)
+    assert_greater(scores[1], scores[0])
@@ -0,0 +1,69 @@
+import numpy as np
+
+from sklearn.utils.testing import assert_array_equal
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_raises
+
+from ..neighborhood import NeighborhoodGraph, WeightedNeighborhoodGraph
+from ..neighborhood import KNN, LOF, COF, LoOP
+
+def test_shared_graph():
+    '''
+    Test that detectors fitted with a shared graph give the same scores as
+    detectors fitted on the data directly.
+    '''
+    X = np.random.RandomState(0).rand(100, 3)
+    graph = NeighborhoodGraph(k_max=10).fit(X)
+    
+    for detector in [KNN(k=3), LOF(k=7), COF(k=5), LoOP(k=10)]:
+        assert_array_almost_equal(detector.fit(graph=graph).predict(),
+                                  detector.fit(X).predict(X))
+        assert_array_almost_equal(detector.fit(graph=graph).predict(X),
+                                  detector.fit(X).predict(X))
+
+def test_graph_kneighbors():
+    '''
+    Test that the precomputed neighborhoods exclude the samples themselves
+    and can be sliced to a smaller k.
+    '''
+    X = np.random.RandomState(0).rand(50, 2)
+    graph = NeighborhoodGraph(k_max=5).fit(X)
+    
+    distances, indices = graph.kneighbors()
+    assert_array_equal(distances.shape, (50, 5))
+    assert np.all(indices != np.arange(50)[:, None])
+    
+    distances_3, indices_3 = graph.kneighbors(n_neighbors=3)
+    assert_array_equal(distances_3, distances[:, :3])
+    assert_array_equal(indices_3, indices[:, :3])
+    
+    assert_raises(ValueError, graph.kneighbors, None, 6)
+    assert_raises(ValueError, LOF(k=6).fit, None, None, graph)
+
+def test_collapse_duplicates():
+    '''
+    Test that collapsing duplicated rows to weighted unique rows gives the
+    scores of the uncollapsed data.
+    '''
+    rs = np.random.RandomState(0)
+    X_unique = rs.rand(60, 3)
+    X = X_unique[rs.permutation(np.arange(90) % 60)]
+    Y = np.vstack((rs.rand(20, 3), X[:5]))
+    
+    graph = WeightedNeighborhoodGraph(k_max=7).fit(X)
+    assert_array_equal(graph.X_unique[graph.inverse], X)
+    _, _, weights = graph.kneighbors()
+    assert_array_equal(weights.sum(axis=1), 7)
+    
+    for detector in [KNN(k=3), LOF(k=7), COF(k=5), LoOP(k=6)]:
+        expected = detector.fit(X).predict()
+        expected_new = detector.predict(Y)
+        
+        detector.set_params(collapse_duplicates=True).fit(X)
+        assert_array_almost_equal(detector.predict(), expected)
+        assert_array_almost_equal(detector.predict(Y), expected_new)
+        assert_array_almost_equal(detector.fit(graph=graph).predict(), expected)
+    
+    lof = LOF(collapse_duplicates=True).fit(X)
+    assert_array_almost_equal(lof.range_predict(X, [3, 5]),
+                              LOF().fit(X).range_predict(X, [3, 5]))
@@ -0,0 +1,58 @@
+import numpy as np
+
+from sklearn.utils.testing import assert_array_almost_equal
+from sklearn.utils.testing import assert_raises
+
+from .. import OversamplingPCA
+from ..oversampling_pca import power_method
+
+
+def _oversampling_pca_loop(A, ratio):
+    # Reference implementation, forming the covariance of every point
+    n = A.shape[0]
+    A_m = A.mean(axis=0)
+    out_prod = A.T.dot(A) / n
+    _, u = power_method(out_prod - A_m[:, None] * A_m)
+
+    similarities = np.zeros(n)
+    for i in range(n):
+        temp_mu = (A_m + ratio * A[i, :]) / (1 + ratio)
+        temp_cov = ((out_prod + ratio * A[i, :, None] * A[i, :]) / (1 + ratio) -
+                    temp_mu[:, None] * temp_mu)
+        _, u_temp = power_method(temp_cov, x=u)
+        similarities[i] = np.abs(u.dot(u_temp))
+    return 1. - similarities
+
+
+def test_oversampling_pca_solvers():
+    rs = np.random.RandomState(0)
+    A = np.vstack((rs.randn(100, 4).dot(np.diag([4., 2., 1., 0.5])),
+                   rs.uniform(-8, 8, size=(5, 4))))
+
+    expected = _oversampling_pca_loop(A, 0.1)
+    for solver in ('rank_one', 'power'):
+        scores = OversamplingPCA(0.1, solver=solver).fit(A).predict(A)
+        assert_array_almost_equal(scores, expected, decimal=6)
+
+    assert_raises(ValueError, OversamplingPCA(0.1, solver='qr').fit(A).predict, A)
+
+
+def test_partial_fit():
+    rs = np.random.RandomState(0)
+    A = rs.randn(300, 4).dot(np.diag([4., 2., 1., 0.5]))
+
+    for solver in ('rank_one', 'power'):
+        expected = OversamplingPCA(0.1, solver=solver).fit(A).predict(A)
+        clf = OversamplingPCA(0.1, solver=solver)
+        for batch in np.array_split(A, 5):
+            clf.partial_fit(batch)
+        assert_array_almost_equal(clf.predict(A), expected, decimal=6)
+
+    # With forgetting, the dominant direction follows a drift from the
+    # first to the second feature
+    clf = OversamplingPCA(0.1, forgetting_factor=0.5)
+    for scale in [[5., 1.]] * 5 + [[1., 5.]] * 5:
+        clf.partial_fit(rs.randn(100, 2) * scale)
+    assert np.abs(clf._dominant_eigenvector()[1]) > 0.99
+
+    assert_raises(ValueError, OversamplingPCA(0.1, forgetting_factor=0.).fit, A)
@@ -9,7 +9,7 @@ from sklearn.utils.testing import assert_equal
 from sklearn.utils.testing import assert_raises
 from sklearn.utils.testing import assert_greater
 
-from ..pca import PrincipalComponentReconstructionError
+from ..pca import PrincipalComponentReconstructionError, pca_reconstruction_error
 
 def test_principle_component_reconstruction_error():
     '''
@@ -21,4 +21,40 @@ def test_principle_component_reconstruction_error():
     
     pca_re = PrincipalComponentReconstructionError(n_components=2)
     
-    pca_re.fit(A).predict(A+noise)
\ No newline at end of file
+    pca_re.fit(A).predict(A+noise)
+
+
+def test_partial_fit():
+    '''
+    Test that streaming the data through partial_fit gives the scores of
+    the batch fit.
+    '''
+    rs = np.random.RandomState(0)
+    X = rs.randn(300, 5).dot(rs.randn(5, 5)) + 3
+
+    for sum_top in (False, True):
+        expected = pca_reconstruction_error(X, 2, sum_top)
+
+        clf = PrincipalComponentReconstructionError(2, sum_top)
+        assert_array_almost_equal(clf.fit(X).predict(X), expected)
+
+        clf = PrincipalComponentReconstructionError(2, sum_top)
+        for batch in np.array_split(X, 7):
+            clf.partial_fit(batch)
+        assert_array_almost_equal(clf.predict(X), expected)
+
+        clf = PrincipalComponentReconstructionError(2, sum_top, chunk_size=40)
+        assert_array_almost_equal(clf.fit(X).predict(X), expected)
+
+        # partial_fit after fit adds to the fitted samples, of which only
+        # the top components are kept with sum_top
+        clf = PrincipalComponentReconstructionError(2, sum_top)
+        clf.fit(X[:250]).partial_fit(X[250:])
+        assert_equal(clf.n_samples_seen_, 300)
+        assert_array_almost_equal(clf.predict(X), expected,
+                                  decimal=1 if sum_top else 6)
+
+    clf = PrincipalComponentReconstructionError(2, True, svd_solver='randomized',
+                                                random_state=0)
+    assert_array_almost_equal(clf.fit(X).predict(X),
+                              pca_reconstruction_error(X, 2, True))